@@ -1,5 +1,10 @@
 from .mover_stubs import ShootingStub
 from .simulation_stubs import ShootingPseudoSimulator
 from .one_way_tps_converters import (
-    TPSConverterOptions, OneWayTPSConverter, GromacsOneWayTPSConverter
+    TPSConverterOptions, TrimmedTrial, OneWayTPSConverter,
+    GromacsOneWayTPSConverter
 )
+from .state_cache import StateIndicatorCache
+from .merge import merge_storages
+from .cv_snapshots import CVSnapshots
+from .external_frames import ExternalFrames
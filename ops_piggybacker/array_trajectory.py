@@ -0,0 +1,249 @@
+"""
+Array-backed trajectories for the converter pipeline
+
+Trimming a trial involves slicing the file's trajectory several times, and
+sometimes reversing it. With an ``openpathsampling.Trajectory``, each of
+those builds a new list of snapshots, and every frame in the file must be
+made into an OPS snapshot before we know whether it is kept. An
+:class:`.ArrayTrajectory` keeps the frames of a file as NumPy arrays.
+Slicing and reversing give views of the same arrays. OPS snapshots are only
+made (by :meth:`.ArrayTrajectory.to_trajectory`) for the frames that end up
+in storage.
+
+An :class:`.ArrayTrajectory` can also hold only some of the atoms (see
+``atom_indices``), which is enough to find where to trim the trajectory.
+
+MDTraj and the OpenMM engine are only imported when they are used. OPS
+itself treats them as optional, so this module (and ``ops_piggybacker``)
+can be imported without them.
+"""
+
+import numpy as np
+import openpathsampling as paths
+
+
+def _as_slice(index):
+    # a contiguous range of frames (in either direction) can be a view
+    index = np.asarray(index)
+    if index.ndim != 1 or len(index) == 0 or index.dtype.kind not in 'iu':
+        return index
+    first, last = int(index[0]), int(index[-1])
+    step = 1 if last >= first else -1
+    if first < 0 or last < 0 or len(index) != abs(last - first) + 1:
+        return index
+    if not np.array_equal(index, np.arange(first, last + step, step)):
+        return index
+    stop = last + step
+    if stop < 0:
+        stop = None
+    return slice(first, stop, step)
+
+
+class ArrayTrajectory(object):
+    """Trajectory stored as coordinate, box vector, and velocity arrays.
+
+    Indexing with a slice (or with an array of frame indices that is a
+    contiguous range) gives an :class:`.ArrayTrajectory` that is a view of
+    the same arrays. Other index arrays copy the selected frames. Indexing
+    with an integer makes a new OPS snapshot for that frame.
+
+    Parameters
+    ----------
+    coordinates : numpy.ndarray
+        coordinates in nm, shape ``(n_frames, n_atoms, 3)``
+    box_vectors : numpy.ndarray or None
+        box vectors in nm, shape ``(n_frames, 3, 3)``; None if there is no
+        periodic box
+    velocities : numpy.ndarray or None
+        velocities in nm/ps, with the same shape as ``coordinates``; None
+        if the velocities are zero (as for XTC files)
+    engine : openpathsampling.engines.DynamicsEngine
+        engine (snapshot descriptor) for the snapshots that are made
+    velocities_reversed : bool
+        whether the snapshots for these frames are the time-reversed
+        (velocity-reversed) versions of the snapshots in the file
+    atom_indices : numpy.ndarray of int or None
+        sorted indices (in the full system) of the atoms in the arrays;
+        None (default) if the arrays have all atoms. Snapshots can't be made
+        for a subset of the atoms.
+    topology : mdtraj.Topology or None
+        topology for the atoms in the arrays, used by :meth:`.to_mdtraj`
+    """
+    def __init__(self, coordinates, box_vectors, velocities, engine,
+                 velocities_reversed=False, atom_indices=None,
+                 topology=None):
+        self.coordinates = coordinates
+        self.box_vectors = box_vectors
+        self.velocities = velocities
+        self.engine = engine
+        self.velocities_reversed = velocities_reversed
+        self.atom_indices = atom_indices
+        self.topology = topology
+
+    @classmethod
+    def from_mdtraj(cls, trajectory, engine, atom_indices=None):
+        """Wrap an MDTraj trajectory, without copying its arrays.
+
+        Parameters
+        ----------
+        trajectory : mdtraj.Trajectory
+            the trajectory
+        engine : openpathsampling.engines.DynamicsEngine
+            engine for the snapshots
+        atom_indices : numpy.ndarray of int or None
+            if ``trajectory`` has only some of the atoms, their indices in
+            the full system
+
+        Returns
+        -------
+        :class:`.ArrayTrajectory`
+            trajectory backed by the arrays of ``trajectory``
+        """
+        return cls(coordinates=trajectory.xyz,
+                   box_vectors=trajectory.unitcell_vectors,
+                   velocities=None,
+                   engine=engine,
+                   atom_indices=atom_indices,
+                   topology=trajectory.topology)
+
+    @classmethod
+    def concatenate(cls, trajectories):
+        """Join array trajectories (copies the arrays).
+
+        Parameters
+        ----------
+        trajectories : list of :class:`.ArrayTrajectory`
+            the trajectories, in order; they must have the same atoms
+
+        Returns
+        -------
+        :class:`.ArrayTrajectory`
+            trajectory with the frames of all of them
+        """
+        first = trajectories[0]
+        if len(trajectories) == 1:
+            return first
+
+        def join(arrays):
+            if arrays[0] is None:
+                return None
+            return np.concatenate(arrays)
+
+        return cls(
+            coordinates=join([traj.coordinates for traj in trajectories]),
+            box_vectors=join([traj.box_vectors for traj in trajectories]),
+            velocities=join([traj.velocities for traj in trajectories]),
+            engine=first.engine,
+            velocities_reversed=first.velocities_reversed,
+            atom_indices=first.atom_indices,
+            topology=first.topology
+        )
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.snapshot(index)
+        if not isinstance(index, slice):
+            index = _as_slice(index)
+        return ArrayTrajectory(
+            coordinates=self.coordinates[index],
+            box_vectors=(self.box_vectors[index]
+                         if self.box_vectors is not None else None),
+            velocities=(self.velocities[index]
+                        if self.velocities is not None else None),
+            engine=self.engine,
+            velocities_reversed=self.velocities_reversed,
+            atom_indices=self.atom_indices,
+            topology=self.topology
+        )
+
+    @property
+    def reversed(self):
+        """Time-reversed trajectory (a view), as for OPS trajectories"""
+        reverse = self[::-1]
+        reverse.velocities_reversed = not self.velocities_reversed
+        return reverse
+
+    def to_mdtraj(self, topology=None):
+        """MDTraj trajectory of these frames.
+
+        Parameters
+        ----------
+        topology : mdtraj.Topology or None
+            topology for the trajectory; default (None) uses ``topology``
+
+        Returns
+        -------
+        mdtraj.Trajectory
+            the trajectory (coordinates are not copied if they are already
+            single-precision)
+        """
+        import mdtraj as md
+        if topology is None:
+            topology = self.topology
+        trajectory = md.Trajectory(self.coordinates, topology)
+        if self.box_vectors is not None:
+            trajectory.unitcell_vectors = self.box_vectors
+        return trajectory
+
+    def _make_snapshot(self, coordinates, box_vectors, velocities):
+        from openpathsampling.engines.openmm import Snapshot
+        from openpathsampling.integration_tools import unit
+        u_nm = unit.nanometer
+        if box_vectors is not None:
+            box_vectors = unit.Quantity(box_vectors, u_nm)
+        statics = Snapshot.StaticContainer(
+            coordinates=unit.Quantity(coordinates, u_nm),
+            box_vectors=box_vectors,
+            engine=self.engine
+        )
+        kinetics = Snapshot.KineticContainer(velocities=velocities,
+                                             engine=self.engine)
+        snapshot = Snapshot(statics=statics, kinetics=kinetics,
+                            engine=self.engine)
+        if self.velocities_reversed:
+            snapshot = snapshot.reversed
+        return snapshot
+
+    def snapshot(self, index):
+        """Make the OPS snapshot for one frame"""
+        return self[index:index + 1 or None].to_trajectory()[0]
+
+    def to_trajectory(self):
+        """Make the OPS trajectory for these frames.
+
+        The arrays are copied (once, for all frames), so that the snapshots
+        don't keep the arrays for the whole file in memory.
+
+        Returns
+        -------
+        openpathsampling.Trajectory
+            trajectory with a new snapshot for each frame
+        """
+        if self.atom_indices is not None:
+            raise RuntimeError("Can't make snapshots from the coordinates "
+                               + "of a subset of the atoms")
+        from openpathsampling.integration_tools import unit
+        vel_unit = unit.nanometer / unit.picosecond
+        coordinates = np.array(self.coordinates)
+        if self.box_vectors is not None:
+            box_vectors = np.array(self.box_vectors)
+        else:
+            box_vectors = [None] * len(self)
+        if self.velocities is not None:
+            velocities = unit.Quantity(np.array(self.velocities), vel_unit)
+        else:
+            # frames without velocities share one zero-velocity array
+            empty_vel = unit.Quantity(np.zeros(coordinates.shape[1:]),
+                                      vel_unit)
+            velocities = [empty_vel] * len(self)
+
+        trajectory = paths.Trajectory()
+        for frame_num in range(len(self)):
+            trajectory.append(self._make_snapshot(
+                coordinates[frame_num], box_vectors[frame_num],
+                velocities[frame_num]
+            ))
+        return trajectory
@@ -0,0 +1,296 @@
+"""
+Coordinate-free (CV-only) conversion
+
+Many analyses of a TPS simulation (rate constants, path length
+distributions, shooting point analysis) only need a few collective
+variables for each frame, not the coordinates. With a
+:class:`.CVSnapshots` object, a converter stores snapshots that only have
+the values of the CVs the states depend on (and any other CVs that are
+registered), and where the frame came from: the trajectory file and the
+frame index in that file. For large systems, this makes the storage
+several orders of magnitude smaller.
+
+The snapshots are toy-engine snapshots with one "atom": its coordinates
+are the file number, the frame index, and then the CV values (stored in
+single precision). Each CV is replaced by a CV that reads its column (see
+:meth:`.CVSnapshots.column_cv`), and the states by the same volumes of the
+column CVs, so the network in the storage (:attr:`.CVSnapshots.network`)
+can be used for analysis as usual.
+
+The file names for the file numbers are kept in ``files``, and are also
+written to ``sources_file`` (one line per file, appended as files are
+used), since they can't be stored in the snapshots. Each line is the file
+name, followed by a tab and the SHA-1 hash of the file's contents, if
+checksums are recorded. With the sources file, an :class:`.ExternalFrames`
+object loads the coordinates of CV-only snapshots from the original files,
+when they are needed.
+"""
+
+import os
+
+import numpy as np
+import openpathsampling as paths
+from openpathsampling import volume as ops_volume
+
+from .array_trajectory import ArrayTrajectory
+from .mover_stubs import NoEngine
+from .state_cache import file_hash
+from .trimming import volume_cvs, trajectory_cv_values
+
+FILE_COLUMN = 0
+FRAME_COLUMN = 1
+_N_SOURCE_COLUMNS = 2
+# CV names are unique in a storage, which may also have the original CVs
+COLUMN_CV_SUFFIX = "_column"
+
+
+def _column_value(snapshot, column):
+    return snapshot.coordinates[0][column]
+
+
+def read_sources_file(sources_file):
+    """Trajectory files (and checksums) from a sources file.
+
+    Parameters
+    ----------
+    sources_file : str
+        the sources file
+
+    Returns
+    -------
+    list of (str, str or None)
+        the file name and content hash (None if not recorded) for each file
+        number
+    """
+    sources = []
+    with open(sources_file, 'r') as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            checksum = fields[1] if len(fields) > 1 else None
+            sources.append((fields[0], checksum))
+    return sources
+
+
+def source_indices(snapshot):
+    """The file number and frame index of a CV-only snapshot"""
+    coordinates = snapshot.coordinates[0]
+    return (int(round(coordinates[FILE_COLUMN])),
+            int(round(coordinates[FRAME_COLUMN])))
+
+
+class CVSnapshots(object):
+    """Make snapshots that only have CV values and their source frame.
+
+    Parameters
+    ----------
+    network : openpathsampling.TPSNetwork
+        the network for the simulation; the CVs its states depend on are
+        always stored
+    cvs : list of openpathsampling.CollectiveVariable or None
+        other CVs to store; each must give one number per frame
+    sources_file : str or None
+        file with the names of the trajectory files, one per line (in file
+        number order); names already in it are reused, so a conversion can
+        be continued. None keeps the names in memory only.
+    checksums : bool
+        whether to record the content hash of each trajectory file (the
+        whole file is read once, the first time it is used); this lets
+        :class:`.ExternalFrames` check that a file hasn't changed
+
+    Attributes
+    ----------
+    cvs : list of openpathsampling.CollectiveVariable
+        the stored CVs (the state CVs first), in column order
+    network : openpathsampling.TPSNetwork
+        the network with states defined by the column CVs; use this for
+        the converter's storage and for analysis
+    files : list of str
+        the trajectory file for each file number
+    file_checksums : list of str or None
+        the content hash of each file (None if not recorded)
+    engine : openpathsampling.engines.DynamicsEngine
+        the engine (snapshot descriptor) of the snapshots
+    """
+    def __init__(self, network, cvs=None, sources_file=None,
+                 checksums=True):
+        transition = network.sampling_transitions[0]
+        states = [transition.stateA, transition.stateB]
+        state_cvs = volume_cvs(paths.join_volumes(states))
+        if state_cvs is None:
+            raise ValueError("CV-only snapshots need states made of "
+                             + "CVDefinedVolumes")
+        self.cvs = []
+        for cv in state_cvs + list(cvs or []):
+            if not any(cv is known for known in self.cvs):
+                self.cvs.append(cv)
+
+        from openpathsampling.engines import toy
+        descriptor = paths.engines.SnapshotDescriptor.construct(
+            toy.Snapshot,
+            {'n_atoms': 1, 'n_spatial': _N_SOURCE_COLUMNS + len(self.cvs)}
+        )
+        self.engine = NoEngine(descriptor=descriptor)
+        self._snapshot_class = toy.Snapshot
+        self._column_cvs = [
+            paths.FunctionCV(cv.name + COLUMN_CV_SUFFIX, _column_value,
+                             cv_time_reversible=True,
+                             column=_N_SOURCE_COLUMNS + idx)
+            for (idx, cv) in enumerate(self.cvs)
+        ]
+        self.network = paths.TPSNetwork(self.volume(transition.stateA),
+                                        self.volume(transition.stateB))
+
+        self.sources_file = sources_file
+        self.checksums = checksums
+        self.files = []
+        self.file_checksums = []
+        self._file_numbers = {}
+        if sources_file is not None and os.path.isfile(sources_file):
+            for (file_name, checksum) in read_sources_file(sources_file):
+                self._add_file(file_name, checksum)
+
+    def _add_file(self, file_name, checksum):
+        self._file_numbers[file_name] = len(self.files)
+        self.files.append(file_name)
+        self.file_checksums.append(checksum)
+
+    def file_number(self, file_name):
+        """Number for a trajectory file (a new one if it isn't known)"""
+        if file_name not in self._file_numbers:
+            checksum = file_hash(file_name) if self.checksums else None
+            self._add_file(file_name, checksum)
+            if self.sources_file is not None:
+                line = file_name
+                if checksum is not None:
+                    line += "\t" + checksum
+                with open(self.sources_file, 'a') as f:
+                    f.write(line + "\n")
+        return self._file_numbers[file_name]
+
+    def column_cv(self, cv):
+        """The CV that reads the stored values of ``cv``.
+
+        Its name is the name of ``cv`` with ``COLUMN_CV_SUFFIX``
+        (``"_column"``) added, so both CVs can be in the same storage.
+        """
+        for (stored_cv, column_cv) in zip(self.cvs, self._column_cvs):
+            if stored_cv is cv:
+                return column_cv
+        raise KeyError("CV " + str(cv.name) + " is not stored")
+
+    def volume(self, volume):
+        """The same volume, defined by the column CVs.
+
+        Parameters
+        ----------
+        volume : openpathsampling.Volume
+            a volume of the stored CVs, made of ``CVDefinedVolume`` objects
+
+        Returns
+        -------
+        openpathsampling.Volume
+            the volume for CV-only snapshots (with the same name)
+        """
+        vol_type = type(volume)
+        if vol_type is paths.CVDefinedVolume:
+            mapped = paths.CVDefinedVolume(
+                self.column_cv(volume.collectivevariable),
+                volume.lambda_min, volume.lambda_max
+            )
+        elif vol_type in [paths.UnionVolume, paths.IntersectionVolume,
+                          ops_volume.SymmetricDifferenceVolume,
+                          ops_volume.RelativeComplementVolume]:
+            mapped = vol_type(self.volume(volume.volume1),
+                              self.volume(volume.volume2))
+        elif vol_type is ops_volume.NegatedVolume:
+            mapped = vol_type(self.volume(volume.volume))
+        elif vol_type in [paths.EmptyVolume, paths.FullVolume]:
+            return volume
+        else:
+            raise ValueError("Can't make a CV-only version of "
+                             + vol_type.__name__)
+        if volume.is_named:
+            mapped = mapped.named(volume.name)
+        return mapped
+
+    def values(self, trajectory):
+        """Values of the stored CVs for each frame of a trajectory.
+
+        Parameters
+        ----------
+        trajectory : openpathsampling.Trajectory or :class:`.ArrayTrajectory`
+            the frames
+
+        Returns
+        -------
+        numpy.ndarray
+            shape ``(n_frames, n_cvs)``
+        """
+        values = np.zeros((len(trajectory), len(self.cvs)))
+        for (idx, cv) in enumerate(self.cvs):
+            values[:, idx] = trajectory_cv_values(cv, trajectory)
+        return values
+
+    def trajectory(self, file_name, frames, trajectory):
+        """CV-only trajectory for frames of a trajectory file.
+
+        Parameters
+        ----------
+        file_name : str
+            the trajectory file
+        frames : array-like of int
+            the index in the file of each frame of ``trajectory``
+        trajectory : openpathsampling.Trajectory or :class:`.ArrayTrajectory`
+            the frames (these may have only some of the atoms, if the CVs
+            can be evaluated for them)
+
+        Returns
+        -------
+        openpathsampling.Trajectory
+            trajectory of CV-only snapshots
+        """
+        n_frames = len(trajectory)
+        columns = np.zeros((n_frames, _N_SOURCE_COLUMNS + len(self.cvs)))
+        columns[:, FILE_COLUMN] = self.file_number(file_name)
+        columns[:, FRAME_COLUMN] = np.asarray(frames)
+        columns[:, _N_SOURCE_COLUMNS:] = self.values(trajectory)
+        velocities = np.zeros((1, columns.shape[1]))
+        return paths.Trajectory([
+            self._snapshot_class(coordinates=columns[idx:idx + 1],
+                                 velocities=velocities,
+                                 engine=self.engine)
+            for idx in range(n_frames)
+        ])
+
+    def trial_trajectory(self, trial, trajectory, offset=0):
+        """CV-only trajectory for a trimmed trial.
+
+        Parameters
+        ----------
+        trial : :class:`.TrimmedTrial`
+            the trimmed trial
+        trajectory : openpathsampling.Trajectory or :class:`.ArrayTrajectory`
+            the frames it was trimmed from, or a part of them
+        offset : int
+            file frame index of the first frame of ``trajectory``
+
+        Returns
+        -------
+        openpathsampling.Trajectory
+            the one-way trial trajectory, as CV-only snapshots
+        """
+        frames = np.asarray(trial.frames, dtype=int)
+        if len(frames) == 0:
+            return paths.Trajectory([])
+        if isinstance(trajectory, ArrayTrajectory):
+            selected = trajectory[frames - offset]
+        else:
+            selected = paths.Trajectory([trajectory[int(frame)]
+                                         for frame in frames - offset])
+        # the CVs are the same for the time-reversed frames
+        return self.trajectory(trial.file_name, frames, selected)
+
+    def source(self, snapshot):
+        """The trajectory file and frame index of a CV-only snapshot"""
+        (file_number, frame) = source_indices(snapshot)
+        return (self.files[file_number], frame)
@@ -0,0 +1,175 @@
+"""
+Coordinates for CV-only snapshots, from the original trajectory files
+
+The CV-only snapshots of a coordinate-free conversion (see
+:class:`.CVSnapshots`) only refer to their frame in the original trajectory
+files. :class:`.ExternalFrames` loads the coordinates for those references
+when an analysis needs them, so the storage itself stays small (and the
+conversion writes almost nothing but CV values).
+
+The coordinates are **not** filled in automatically. Loading a step,
+sample, trajectory, or snapshot from the storage gives CV-only snapshots,
+whose ``snapshot.coordinates`` is the one-"atom" row of file number, frame
+index, and CV values (see :mod:`ops_piggybacker.cv_snapshots`), not the
+atom positions. To get the atom positions, call an :class:`.ExternalFrames`
+explicitly; it returns new objects with the coordinates::
+
+    frames = ExternalFrames("sources.txt", "topology.gro")
+    traj = frames.trajectory(step.active[0].trajectory)  # with coordinates
+    snap = frames.snapshot(cv_only_snapshot)
+    md_traj = frames.mdtraj(step.active[0].trajectory)
+
+Here ``"sources.txt"`` is the ``sources_file`` given to the
+:class:`.CVSnapshots` of the conversion.
+
+Frames are read in chunks of ``chunk_size`` consecutive frames (with the
+:class:`.FrameOffsetIndex` for XTC and TRR files, so a chunk is read without
+reading the rest of the file), and the last ``cache_size`` chunks are kept
+in a least-recently-used cache, so loading the frames of a path (which are
+mostly consecutive frames of a few files) reads each chunk only once. If
+checksums were recorded, each file is checked against its checksum the
+first time it is used.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+from .array_trajectory import ArrayTrajectory
+from .cv_snapshots import read_sources_file, source_indices
+from .frame_index import FrameOffsetIndex
+from .state_cache import file_hash
+
+
+class ExternalFrames(object):
+    """Load the coordinates of CV-only snapshots from the original files.
+
+    Parameters
+    ----------
+    sources : str or :class:`.CVSnapshots`
+        the sources file of the conversion, or the :class:`.CVSnapshots`
+        that made the snapshots
+    topology_file : str
+        topology (e.g., ``.gro`` or ``.pdb``) for the trajectory files
+    cache_size : int
+        number of chunks kept in memory
+    chunk_size : int
+        number of frames read at a time
+    frame_index_dir : str or None
+        directory to save the frame offsets of XTC and TRR files in (see
+        :class:`.FrameOffsetIndex`); None (default) keeps them in memory
+    verify : bool
+        whether to check the files against their recorded checksums
+
+    Attributes
+    ----------
+    files : list of str
+        the trajectory file for each file number
+    """
+    def __init__(self, sources, topology_file, cache_size=10,
+                 chunk_size=100, frame_index_dir=None, verify=True):
+        if isinstance(sources, str):
+            source_list = read_sources_file(sources)
+            self.files = [file_name for (file_name, _) in source_list]
+            self.file_checksums = [checksum for (_, checksum) in source_list]
+        else:
+            self.files = sources.files
+            self.file_checksums = sources.file_checksums
+        self.cache_size = cache_size
+        self.chunk_size = chunk_size
+        self.verify = verify
+        self.frame_index = FrameOffsetIndex(frame_index_dir)
+        import mdtraj as md
+        from openpathsampling.engines.openmm.tools import TopologyEngine
+        from openpathsampling.engines.topology import MDTrajTopology
+        self.mdtraj_topology = md.load_topology(topology_file)
+        self.engine = TopologyEngine(MDTrajTopology(self.mdtraj_topology))
+        self._chunks = OrderedDict()
+        self._verified = set()
+
+    def _check_file(self, file_number):
+        if not self.verify or file_number in self._verified:
+            return
+        checksum = self.file_checksums[file_number]
+        file_name = self.files[file_number]
+        if checksum is not None and file_hash(file_name) != checksum:
+            raise RuntimeError("Trajectory file " + file_name
+                               + " has changed since it was converted")
+        self._verified.add(file_number)
+
+    def _read_chunk(self, file_name, start):
+        import mdtraj as md
+        stop = start + self.chunk_size
+        if self.frame_index.can_index(file_name):
+            # XTC and TRR both give (xyz, time, step, box, ...)
+            data = self.frame_index.read(file_name, start, stop)
+            return data[0], data[3]
+        chunks = md.iterload(file_name, top=self.mdtraj_topology,
+                             chunk=self.chunk_size, skip=start)
+        trajectory = next(iter(chunks))
+        return trajectory.xyz, trajectory.unitcell_vectors
+
+    def _chunk(self, file_number, start):
+        key = (file_number, start)
+        if key in self._chunks:
+            self._chunks.move_to_end(key)
+        else:
+            self._check_file(file_number)
+            self._chunks[key] = self._read_chunk(self.files[file_number],
+                                                 start)
+            while len(self._chunks) > self.cache_size:
+                self._chunks.popitem(last=False)
+        return self._chunks[key]
+
+    def frames(self, trajectory):
+        """Coordinates for the frames of a CV-only trajectory.
+
+        Parameters
+        ----------
+        trajectory : openpathsampling.Trajectory
+            trajectory of CV-only snapshots (or a list of them)
+
+        Returns
+        -------
+        :class:`.ArrayTrajectory`
+            the frames, with all atoms (without velocities)
+        """
+        coordinates = []
+        box_vectors = []
+        for snapshot in trajectory:
+            (file_number, frame) = source_indices(snapshot)
+            start = frame - frame % self.chunk_size
+            (xyz, box) = self._chunk(file_number, start)
+            if frame - start >= len(xyz):
+                raise IndexError("Frame " + str(frame) + " is not in "
+                                 + self.files[file_number])
+            coordinates.append(xyz[frame - start])
+            box_vectors.append(box[frame - start] if box is not None
+                               else None)
+        if len(coordinates) == 0:
+            coordinates = np.zeros((0, self.mdtraj_topology.n_atoms, 3))
+        if any(box is None for box in box_vectors):
+            box_vectors = None
+        else:
+            box_vectors = np.array(box_vectors)
+        return ArrayTrajectory(coordinates=np.array(coordinates),
+                               box_vectors=box_vectors,
+                               velocities=None,
+                               engine=self.engine,
+                               topology=self.mdtraj_topology)
+
+    def trajectory(self, trajectory):
+        """OPS trajectory (with coordinates) for a CV-only trajectory"""
+        return self.frames(trajectory).to_trajectory()
+
+    def mdtraj(self, trajectory):
+        """MDTraj trajectory for a CV-only trajectory"""
+        return self.frames(trajectory).to_mdtraj()
+
+    def snapshot(self, snapshot):
+        """OPS snapshot (with coordinates) for a CV-only snapshot"""
+        return self.trajectory([snapshot])[0]
+
+    def clear(self):
+        """Empty the chunk cache"""
+        self._chunks.clear()
@@ -0,0 +1,234 @@
+"""
+Persistent frame-offset indices for XTC and TRR files
+
+XTC and TRR files have no index: to find where frame ``n`` starts, the
+reader has to walk through the headers of all the frames before it. MDTraj
+does this (for the whole file) the first time a file object needs its
+length or seeks. When the same trajectory files are converted several times
+(for example, with different :class:`.TPSConverterOptions`), that walk is
+repeated for every file, every time.
+
+A :class:`.FrameOffsetIndex` keeps the byte offset of each frame of each
+file on disk, keyed by the file's absolute path, size, and modification
+time. An index is only reused while the file is unchanged, so files that
+are still being written (see :meth:`.OneWayTPSConverter.follow`) are
+re-indexed as they grow. Indices are only saved on disk if a directory is
+given (for example, :func:`.default_frame_index_dir`); otherwise, they are
+kept in memory for the life of the index object.
+"""
+
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+
+def default_frame_index_dir():
+    """Default directory for frame-offset indices.
+
+    This is ``ops_piggybacker/frame_offsets`` in ``$XDG_CACHE_HOME``
+    (default ``~/.cache``).
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                os.path.join(os.path.expanduser('~'),
+                                             '.cache'))
+    return os.path.join(cache_home, 'ops_piggybacker', 'frame_offsets')
+
+
+class FrameOffsetIndex(object):
+    """Byte offsets of the frames of XTC/TRR files, saved between runs.
+
+    This is thread-safe, and several processes can share the same
+    directory (index files are written to a temporary file and renamed).
+
+    Parameters
+    ----------
+    cache_dir : str or None
+        directory for the index files; None keeps the indices in memory
+        only
+
+    Attributes
+    ----------
+    extensions : list of str
+        file extensions that can be indexed
+    """
+    extensions = ['.xtc', '.trr']
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self._indices = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # locks can't be pickled (e.g., to send the index to a worker)
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def can_index(self, file_name):
+        """Whether ``file_name`` is a format that can be indexed"""
+        extension = os.path.splitext(file_name)[1].lower()
+        return extension in self.extensions
+
+    @staticmethod
+    def _file_key(file_name):
+        stat = os.stat(file_name)
+        return (os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns)
+
+    def _index_file(self, path):
+        digest = hashlib.sha1(path.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + ".npz")
+
+    @staticmethod
+    def _compute_offsets(file_name):
+        import mdtraj as md
+        with md.open(file_name) as f:
+            return np.asarray(f.offsets, dtype=np.int64)
+
+    def _load(self, key):
+        index_file = self._index_file(key[0])
+        if not os.path.isfile(index_file):
+            return None
+        try:
+            with np.load(index_file) as saved:
+                if (str(saved['path']) == key[0]
+                        and int(saved['size']) == key[1]
+                        and int(saved['mtime_ns']) == key[2]):
+                    return saved['offsets']
+        except (IOError, OSError, ValueError, KeyError):
+            pass  # unreadable index; it is rebuilt
+        return None
+
+    def _save(self, key, offsets):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+        index_file = self._index_file(key[0])
+        tmp_file = (index_file + "." + str(os.getpid()) + "-"
+                    + str(threading.get_ident()) + ".tmp.npz")
+        np.savez(tmp_file, path=key[0], size=key[1], mtime_ns=key[2],
+                 offsets=offsets)
+        os.replace(tmp_file, index_file)
+
+    def offsets(self, file_name):
+        """Byte offset of each frame in a file.
+
+        The offsets are built (by reading the frame headers) the first time
+        a file is used, or when it has changed.
+
+        Parameters
+        ----------
+        file_name : str
+            the XTC or TRR file
+
+        Returns
+        -------
+        numpy.ndarray of int
+            the offset of each frame; the length is the number of frames
+        """
+        key = self._file_key(file_name)
+        offsets = None
+        with self._lock:
+            if key[0] in self._indices and self._indices[key[0]][0] == key:
+                offsets = self._indices[key[0]][1]
+        if offsets is None and self.cache_dir is not None:
+            offsets = self._load(key)
+        if offsets is None:
+            offsets = self._compute_offsets(file_name)
+            if self.cache_dir is not None:
+                self._save(key, offsets)
+        with self._lock:
+            self._indices[key[0]] = (key, offsets)
+        return offsets
+
+    def n_frames(self, file_name):
+        """Number of frames in a file (from its offsets)"""
+        return len(self.offsets(file_name))
+
+    def read(self, file_name, start, stop, atom_indices=None):
+        """Read frames ``start:stop`` of a file.
+
+        The saved offsets are given to the MDTraj file object, so it seeks
+        straight to frame ``start`` without walking through the frames
+        before it. (The length of the file object would need that walk,
+        so it isn't used; the number of frames comes from the offsets.)
+
+        Parameters
+        ----------
+        file_name : str
+            the XTC or TRR file
+        start : int
+            first frame
+        stop : int
+            frame after the last frame (clipped to the number of frames)
+        atom_indices : numpy.ndarray of int or None
+            atoms to read; None for all atoms
+
+        Returns
+        -------
+        tuple
+            as for MDTraj's ``read`` (for XTC and TRR, ``(xyz, time, step,
+            box, ...)``)
+        """
+        import mdtraj as md
+        offsets = self.offsets(file_name)
+        stop = min(stop, len(offsets))
+        if start >= stop:
+            raise IndexError("No frames " + str(start) + ":" + str(stop)
+                             + " in " + file_name)
+        with md.open(file_name) as f:
+            f.offsets = offsets
+            f.seek(start)
+            return f.read(n_frames=stop - start, atom_indices=atom_indices)
+
+
+def xdr_n_frames(file_name, frame_index=None):
+    """Number of frames in an XTC or TRR file.
+
+    Parameters
+    ----------
+    file_name : str
+        the file
+    frame_index : :class:`.FrameOffsetIndex` or None
+        index to use; None lets MDTraj find the frames
+    """
+    if frame_index is not None:
+        return frame_index.n_frames(file_name)
+    import mdtraj as md
+    with md.open(file_name) as f:
+        return len(f)
+
+
+def read_xdr_frames(file_name, start, stop, atom_indices=None,
+                    frame_index=None):
+    """Read frames ``start:stop`` of an XTC or TRR file.
+
+    Parameters
+    ----------
+    file_name : str
+        the file
+    start : int
+        first frame
+    stop : int
+        frame after the last frame
+    atom_indices : numpy.ndarray of int or None
+        atoms to read; None for all atoms
+    frame_index : :class:`.FrameOffsetIndex` or None
+        index to use (see :meth:`.FrameOffsetIndex.read`); None lets MDTraj
+        find the frames
+
+    Returns
+    -------
+    tuple
+        ``(xyz, time, step, box, ...)``
+    """
+    if frame_index is not None:
+        return frame_index.read(file_name, start, stop, atom_indices)
+    import mdtraj as md
+    with md.open(file_name) as f:
+        f.seek(start)
+        return f.read(n_frames=stop - start, atom_indices=atom_indices)
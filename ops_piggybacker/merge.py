@@ -0,0 +1,244 @@
+"""
+Merging storages from independent TPS chains
+
+Independent TPS chains (for example, several runs converted with separate
+:class:`.GromacsOneWayTPSConverter` objects) each give their own storage.
+:func:`.merge_storages` combines them into one storage, with each chain as
+its own replica, so that they can be analyzed together.
+
+Each input storage has its own move scheme and :class:`.ShootingStub` mimic
+mover. The merged storage has a single scheme and mimic mover (and the
+network of the first input), and the steps of each chain are remade with
+them. The snapshots are copied first, in chunks, with one sync per chunk;
+after that, saving the steps doesn't need to save any snapshots, since the
+trial trajectories keep the same snapshots. Placeholders for rejected
+trials (see the ``rejected_trials`` attribute of
+:class:`.ShootingPseudoSimulator`) keep their recorded trial lengths.
+"""
+
+import openpathsampling as paths
+from openpathsampling.tools import refresh_output
+
+from .mover_stubs import ShootingStub
+from .simulation_stubs import ShootingPseudoSimulator
+
+
+def _load_snapshot_pairs(snapshots, start, stop):
+    """Load the stored snapshots at positions ``start:stop`` of a store.
+
+    Each position holds a snapshot and its reversed copy. The store and
+    UUID of each position, and each variable of the snapshots, are read
+    with one (sliced) read per snapshot store; only snapshots that are
+    mentioned but not stored (which come from a fallback storage) are
+    loaded one at a time.
+    """
+    store_numbers = snapshots.variables['store'][start:stop]
+    uuids = snapshots.vars['uuid'][start:stop]
+    loaded = [None] * (stop - start)
+    for store_number in sorted(set(int(num) for num in store_numbers)):
+        positions = [pos for pos in range(start, stop)
+                     if store_numbers[pos - start] == store_number]
+        if store_number < 0:
+            for pos in positions:
+                loaded[pos - start] = snapshots.load(2 * pos)
+            continue
+        store = snapshots.store_snapshot_list[store_number]
+        local = [store.index[pos] for pos in positions]
+        (lo, hi) = (min(local), max(local) + 1)
+        attributes = list(dict.fromkeys(store.storables))
+        values = {attr: store.vars[attr][lo:hi] for attr in attributes}
+        cls = store.snapshot_class
+        for (pos, idx) in zip(positions, local):
+            snapshot = cls.__new__(cls)
+            cls.init_empty(snapshot)
+            for attr in attributes:
+                setattr(snapshot, attr, values[attr][idx - lo])
+            snapshot.__uuid__ = uuids[pos - start]
+            loaded[pos - start] = snapshot
+    return loaded
+
+
+def copy_snapshots(source, target, chunk_size=10000):
+    """Copy all snapshots from one storage to another.
+
+    The snapshots are copied in chunks of ``chunk_size`` stored snapshots
+    (a snapshot and its reversed copy are stored together, and count as
+    one). Each chunk is loaded with one read of each snapshot variable (for
+    example, all the coordinates of the chunk), then saved, then ``target``
+    is synced. Snapshots already in ``target`` are not saved again.
+
+    Parameters
+    ----------
+    source : openpathsampling.Storage
+        the storage to copy from
+    target : openpathsampling.Storage
+        the storage to copy to
+    chunk_size : int
+        number of stored snapshots in each chunk
+
+    Returns
+    -------
+    int
+        number of snapshots in ``source`` (including reversed copies)
+    """
+    snapshots = source.snapshots
+    n_stored = len(snapshots) // 2
+    for start in range(0, n_stored, chunk_size):
+        stop = min(start + chunk_size, n_stored)
+        for snapshot in _load_snapshot_pairs(snapshots, start, stop):
+            target.snapshots.save(snapshot)
+        target.sync_all()
+    return len(snapshots)
+
+
+def shooting_step_info(step):
+    """Input for :meth:`.ShootingPseudoSimulator.run` to remake a step.
+
+    Parameters
+    ----------
+    step : openpathsampling.MCStep
+        a step made by a :class:`.ShootingPseudoSimulator`
+
+    Returns
+    -------
+    tuple
+        ``(replica, trial_trajectory, shooting_point_index, accepted,
+        direction, n_segment)``, where ``trial_trajectory`` is the full
+        (joined) trial trajectory, and ``n_segment`` is the number of frames
+        generated by the trial if the stored trajectory is a placeholder
+        (see :func:`.trial_length`), or None
+    """
+    choice_change = step.change.subchange
+    inner = choice_change.subchange
+    details = inner.details
+    initial_trajectory = details.initial_trajectory
+    shooting_index = initial_trajectory.index(details.shooting_snapshot)
+    direction = 1 if choice_change.details.choice == 0 else -1
+    trial = inner.trials[0]
+    n_segment = None
+    n_trial_frames = getattr(details, 'trial_length', None)
+    if n_trial_frames is not None:
+        if direction > 0:
+            n_shared = shooting_index + 1
+        else:
+            n_shared = len(initial_trajectory) - shooting_index
+        n_segment = n_trial_frames - n_shared
+    return (trial.replica, trial.trajectory, shooting_index, inner.accepted,
+            direction, n_segment)
+
+
+def network_signature(network):
+    """Description of a network, to check that networks are the same.
+
+    Networks loaded from different storages are different objects, so they
+    are compared by their sampling transitions: the name and definition of
+    the initial and final state of each.
+
+    Parameters
+    ----------
+    network : openpathsampling.TransitionNetwork
+        the network
+
+    Returns
+    -------
+    list of tuple
+        ``(name, definition)`` of the initial and final state, for each
+        sampling transition
+    """
+    return [((transition.stateA.name, str(transition.stateA)),
+             (transition.stateB.name, str(transition.stateB)))
+            for transition in network.sampling_transitions]
+
+
+def merge_storages(output_file, input_files, chunk_size=10000,
+                   report_progress=None):
+    """Merge storages from independent TPS chains into one storage.
+
+    The replicas of each input are given new numbers: the replicas of the
+    first input come first (in order), then those of the second input,
+    and so on. The steps are remade chain by chain, so the steps of each
+    chain are together (and in order) in the merged storage.
+
+    Parameters
+    ----------
+    output_file : str
+        the merged storage file (overwritten)
+    input_files : list of str
+        the storage files to merge; they must have the same (one-ensemble)
+        network (see :func:`.network_signature`)
+    chunk_size : int
+        number of stored snapshots copied in each chunk (see
+        :func:`.copy_snapshots`)
+    report_progress : file-like or None
+        stream for progress reports; None (default) for no reports
+
+    Returns
+    -------
+    dict
+        map from ``(input_number, replica)`` to the replica in the merged
+        storage
+    """
+    sources = [paths.Storage(input_file, 'r') for input_file in input_files]
+    output = None
+    try:
+        for source in sources:
+            source.set_caching_mode('lowmemory')
+        network = sources[0].networks[0]
+        ensemble = network.sampling_ensembles[0]
+        signature = network_signature(network)
+        for (input_file, source) in zip(input_files[1:], sources[1:]):
+            source_network = source.networks[0]
+            if (network_signature(source_network) != signature
+                    or len(source_network.sampling_ensembles)
+                    != len(network.sampling_ensembles)):
+                raise RuntimeError("The network in " + input_file
+                                   + " doesn't match the network in "
+                                   + input_files[0])
+        template = sources[0].snapshots[0]
+        output = paths.Storage(output_file, 'w', template)
+        output.save(template)
+
+        for (source_num, source) in enumerate(sources):
+            if report_progress is not None:
+                refresh_output("Copying snapshots from "
+                               + input_files[source_num] + "\n",
+                               output_stream=report_progress)
+            copy_snapshots(source, output, chunk_size)
+
+        replicas = {}
+        initial_samples = []
+        for (source_num, source) in enumerate(sources):
+            for sample in source.steps[0].active:
+                replica = len(replicas)
+                replicas[(source_num, sample.replica)] = replica
+                initial_samples.append(paths.Sample(
+                    replica=replica,
+                    trajectory=sample.trajectory,
+                    ensemble=ensemble
+                ))
+
+        def step_infos():
+            for (source_num, source) in enumerate(sources):
+                if report_progress is not None:
+                    refresh_output("Merging steps from "
+                                   + input_files[source_num] + "\n",
+                                   output_stream=report_progress)
+                steps = source.steps
+                for idx in range(1, len(steps)):
+                    info = shooting_step_info(steps[idx])
+                    yield (replicas[(source_num, info[0])],) + info[1:]
+
+        simulator = ShootingPseudoSimulator(
+            storage=output,
+            initial_conditions=paths.SampleSet(initial_samples),
+            mover=ShootingStub(ensemble, pre_joined=True),
+            network=network
+        )
+        simulator.bounded_memory = True
+        simulator.run(step_infos())
+    finally:
+        if output is not None:
+            output.close()
+        for source in sources:
+            source.close()
+    return replicas
@@ -1,4 +1,5 @@
 import openpathsampling as paths
+from .trajectory_segments import SegmentedTrajectory
 
 class NoEngine(paths.engines.DynamicsEngine):
     pass
@@ -20,6 +21,11 @@ class ShootingStub(paths.pathmover.PathMover):
         trajectories, or take partial one-way segments which should by
         dynamically joined. Currently defaults to pre_joined=True (likely to
         change soon, though).
+    validate : bool
+        whether to check the direction of each trial by comparing the trial
+        trajectory with the input trajectory. This scans both trajectories,
+        which is slow for long trajectories; it is only done (whatever this
+        setting) if the direction isn't given. Default False.
 
     Attributes
     ----------
@@ -27,7 +33,8 @@ class ShootingStub(paths.pathmover.PathMover):
         the mover that this stub mimics
 
     """
-    def __init__(self, ensemble, selector=None, engine=None, pre_joined=True):
+    def __init__(self, ensemble, selector=None, engine=None, pre_joined=True,
+                 validate=False):
         super(ShootingStub, self).__init__()
         if engine is None:
             engine = NoEngine()
@@ -37,6 +44,7 @@ class ShootingStub(paths.pathmover.PathMover):
         self.selector = selector
         self.ensemble = ensemble
         self.pre_joined = pre_joined
+        self.validate = validate
         self.mimic = paths.OneWayShootingMover(ensemble, selector, engine)
 
     @staticmethod
@@ -60,24 +68,52 @@ class ShootingStub(paths.pathmover.PathMover):
 
         Returns
         -------
-        paths.Trajectory
-            the complete trial trajectory
+        :class:`.SegmentedTrajectory`
+            the complete trial trajectory (a ``paths.Trajectory`` that
+            refers to the frames of the input and partial trajectories)
         """
         shooting_idx = input_trajectory.index(shooting_point)
+        return ShootingStub._join_at_index(input_trajectory, partial_trial,
+                                           shooting_idx, direction)
+
+    @staticmethod
+    def _join_at_index(input_trajectory, partial_trial, shooting_idx,
+                       direction):
+        """Join a one-way trial at a known shooting point index.
+
+        The trial is a :class:`.SegmentedTrajectory`, so no frames are
+        copied until it is saved.
+        """
         if direction > 0:
-            joined_trajectory = (input_trajectory[:shooting_idx+1] +
-                                 partial_trial)
+            segments = [(input_trajectory, 0, shooting_idx + 1),
+                        (partial_trial, 0, len(partial_trial))]
         elif direction < 0:
-            joined_trajectory = (partial_trial +
-                                 input_trajectory[shooting_idx:])
+            segments = [(partial_trial, 0, len(partial_trial)),
+                        (input_trajectory, shooting_idx,
+                         len(input_trajectory))]
         else: # pragma: no cover
             raise RuntimeError("Bad direction for shooting: " +
                                str(direction))
-        return joined_trajectory
+        return SegmentedTrajectory(segments)
 
 
+    @staticmethod
+    def _scan_choice(trial_trajectory, initial_trajectory):
+        """Submover choice (0 forward, 1 backward) from the shared frames"""
+        shared = trial_trajectory.shared_subtrajectory(initial_trajectory)
+        if len(shared) == 0:
+            raise RuntimeError("No shared frames. "
+                               + "Were these shot from each other?")
+
+        if shared[0] == trial_trajectory[0]:
+            return 0  # forward submover
+        elif shared[-1] == trial_trajectory[-1]:
+            return 1  # backward submover
+        else:  # pragma: no cover
+            raise RuntimeError("Are you sure this is 1-way shooting?")
+
     def move(self, input_sample, trial_trajectory, shooting_point, accepted,
-             direction=None):
+             direction=None, shooting_index=None):
         """Fake a move.
 
         Parameters
@@ -92,32 +128,48 @@ class ShootingStub(paths.pathmover.PathMover):
             whether the trial was accepted
         direction: +1, -1, or None
             direction of the shooting move (positive is forward, negative is
-            backward). If self.pre_joined is True, the trial trajectory is
-            reconstructed from the parts. To use the exact input trial
-            trajectory with self.pre_joined == True, set direction=None
+            backward). If self.pre_joined is False, the trial trajectory is
+            reconstructed from the parts, and the direction is required. If
+            self.pre_joined is True, the direction can be None, in which
+            case it is determined by comparing the trial trajectory with
+            the input trajectory.
+        shooting_index: int or None
+            index of the shooting point in the input trajectory. If None,
+            it is found by searching the input trajectory for the shooting
+            point (only needed if self.pre_joined is False).
         """
         initial_trajectory = input_sample.trajectory
         replica = input_sample.replica
         ensemble = input_sample.ensemble
 
         if not self.pre_joined:
-            trial_trajectory = self.join_one_way(initial_trajectory,
-                                                 trial_trajectory,
-                                                 shooting_point,
-                                                 direction)
-
-        # determine the direction based on trial trajectory
-        shared = trial_trajectory.shared_subtrajectory(initial_trajectory)
-        if len(shared) == 0:
-            raise RuntimeError("No shared frames. "
-                               + "Were these shot from each other?")
-
-        if shared[0] == trial_trajectory[0]:
-            choice = 0  # forward submover
-        elif shared[-1] == trial_trajectory[-1]:
-            choice = 1  # backward submover
-        else:  # pragma: no cover
-            raise RuntimeError("Are you sure this is 1-way shooting?")
+            if shooting_index is None:
+                trial_trajectory = self.join_one_way(initial_trajectory,
+                                                     trial_trajectory,
+                                                     shooting_point,
+                                                     direction)
+            else:
+                trial_trajectory = self._join_at_index(initial_trajectory,
+                                                       trial_trajectory,
+                                                       shooting_index,
+                                                       direction)
+
+        if (self.validate and shooting_index is not None
+                and initial_trajectory[shooting_index] != shooting_point):
+            raise RuntimeError("Shooting point is not frame "
+                               + str(shooting_index) + " of the input "
+                               + "trajectory")
+
+        if direction is None or self.validate:
+            scanned_choice = self._scan_choice(trial_trajectory,
+                                               initial_trajectory)
+        if direction is None:
+            choice = scanned_choice
+        else:
+            choice = 0 if direction > 0 else 1  # forward, backward submover
+            if self.validate and choice != scanned_choice:
+                raise RuntimeError("Direction " + str(direction) + " does "
+                                   + "not match the trial trajectory")
 
         details = paths.Details(
             initial_trajectory=initial_trajectory,
@@ -26,15 +26,36 @@ Valid values for a trajectory that is ``accepted`` are ``T``, ``True``,
 
 In general, we suggest the ``FW``/``BW`` pair for ``direction``, and
 ``True``/``False`` for ``accepted``. These tend to be most readable.
+
+Blank lines and lines starting with ``#`` in the summary file are ignored.
+The summary file may be compressed with gzip, bzip2, or xz (extensions
+``.gz``, ``.bz2``, ``.xz``); it is read one line at a time.
 """
 
+import io
+import itertools
+import json
+import multiprocessing
 import os
+import pickle
+import numpy as np
 import openpathsampling as paths
 import ops_piggybacker as oink
-from openpathsampling.engines.openmm.tools import ops_load_trajectory
+from openpathsampling.netcdfplus import ObjectJSON, StorableObject
 from openpathsampling.tools import refresh_output
+from .array_trajectory import ArrayTrajectory
+from .frame_index import FrameOffsetIndex, read_xdr_frames, xdr_n_frames
+from .prefetch import Prefetcher, data_nbytes
+from .shards import ShardWriter, read_shard, shard_info
+from .simulation_stubs import rejected_segment_indices
+from .summary_files import summary_lines, follow_summary_lines
+from .trimming import (
+    TrajectoryTrimmer, forward_segments, backward_segments, full_segments,
+    cv_atom_indices, state_atom_indices
+)
 
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
 _tps_converter_option_list = ('trim retrim_shooting auto_reverse '
                               + 'includes_shooting_point full_trajectory')
@@ -72,6 +93,125 @@ class TPSConverterOptions(namedtuple("TPSConverterOptions",
         )
 
 
+_trimmed_trial_list = ('replica file_name frames reverse trajectory '
+                       + 'shooting_index accepted direction retrim_shooting '
+                       + 'extra_bw_frames extra_fw_frames n_frames')
+
+
+class TrimmedTrial(namedtuple("TrimmedTrial", _trimmed_trial_list)):
+    """
+    Result of loading and trimming a trial, before bookkeeping.
+
+    Parameters
+    ----------
+    replica : int
+        replica ID (always 0 for now)
+    file_name : str
+        the trajectory file for this trial
+    frames : numpy.ndarray of int
+        index (in the file) of each frame of the one-way trial, in order
+    reverse : bool
+        whether the snapshots from the file are time-reversed in the trial
+    trajectory : openpathsampling.Trajectory or None
+        the one-way trial trajectory
+    shooting_index : int
+        shooting point index, as given in the summary file
+    accepted : bool
+        whether the trial was accepted
+    direction : 1 or -1
+        positive if forward shooting, negative if backward
+    retrim_shooting : bool
+        whether the shooting index must be shifted by the extra frames of
+        the previous accepted trial
+    extra_bw_frames : int or None
+        extra backward frames in this trial's file, if this trial changes
+        them (None otherwise)
+    extra_fw_frames : int or None
+        extra forward frames in this trial's file, if this trial changes
+        them (None otherwise)
+    n_frames : int or None
+        number of frames in the one-way trial, if some were left out of
+        ``frames`` by the ``rejected_trials`` policy (default None)
+    """
+    __slots__ = ()
+
+    def __new__(cls, replica, file_name, frames, reverse, trajectory,
+                shooting_index, accepted, direction, retrim_shooting,
+                extra_bw_frames, extra_fw_frames, n_frames=None):
+        return super(TrimmedTrial, cls).__new__(
+            cls, replica, file_name, frames, reverse, trajectory,
+            shooting_index, accepted, direction, retrim_shooting,
+            extra_bw_frames, extra_fw_frames, n_frames
+        )
+
+
+# worker processes for parallel trimming get their own converter; they only
+# return frame indices and file data, since OPS objects can't be sent
+# between processes
+_worker_converter = None
+
+# converter attributes for the simulation (and the storage) that the
+# workers don't need to trim
+_NOT_FOR_WORKERS = ['storage', '_writer', 'mover', 'network', 'scheme',
+                    'root_mover', '_path_sim_mover', 'sample_set',
+                    'initial_conditions', 'hooks', 'output_stream',
+                    'report_progress']
+
+
+class _WorkerPickler(pickle.Pickler):
+    """Pickle the state of a converter for the worker processes.
+
+    OPS objects can't be pickled; they are sent as their JSON description
+    (each one only once), and rebuilt by :class:`._WorkerUnpickler`.
+    """
+    def __init__(self, file):
+        super(_WorkerPickler, self).__init__(file)
+        self.json = ObjectJSON()
+        self._sent = set()
+
+    def persistent_id(self, obj):
+        if not isinstance(obj, StorableObject):
+            return None
+        uuid = obj.__uuid__
+        if uuid in self._sent:
+            return (uuid, None)
+        self._sent.add(uuid)
+        return (uuid, self.json.to_json_object(obj))
+
+
+class _WorkerUnpickler(pickle.Unpickler):
+    def __init__(self, file):
+        super(_WorkerUnpickler, self).__init__(file)
+        self.json = ObjectJSON()
+        self._objects = {}
+
+    def persistent_load(self, pid):
+        (uuid, json_object) = pid
+        if json_object is not None:
+            self._objects[uuid] = self.json.from_json(json_object)
+        return self._objects[uuid]
+
+
+def _worker_payload(converter):
+    state = {key: value for (key, value) in converter.__dict__.items()
+             if key not in _NOT_FOR_WORKERS}
+    buffer = io.BytesIO()
+    _WorkerPickler(buffer).dump((type(converter), state))
+    return buffer.getvalue()
+
+
+def _init_trim_worker(payload):
+    global _worker_converter
+    (cls, state) = _WorkerUnpickler(io.BytesIO(payload)).load()
+    _worker_converter = cls.__new__(cls)
+    _worker_converter.__dict__.update(dict.fromkeys(_NOT_FOR_WORKERS))
+    _worker_converter.__dict__.update(state)
+
+
+def _trim_in_worker(line):
+    return _worker_converter.trim_summary_line_data(line)
+
+
 class OneWayTPSConverter(oink.ShootingPseudoSimulator):
     """
     Single-ensemble network shooting pseudo-simulator from external
@@ -81,9 +221,22 @@ class OneWayTPSConverter(oink.ShootingPseudoSimulator):
     that the user must create a "simulation summary" file, which contains
     the information we need to perform the pseudo-simulation, where the
     trajectories are loaded via mdtraj.
+
+    With ``cv_snapshots`` (a :class:`.CVSnapshots`), the conversion is
+    coordinate-free: the stored snapshots only have CV values and where the
+    frame came from, and the storage gets ``cv_snapshots.network`` instead
+    of ``network``. Trimming still uses ``network`` (kept as
+    ``trim_network``). The ``mover`` must then use the ensemble of
+    ``cv_snapshots.network``.
+
+    The CVs in ``precompute_cvs`` are evaluated for each trial trajectory
+    as it is converted (see :meth:`.precompute_cv_values`), and their values
+    are saved in the storage, so analysis of the storage doesn't need to
+    evaluate them again (or load the coordinates to do so).
     """
     def __init__(self, storage, initial_file, mover, network, options=None,
-                 options_rejected=None):
+                 options_rejected=None, cv_snapshots=None,
+                 precompute_cvs=None):
         # TODO: mke the initial file into an initial trajectory
         if options is None:
             options = TPSConverterOptions()
@@ -93,19 +246,73 @@ class OneWayTPSConverter(oink.ShootingPseudoSimulator):
         self.options_rejected = options_rejected
 
         self.initial_file = initial_file  # needed for restore
+        self.cv_snapshots = cv_snapshots
+        if cv_snapshots is not None and precompute_cvs:
+            raise ValueError("CV-only snapshots already have the values of "
+                             + "their CVs; use the cvs of CVSnapshots "
+                             + "instead of precompute_cvs")
+        self.precompute_cvs = list(precompute_cvs or [])
+
+        # initial_states = network.initial_states
+        # final_states = network.final_states
+        # TODO: prefer the above, but the below work until fix for network
+        # storage
+        initial_states = [network.sampling_transitions[0].stateA]
+        final_states = [network.sampling_transitions[0].stateB]
+
+        all_states = paths.join_volumes(initial_states + final_states)
+
+        # the ensembles define what the trimmer finds; the trimmer finds
+        # them in linear time (SequentialEnsemble.split is quadratic)
+        self.fw_ensemble = paths.SequentialEnsemble([
+            paths.AllOutXEnsemble(all_states),
+            paths.AllInXEnsemble(all_states) & paths.LengthEnsemble(1)
+        ])
+        self.bw_ensemble = paths.SequentialEnsemble([
+            paths.AllInXEnsemble(all_states) & paths.LengthEnsemble(1),
+            paths.AllOutXEnsemble(all_states)
+        ])
+        self.full_ensemble = paths.SequentialEnsemble([
+            paths.AllInXEnsemble(all_states) & paths.LengthEnsemble(1),
+            paths.AllOutXEnsemble(all_states),
+            paths.AllInXEnsemble(all_states) & paths.LengthEnsemble(1)
+        ])
+        self.all_states = all_states
+        self.trimmer = TrajectoryTrimmer(all_states)
+
         traj = self.load_trajectory(initial_file)
-        # assume we're TPS here
+        # assume we're TPS here: any TPS path is one of the full segments,
+        # so we only need to check those against the ensemble
         ensemble = network.sampling_ensembles[0]
-        initial_trajectories = ensemble.split(traj)
-        if len(initial_trajectories) == 0:  # pragma: no cover
+        initial_segments = [seg for seg in self.trimmer.full(traj)
+                            if ensemble(traj[seg])]
+        if len(initial_segments) == 0:  # pragma: no cover
             raise RuntimeError("Initial trajectory in " + str(initial_file)
                                + " has no subtrajectory satisfying the "
                                + "TPS ensemble.")
-        elif len(initial_trajectories) > 1:  # pragma: no cover
+        elif len(initial_segments) > 1:  # pragma: no cover
             raise RuntimeWarning("More than one potential initial "
                                  + "subtrajectory. We use the first.")
 
-        initial_trajectory = initial_trajectories[0]
+        initial_segment = initial_segments[0]
+        initial_trajectory = traj[initial_segment]
+        self.trim_network = network
+        if cv_snapshots is not None:
+            initial_trajectory = cv_snapshots.trajectory(
+                initial_file,
+                np.arange(initial_segment.start, initial_segment.stop),
+                initial_trajectory
+            )
+            network = cv_snapshots.network
+            ensemble = network.sampling_ensembles[0]
+        if storage is not None and self.precompute_cvs:
+            # values are only saved for CVs with a disk cache in the storage,
+            # which needs a stored snapshot as a template; with
+            # allow_incomplete, saving a snapshot doesn't evaluate them
+            storage.save(initial_trajectory)
+            for cv in self.precompute_cvs:
+                storage.save(cv.with_diskcache(allow_incomplete=True))
+        self.precompute_cv_values(initial_trajectory)
 
         initial_conditions = paths.SampleSet([
             paths.Sample(replica=0,
@@ -113,13 +320,15 @@ class OneWayTPSConverter(oink.ShootingPseudoSimulator):
                          ensemble=ensemble)
         ])
 
-        self.extra_bw_frames = traj.index(initial_trajectory[0])
-        final_frame_index = traj.index(initial_trajectory[-1])
-        self.extra_fw_frames = len(traj) - final_frame_index - 1
-        # extra -1 bc frame index counts from 0; len counts from 1
+        self.extra_bw_frames = initial_segment.start
+        self.extra_fw_frames = len(traj) - initial_segment.stop
 
         self.summary_root_dir = None
         self.report_progress = None
+        self.streaming_trim = True
+        self.state_cache = None
+        self.checkpoint_file = None
+        self._checkpoint_position = None
         super(OneWayTPSConverter, self).__init__(
             storage=storage,
             initial_conditions=initial_conditions,
@@ -127,36 +336,112 @@ class OneWayTPSConverter(oink.ShootingPseudoSimulator):
             network=network
         )
 
-        # initial_states = self.network.initial_states
-        # final_states = self.network.final_states
-        # TODO: prefer the above, but the below work until fix for network
-        # storage
-        initial_states = [self.network.sampling_transitions[0].stateA]
-        final_states = [self.network.sampling_transitions[0].stateB]
-
-        all_states = paths.join_volumes(initial_states + final_states)
-
-        self.fw_ensemble = paths.SequentialEnsemble([
-            paths.AllOutXEnsemble(all_states),
-            paths.AllInXEnsemble(all_states) & paths.LengthEnsemble(1)
-        ])
-        self.bw_ensemble = paths.SequentialEnsemble([
-            paths.AllInXEnsemble(all_states) & paths.LengthEnsemble(1),
-            paths.AllOutXEnsemble(all_states)
-        ])
-        self.full_ensemble = paths.SequentialEnsemble([
-            paths.AllInXEnsemble(all_states) & paths.LengthEnsemble(1),
-            paths.AllOutXEnsemble(all_states),
-            paths.AllInXEnsemble(all_states) & paths.LengthEnsemble(1)
-        ])
-        self.all_states = all_states
-
+    def to_dict(self):
+        # loading a storage remakes the converter with __init__ from this;
+        # that must not write to the (read-only) storage. CVSnapshots can't
+        # be stored, so a CV-only converter is remade as a normal one, with
+        # the network it trims with (not the network of the column CVs).
+        dct = super(OneWayTPSConverter, self).to_dict()
+        dct['storage'] = None
+        dct['network'] = self.trim_network
+        return dct
 
     def load_trajectory(self, file_name):
         raise NotImplementedError(
             "Can't instantiate abstract OneWayTPSConverter: Use a subclass"
         )
 
+    def read_trajectory_data(self, file_name):
+        """Read the data for a trajectory file, without creating OPS objects.
+
+        This is the part of loading that can be done ahead of time, in a
+        background thread (see the ``n_prefetch`` option to :meth:`.run`),
+        so it must be thread-safe. The default implementation just reads
+        the file (if it exists), so that it is in the filesystem cache when
+        :meth:`.load_trajectory` is called.
+
+        Parameters
+        ----------
+        file_name : str
+            the trajectory file
+
+        Returns
+        -------
+        object or None
+            data to pass to :meth:`.trajectory_from_data`
+        """
+        if os.path.isfile(file_name):
+            with open(file_name, 'rb') as f:
+                while f.read(2**22):
+                    pass
+        return None
+
+    def trajectory_from_data(self, file_name, data):
+        """Create the OPS trajectory from :meth:`.read_trajectory_data`.
+
+        Parameters
+        ----------
+        file_name : str
+            the trajectory file
+        data : object or None
+            the result of :meth:`.read_trajectory_data`; if None, the file
+            is loaded with :meth:`.load_trajectory`
+
+        Returns
+        -------
+        openpathsampling.Trajectory
+            the trajectory from the file
+        """
+        return self.load_trajectory(file_name)
+
+    def load_frames(self, file_name):
+        """Load a trajectory file for trimming.
+
+        Trimming only needs the frames as a trajectory-like object that
+        :meth:`.TrajectoryTrimmer.in_state` accepts, and that can be
+        indexed with the frames of the trial (see :meth:`.select_frames`).
+        The default is :meth:`.load_trajectory`; subclasses can return an
+        :class:`.ArrayTrajectory`, so that OPS snapshots are only made for
+        the frames that are kept.
+
+        Parameters
+        ----------
+        file_name : str
+            the trajectory file
+
+        Returns
+        -------
+        openpathsampling.Trajectory or :class:`.ArrayTrajectory`
+            the frames from the file
+        """
+        return self.load_trajectory(file_name)
+
+    def frames_from_data(self, file_name, data):
+        """Frames for trimming from :meth:`.read_trajectory_data`.
+
+        This is to :meth:`.load_frames` as :meth:`.trajectory_from_data`
+        is to :meth:`.load_trajectory`. The default is
+        :meth:`.trajectory_from_data`.
+
+        Parameters
+        ----------
+        file_name : str
+            the trajectory file
+        data : object or None
+            the result of :meth:`.read_trajectory_data`
+
+        Returns
+        -------
+        openpathsampling.Trajectory or :class:`.ArrayTrajectory`
+            the frames from the file
+        """
+        return self.trajectory_from_data(file_name, data)
+
+    def summary_line_file_name(self, line):
+        """Full path to the trajectory file for a line of the summary file
+        """
+        return os.path.join(self.summary_root_dir, line.split()[0])
+
     @staticmethod
     def _get_direction(val):
         """Identifies the direction based on val"""
@@ -181,40 +466,34 @@ class OneWayTPSConverter(oink.ShootingPseudoSimulator):
             raise ValueError("Unknown truth value for acceptance: " +
                              str(val))
 
-    def parse_summary_line(self, line):
-        """Parse a line from the summary file.
+    def trim_frames(self, line, in_state):
+        """Find the frames of the one-way trial for a line of the summary.
 
-        To control the parsing, set the OneWayTPSConverter.options (see
-        :class:`.TPSConverterOptions`).
+        This is the trimming part of :meth:`.parse_summary_line`, done only
+        in terms of frame indices. It depends only on the line, the state
+        indicator for the file's trajectory, and the options; it does not
+        use or change the state of the converter. For rejected trials, only
+        the frames kept by the ``rejected_trials`` policy are included (see
+        :func:`.rejected_segment_indices`).
 
         Parameters
         ----------
         line : str
             the input line
+        in_state : numpy.ndarray of bool
+            for each frame of the file, whether it is in any state
 
         Returns
         -------
-        replica : 0
-            always zero for now
-        trial_trajectory : openpathsampling.Trajectory
-            one-way trial segments
-        shooting_point_index : int
-            index of the shooting point based on the previous trajectory
-            (None if no previous trajectory)
-        accepted : bool
-            whether the trial was accepted
-        direction : 1 or -1
-            positive if forward shooting, negative if backward
+        :class:`.TrimmedTrial`
+            the trimmed trial, with ``trajectory=None``
         """
-        #print line
         splitted = line.split()
         assert 4 <= len(splitted) <= 5, \
             "Incorrect number of fields in input: " + line
 
         replica = 0
-        file_name = splitted[0]
-        full_file_name = os.path.join(self.summary_root_dir, file_name)
-        trajectory = self.load_trajectory(full_file_name)
+        full_file_name = self.summary_line_file_name(line)
         shooting_index = int(splitted[1])
         direction = self._get_direction(splitted[2])
         accepted = self._get_accepted(splitted[3])
@@ -224,68 +503,56 @@ class OneWayTPSConverter(oink.ShootingPseudoSimulator):
         else:
             options = self.options_rejected
 
-        # if reversed, make sure time is in the right direction
-        if options.auto_reverse and direction < 0:
-            trajectory = trajectory.reversed
-
-        old_extra_bw_frames = self.extra_bw_frames
-        old_extra_fw_frames = self.extra_fw_frames
+        # frames tracks the file's frame index for each frame of the trial
+        frames = np.arange(len(in_state))
+        extra_bw_frames = None
+        extra_fw_frames = None
 
         # if reversed, make sure time is in the right direction
+        reverse = options.auto_reverse and direction < 0
+        if reverse:
+            frames = frames[::-1]
+            in_state = in_state[::-1]
+
         # ensure the trajectory doesn't have extra frames
         if options.trim and not options.full_trajectory:
-            len_pre_trim = len(trajectory)
+            len_pre_trim = len(frames)
             if direction > 0:
-                # in the forward direction, we do an extra check which can
-                # make this much faster (otherwise, this is quadratic until
-                # OPS supports some of the ideas of path ensemble theory).
-                # The BW part doesn't need this bc it will already be linear
-                # in this case.
-                # Check whether amy states are in that traj
-                if any(self.all_states(s) for s in trajectory):
-                    segments = self.fw_ensemble.split(trajectory)
-                else:
-                    segments = []
+                segments = forward_segments(in_state)
                 # If following not true, simulation failed. Perhaps max
                 # length or simulation crash? Should be fine as rejected
                 if len(segments) > 0 or accepted:
-                    trajectory = segments[0]
+                    frames = frames[segments[0]]
                 if accepted:
-                    self.extra_fw_frames = len_pre_trim - len(trajectory)
+                    extra_fw_frames = len_pre_trim - len(frames)
             elif direction < 0:
-                segments = self.bw_ensemble.split(trajectory)
+                segments = backward_segments(in_state)
                 if len(segments) > 0 or accepted:
-                    trajectory = segments[-1]
+                    frames = frames[segments[-1]]
                 if accepted:
-                    self.extra_bw_frames = len_pre_trim - len(trajectory)
+                    extra_bw_frames = len_pre_trim - len(frames)
 
         if options.trim and options.full_trajectory:
-            # all segments that could be generated by TPS are identified by
-            # the full_ensemble.split, and the one that has the shooting
-            # point in it is the one that we actually identify
-            segments = self.full_ensemble.split(trajectory)
+            # all segments that could be generated by TPS are the full
+            # segments, and the one that has the shooting point in it is
+            # the one that we actually identify
+            segments = full_segments(in_state)
             shooting_index_in_trial = int(splitted[4])
-            shooting_frame = trajectory[shooting_index_in_trial]
+            if shooting_index_in_trial < 0:
+                shooting_index_in_trial += len(frames)
             shooting_segments = [seg for seg in segments
-                                 if shooting_frame in seg]
+                                 if seg.start <= shooting_index_in_trial
+                                 < seg.stop]
             if len(shooting_segments) > 1:  # pragma: no cover
                 raise RuntimeError("Your shooting point appears more"
                                    + " than once!")
-            new_traj = shooting_segments[0]
-            new_extra_bw_frames = trajectory.index(new_traj[0])
-            final_frame_index = trajectory.index(new_traj[-1])
-            new_extra_fw_frames = len(trajectory) - final_frame_index - 1
-            trajectory = new_traj
+            new_segment = shooting_segments[0]
+            new_extra_bw_frames = new_segment.start
+            new_extra_fw_frames = len(frames) - new_segment.stop
+            frames = frames[new_segment]
             if accepted:
-                self.extra_bw_frames = new_extra_bw_frames
-                self.extra_fw_frames = new_extra_fw_frames
-
-        if options.retrim_shooting:
-            if shooting_index >= 0:
-                shooting_index -= old_extra_bw_frames
-            else:
-                shooting_index += old_extra_fw_frames
-
+                extra_bw_frames = new_extra_bw_frames
+                extra_fw_frames = new_extra_fw_frames
 
         # if this is a full trajectory, cut it down to one-way segments
         if options.full_trajectory:
@@ -298,57 +565,1251 @@ class OneWayTPSConverter(oink.ShootingPseudoSimulator):
 
             shoot_pt = 0 if options.includes_shooting_point else 1
             if direction > 0:
-                trajectory = trajectory[shooting_index_in_trial+shoot_pt:]
+                frames = frames[shooting_index_in_trial+shoot_pt:]
             elif direction < 0:
-                trajectory = trajectory[0:shooting_index_in_trial+1-shoot_pt]
+                frames = frames[0:shooting_index_in_trial+1-shoot_pt]
 
         # remove shooting point from trial, if necessary
         if options.includes_shooting_point:
             if direction > 0:
-                trajectory = trajectory[1:]
+                frames = frames[1:]
+            else:
+                frames = frames[:-1]
+
+        # only make snapshots for the frames of rejected trials we store
+        n_frames = None
+        if not accepted:
+            keep = rejected_segment_indices(len(frames), direction,
+                                            self.rejected_trials,
+                                            self.rejected_max_frames)
+            if keep is not None:
+                n_frames = len(frames)
+                frames = frames[keep]
+
+        return TrimmedTrial(replica=replica,
+                            file_name=full_file_name,
+                            frames=frames,
+                            reverse=reverse,
+                            trajectory=None,
+                            shooting_index=shooting_index,
+                            accepted=accepted,
+                            direction=direction,
+                            retrim_shooting=options.retrim_shooting,
+                            extra_bw_frames=extra_bw_frames,
+                            extra_fw_frames=extra_fw_frames,
+                            n_frames=n_frames)
+
+    @staticmethod
+    def select_frames(trajectory, trial, offset=0):
+        """Trial trajectory from the trajectory that was trimmed.
+
+        For an :class:`.ArrayTrajectory`, the trial's frames are selected
+        as a view, and snapshots are made only for those frames.
+
+        Parameters
+        ----------
+        trajectory : openpathsampling.Trajectory or :class:`.ArrayTrajectory`
+            the trajectory from the file, or a part of it
+        trial : :class:`.TrimmedTrial`
+            the trimmed trial
+        offset : int
+            file frame index of the first frame of ``trajectory``
+
+        Returns
+        -------
+        openpathsampling.Trajectory
+            the one-way trial trajectory
+        """
+        if isinstance(trajectory, ArrayTrajectory):
+            frames = np.asarray(trial.frames) - offset
+            if trial.reverse:
+                # frames are in reverse order; reversing the forward view
+                # also reverses the velocities, as snap.reversed does
+                return trajectory[frames[::-1]].reversed.to_trajectory()
+            else:
+                return trajectory[frames].to_trajectory()
+
+        snapshots = [trajectory[frame - offset] for frame in trial.frames]
+        if trial.reverse:
+            snapshots = [snap.reversed for snap in snapshots]
+        return paths.Trajectory(snapshots)
+
+    def trial_trajectory(self, trial, trajectory, offset=0):
+        """OPS trajectory for a trial, from the frames it was trimmed from.
+
+        The default is :meth:`.select_frames` (or
+        :meth:`.CVSnapshots.trial_trajectory`, for coordinate-free
+        conversion). Subclasses that trim from partial frame data (for
+        example, only some of the atoms) can load the data for the trial's
+        frames here.
+
+        Parameters
+        ----------
+        trial : :class:`.TrimmedTrial`
+            the trimmed trial
+        trajectory : openpathsampling.Trajectory or :class:`.ArrayTrajectory`
+            the frames used for trimming (see :meth:`.load_frames`), or a
+            part of them
+        offset : int
+            file frame index of the first frame of ``trajectory``
+
+        Returns
+        -------
+        openpathsampling.Trajectory
+            the one-way trial trajectory
+        """
+        if self.cv_snapshots is not None:
+            return self.cv_snapshots.trial_trajectory(trial, trajectory,
+                                                      offset)
+        return self.select_frames(trajectory, trial, offset)
+
+    def trial_data(self, trial, file_data):
+        """The part of the file data needed to make the trial trajectory.
+
+        Worker processes (see the ``n_processes`` option to :meth:`.run`)
+        send this back, so it must not contain OPS objects. The default is
+        the range of ``file_data`` from the first to the last frame of the
+        trial.
+
+        Parameters
+        ----------
+        trial : :class:`.TrimmedTrial`
+            the trimmed trial
+        file_data : object or None
+            the result of :meth:`.read_trajectory_data`
+
+        Returns
+        -------
+        object or None
+            data for :meth:`.frames_from_data`, starting at the first frame
+            of the trial (None to load the file again)
+        """
+        if file_data is not None and len(trial.frames) > 0:
+            file_data = file_data[min(trial.frames):max(trial.frames) + 1]
+        return file_data
+
+    def load_trial(self, trial):
+        """Load the OPS trajectory for a trial that has already been trimmed.
+
+        This is used when the trial's frames are known without loading the
+        file (see :meth:`.cached_trim`). The default loads the whole file
+        with :meth:`.load_frames`; subclasses can load only the trial's
+        frames.
+
+        Parameters
+        ----------
+        trial : :class:`.TrimmedTrial`
+            the trimmed trial
+
+        Returns
+        -------
+        openpathsampling.Trajectory
+            the one-way trial trajectory
+        """
+        return self.trial_trajectory(trial, self.load_frames(trial.file_name))
+
+    def save_in_state(self, file_name, in_state, start=0, stop=None):
+        """Save a file's state indicator in ``state_cache`` (if set).
+
+        Parameters
+        ----------
+        file_name : str
+            the trajectory file
+        in_state : numpy.ndarray of bool
+            for each frame of the file, whether it is in any state
+        start : int
+            first frame for which ``in_state`` was evaluated
+        stop : int or None
+            frame after the last one for which ``in_state`` was evaluated
+            (None for the end of the file)
+        """
+        if self.state_cache is not None and os.path.isfile(file_name):
+            self.state_cache.save(file_name, in_state, start, stop)
+
+    def cached_trim(self, line):
+        """Trim the trial for a line using only ``state_cache``.
+
+        Parameters
+        ----------
+        line : str
+            the input line
+
+        Returns
+        -------
+        :class:`.TrimmedTrial` or None
+            the trimmed trial, with ``trajectory=None``; None if there is no
+            cache, or it doesn't have what this line needs
+        """
+        file_name = self.summary_line_file_name(line)
+        if self.state_cache is None or not os.path.isfile(file_name):
+            return None
+        saved = self.state_cache.get(file_name)
+        if saved is None:
+            return None
+        in_state, start, stop = saved
+        if start > 0 or stop < len(in_state):
+            # partial indicators (from streaming) are enough if streaming
+            # this line would stop within the known frames
+            from_end = self._stream_from_end(line)
+            if from_end is None:
+                return None
+            elif from_end:
+                found = (stop == len(in_state)
+                         and len(backward_segments(in_state[start:])) > 0)
             else:
-                trajectory = trajectory[:-1]
+                found = (start == 0
+                         and len(forward_segments(in_state[:stop])) > 0)
+            if not found:
+                return None
+        return self.trim_frames(line, in_state)
+
+    def frame_chunks(self, file_name, from_end=False, origin=None):
+        """Read a trajectory file in chunks, so trimming can stop early.
+
+        Subclasses that can read part of a file without reading all of it
+        implement this to support :meth:`.stream_summary_line`. The default
+        returns None (not supported).
+
+        Parameters
+        ----------
+        file_name : str
+            the trajectory file
+        from_end : bool
+            if True, the chunks go backward from the end of the file (or
+            from ``origin``); otherwise they go forward from the beginning
+            (or from ``origin``)
+        origin : int or None
+            if not None, the frame where reading starts (going forward) or
+            stops (going backward); negative values count from the end of
+            the file
 
-        return (replica, trajectory, shooting_index, accepted, direction)
+        Returns
+        -------
+        tuple or None
+            ``(n_frames, chunks)``, where ``n_frames`` is the number of
+            frames in the file and ``chunks`` is an iterator of ``(start,
+            frames)`` pairs, where ``frames`` is an :class:`.ArrayTrajectory`
+            for the file frames ``start:start+len(frames)``; or None if the
+            file can't be read in chunks
+        """
+        return None
 
-    def run(self, summary_file_name, n_trajs_per_block=None):
+    def _stream_from_end(self, line):
+        # which end of the file the trimmed trial is found from, if the
+        # trimming can stop early: False for the beginning, True for the
+        # end, None if the whole file is needed
+        splitted = line.split()
+        direction = self._get_direction(splitted[2])
+        if self._get_accepted(splitted[3]):
+            options = self.options
+        else:
+            options = self.options_rejected
+        if not options.trim or options.full_trajectory:
+            return None
+        # a backward trial that is reversed is the first forward segment of
+        # the file, so either way it is found from the beginning
+        return direction < 0 and not options.auto_reverse
+
+    def shared_frames(self, line):
+        """Number of frames a full-trajectory trial shares with the current
+        path.
+
+        With ``full_trajectory=True``, the trial file has the shared part
+        of the current path again. The shooting point is frame
+        ``shooting_point`` of the current path, so the shared part is the
+        current path up to the shooting point (forward shooting) or from the
+        shooting point on (backward shooting). This uses the state of the
+        converter, so it is only correct just before the line's trial is
+        applied.
+
+        Parameters
+        ----------
+        line : str
+            the input line
+
+        Returns
+        -------
+        int or None
+            number of shared frames, including the shooting point; None if
+            the line's options don't have ``trim`` and ``full_trajectory``
+        """
+        splitted = line.split()
+        if self._get_accepted(splitted[3]):
+            options = self.options
+        else:
+            options = self.options_rejected
+        if not (options.trim and options.full_trajectory):
+            return None
+        direction = self._get_direction(splitted[2])
+        shooting_index = int(splitted[1])
+        if options.retrim_shooting:
+            if shooting_index >= 0:
+                shooting_index -= self.extra_bw_frames
+            else:
+                shooting_index += self.extra_fw_frames
+        path = self.sample_set[0].trajectory
+        if shooting_index < 0:
+            shooting_index += len(path)
+        if direction > 0:
+            return shooting_index + 1
+        else:
+            return len(path) - shooting_index
+
+    def _stream_shared(self, line, n_shared):
+        # full trajectories: the frames shared with the current path (and
+        # where the trial starts or ends in them) are known, so only the
+        # new frames, going out from the shooting point, are read
+        splitted = line.split()
+        direction = self._get_direction(splitted[2])
+        shooting_index = int(splitted[4])
+        if direction > 0:
+            origin = shooting_index
+        else:
+            origin = shooting_index + 1 if shooting_index != -1 else None
+        file_name = self.summary_line_file_name(line)
+        streamed = self.frame_chunks(file_name, direction < 0, origin)
+        if streamed is None:
+            return None
+        n_frames, chunks = streamed
+        if shooting_index < 0:
+            shooting_index += n_frames
+
+        # frames that aren't read are marked as in a state: the only
+        # segment through the shooting point is still the trial's
+        in_state = np.ones(n_frames, dtype=bool)
+        if direction > 0:
+            first_shared = shooting_index - n_shared + 1
+            if first_shared < 0:
+                return None  # file doesn't match the current path
+            in_state[first_shared + 1:shooting_index] = False
+            # the shared part must start with the path's state frame
+            end_frames = (first_shared, [True, False])
+        else:
+            last_shared = shooting_index + n_shared - 1
+            if last_shared >= n_frames:
+                return None  # file doesn't match the current path
+            in_state[shooting_index + 1:last_shared] = False
+            # the shared part must end with the path's state frame
+            end_frames = (last_shared - 1, [False, True])
+        (start, expected) = end_frames
+        if list(self._frames_in_state(file_name, start, 2)) != expected:
+            return None  # file doesn't match the current path
+
+        read_frames = []
+        first_read = n_frames
+        last_read = 0
+        for (start, frames) in chunks:
+            stop = start + len(frames)
+            in_state[start:stop] = self.trimmer.in_state(frames)
+            read_frames.append(frames)
+            first_read = min(first_read, start)
+            last_read = max(last_read, stop)
+            if direction > 0:
+                found = np.any(in_state[shooting_index + 1:stop])
+            else:
+                found = np.any(in_state[start:shooting_index])
+            if found:
+                break
+        if len(read_frames) == 0 or in_state[shooting_index]:
+            return None  # file doesn't match the current path
+        if direction < 0:
+            read_frames.reverse()
+        self.save_in_state(file_name, in_state, first_read, last_read)
+
+        trial = self.trim_frames(line, in_state)
+        trajectory = ArrayTrajectory.concatenate(read_frames)
+        return trial._replace(
+            trajectory=self.trial_trajectory(trial, trajectory, first_read)
+        )
+
+    def _frames_in_state(self, file_name, start, n_frames):
+        # in-state flags of n_frames frames of a file, from start on
+        (_, chunks) = self.frame_chunks(file_name, False, start)
+        in_state = []
+        for (_, frames) in chunks:
+            in_state.extend(self.trimmer.in_state(frames))
+            if len(in_state) >= n_frames:
+                break
+        return in_state[:n_frames]
+
+    def stream_summary_line(self, line, n_shared=None):
+        """Trim the trajectory for a line, reading only the part needed.
+
+        For a forward trial (or a backward trial with ``auto_reverse``), the
+        trial ends at the first frame in a state after the shooting point,
+        so the file is read in chunks (see :meth:`.frame_chunks`) until
+        that frame is found. A backward trial without ``auto_reverse`` is
+        found by reading chunks from the end of the file. The frames that
+        aren't read are only counted. The result is the same as for
+        :meth:`.trim_summary_line`.
+
+        For full trajectories, ``n_shared`` (see :meth:`.shared_frames`)
+        gives the frames of the file that are already in the current path.
+        Those frames are not read, except for the two at the far end of
+        the shared part, which are checked against the current path (the
+        state frame it starts or ends with): the file is only read from the
+        shooting point to the first frame in a state after it (or before
+        it, for backward shooting).
+
+        Parameters
+        ----------
+        line : str
+            the input line
+        n_shared : int or None
+            for full trajectories, the number of frames shared with the
+            current path, from :meth:`.shared_frames`
+
+        Returns
+        -------
+        :class:`.TrimmedTrial` or None
+            the trimmed trial; None if this line's trial can't be trimmed
+            by streaming (full trajectories without ``n_shared``, or where
+            the file doesn't match ``n_shared``, no trimming, or the file
+            can't be read in chunks)
+        """
+        if n_shared is not None:
+            return self._stream_shared(line, n_shared)
+        from_end = self._stream_from_end(line)
+        if from_end is None:
+            return None
+        file_name = self.summary_line_file_name(line)
+        streamed = self.frame_chunks(file_name, from_end)
+        if streamed is None:
+            return None
+        n_frames, chunks = streamed
+        if n_frames == 0:
+            return None
+
+        # frames that aren't read are marked as in a state; they come
+        # after (or, from the end, before) the state frame that ends the
+        # trial, so they don't change the segment that is found
+        in_state = np.ones(n_frames, dtype=bool)
+        read_frames = []
+        first_read = n_frames
+        last_read = 0
+        for (start, frames) in chunks:
+            stop = start + len(frames)
+            in_state[start:stop] = self.trimmer.in_state(frames)
+            read_frames.append(frames)
+            first_read = min(first_read, start)
+            last_read = max(last_read, stop)
+            if from_end:
+                found = len(backward_segments(in_state[start:])) > 0
+            else:
+                found = len(forward_segments(in_state[:stop])) > 0
+            if found:
+                break
+        if from_end:
+            read_frames.reverse()
+        self.save_in_state(file_name, in_state, first_read, last_read)
+
+        trial = self.trim_frames(line, in_state)
+        trajectory = ArrayTrajectory.concatenate(read_frames)
+        return trial._replace(
+            trajectory=self.trial_trajectory(trial, trajectory, first_read)
+        )
+
+    def trim_summary_line(self, line, file_data=None, n_shared=None):
+        """Load and trim the trajectory for a line from the summary file.
+
+        Unlike :meth:`.parse_summary_line`, this does not use or change the
+        state of the converter (except through ``n_shared``). Follow it
+        with :meth:`.apply_trimmed_trial`.
+
+        If ``streaming_trim`` is True (default) and no ``file_data`` is
+        given, only the part of the file needed for trimming is read, where
+        possible (see :meth:`.stream_summary_line`).
+
+        If ``state_cache`` is a :class:`.StateIndicatorCache`, the state
+        indicator is taken from it when possible (see :meth:`.cached_trim`),
+        and only the trial's frames are loaded (see :meth:`.load_trial`).
+        Indicators that are evaluated are saved in it.
+
+        Parameters
+        ----------
+        line : str
+            the input line
+        file_data : object or None
+            if not None, the data for this line's trajectory file, from
+            :meth:`.read_trajectory_data`
+        n_shared : int or None
+            for full trajectories, the number of frames shared with the
+            current path (see :meth:`.shared_frames`); if given, the
+            shared frames aren't read when streaming
+
+        Returns
+        -------
+        :class:`.TrimmedTrial`
+            the trimmed trial
+        """
+        file_name = self.summary_line_file_name(line)
+        trial = self.cached_trim(line)
+        if trial is not None:
+            if file_data is None:
+                trajectory = self.load_trial(trial)
+            else:
+                trajectory = self.trial_trajectory(
+                    trial, self.frames_from_data(file_name, file_data)
+                )
+            return trial._replace(trajectory=trajectory)
+
+        if file_data is None and self.streaming_trim:
+            trial = self.stream_summary_line(line, n_shared)
+            if trial is not None:
+                return trial
+
+        if file_data is None:
+            trajectory = self.load_frames(file_name)
+        else:
+            trajectory = self.frames_from_data(file_name, file_data)
+        in_state = self.trimmer.in_state(trajectory)
+        self.save_in_state(file_name, in_state)
+        trial = self.trim_frames(line, in_state)
+        return trial._replace(trajectory=self.trial_trajectory(trial,
+                                                               trajectory))
+
+    def precompute_cv_values(self, trajectory):
+        """Evaluate the ``precompute_cvs`` for a trajectory.
+
+        Each CV is called once for the whole trajectory (which OPS
+        evaluates in one batch for ``MDTrajFunctionCV`` objects), while the
+        coordinates are still in memory. The values are kept in the CV's
+        cache, and saved with the snapshots. The CV's cache is part of the
+        storage, so this holds the lock of the ``async_writer``, if it is
+        running.
+
+        Parameters
+        ----------
+        trajectory : openpathsampling.Trajectory
+            the trajectory
+        """
+        if len(trajectory) == 0 or not self.precompute_cvs:
+            return
+        writer = getattr(self, '_writer', None)
+        if writer is not None:
+            with writer.lock:
+                for cv in self.precompute_cvs:
+                    cv(trajectory)
+        else:
+            for cv in self.precompute_cvs:
+                cv(trajectory)
+
+    def apply_trimmed_trial(self, trial):
+        """Update the converter state for a trimmed trial.
+
+        Trials must be applied in the order of the summary file, since the
+        shooting point may be given relative to the untrimmed version of
+        the previous accepted trial. This is also where the
+        ``precompute_cvs`` are evaluated for the trial trajectory.
+
+        Parameters
+        ----------
+        trial : :class:`.TrimmedTrial`
+            the trimmed trial, including its trajectory
+
+        Returns
+        -------
+        tuple
+            as for :meth:`.parse_summary_line`
+        """
+        shooting_index = trial.shooting_index
+        if trial.retrim_shooting:
+            if shooting_index >= 0:
+                shooting_index -= self.extra_bw_frames
+            else:
+                shooting_index += self.extra_fw_frames
+
+        if trial.extra_bw_frames is not None:
+            self.extra_bw_frames = trial.extra_bw_frames
+        if trial.extra_fw_frames is not None:
+            self.extra_fw_frames = trial.extra_fw_frames
+
+        self.precompute_cv_values(trial.trajectory)
+        return (trial.replica, trial.trajectory, shooting_index,
+                trial.accepted, trial.direction, trial.n_frames)
+
+    def parse_summary_line(self, line, file_data=None):
+        """Parse a line from the summary file.
+
+        To control the parsing, set the OneWayTPSConverter.options (see
+        :class:`.TPSConverterOptions`).
+
+        Parameters
+        ----------
+        line : str
+            the input line
+        file_data : object or None
+            if not None, the data for this line's trajectory file, from
+            :meth:`.read_trajectory_data`
+
+        Returns
+        -------
+        replica : 0
+            always zero for now
+        trial_trajectory : openpathsampling.Trajectory
+            one-way trial segments
+        shooting_point_index : int
+            index of the shooting point based on the previous trajectory
+            (None if no previous trajectory)
+        accepted : bool
+            whether the trial was accepted
+        direction : 1 or -1
+            positive if forward shooting, negative if backward
+        n_frames : int or None
+            number of frames in the one-way trial, if some frames of a
+            rejected trial were left out (see ``rejected_trials``)
+        """
+        trial = self.trim_summary_line(line, file_data)
+        return self.apply_trimmed_trial(trial)
+
+    def trim_summary_line_data(self, line):
+        """Trim a trial, returning the file data for its frames.
+
+        This does the work of :meth:`.trim_summary_line` that only depends
+        on the file, without making OPS snapshots. It is used by worker
+        processes (see the ``n_processes`` option to :meth:`.run`) and by
+        :meth:`.prepare_shard`.
+
+        Parameters
+        ----------
+        line : str
+            line from the summary file
+
+        Returns
+        -------
+        trial : :class:`.TrimmedTrial`
+            the trimmed trial, without its trajectory
+        data : object or None
+            the result of :meth:`.trial_data`
+        """
+        trial = self.cached_trim(line)
+        if trial is not None:
+            return trial, self.trial_data(trial, None)
+        file_name = self.summary_line_file_name(line)
+        file_data = self.read_trajectory_data(file_name)
+        if file_data is None:
+            trajectory = self.load_frames(file_name)
+        else:
+            trajectory = self.frames_from_data(file_name, file_data)
+        in_state = self.trimmer.in_state(trajectory)
+        self.save_in_state(file_name, in_state)
+        trial = self.trim_frames(line, in_state)
+        return trial, self.trial_data(trial, file_data)
+
+    def encode_trial_data(self, data):
+        """Arrays to store the result of :meth:`.trial_data` in a shard.
+
+        The default converts ``data`` to a single array. Subclasses with
+        other data must override this and :meth:`.decode_trial_data`.
+
+        Parameters
+        ----------
+        data : object
+            the result of :meth:`.trial_data` (not None)
+
+        Returns
+        -------
+        dict of str to numpy.ndarray
+            the arrays to store; keys must be valid file names
+        """
+        return {'data': np.asarray(data)}
+
+    def decode_trial_data(self, arrays):
+        """Inverse of :meth:`.encode_trial_data`"""
+        return arrays['data']
+
+    def prepare_shard(self, summary_file_name, shard_file, start_line=0,
+                      stop_line=None):
+        """Trim the trials for part of a summary file, and save them.
+
+        This is the first phase of a sharded conversion (see
+        :mod:`ops_piggybacker.shards`). It doesn't make any OPS steps, so
+        the converter can be created with ``storage=None``, and shards for
+        different ranges of lines can be prepared independently (e.g., on
+        different machines). Use :meth:`.assemble_shards` to make the steps.
+
+        Parameters
+        ----------
+        summary_file_name : str
+            the summary file
+        shard_file : str
+            the shard file to write
+        start_line : int
+            index of the first MC step line of the summary file to include
+        stop_line : int or None
+            index of the MC step line after the last one to include;
+            default (None) is the end of the file
+
+        Returns
+        -------
+        int
+            number of trials in the shard
+        """
+        if self.summary_root_dir is None:
+            self.summary_root_dir = os.path.dirname(summary_file_name)
+        lines = itertools.islice(summary_lines(summary_file_name),
+                                 start_line, stop_line)
+        with ShardWriter(shard_file, os.path.abspath(summary_file_name),
+                         start_line) as writer:
+            for line in lines:
+                trial, data = self.trim_summary_line_data(line)
+                if len(trial.frames) == 0 or data is None:
+                    arrays = None
+                else:
+                    arrays = self.encode_trial_data(data)
+                writer.add(trial, arrays)
+        return writer.n_trials
+
+    def assemble_shards(self, shard_files, n_trajs_per_block=None):
+        """Make the OPS steps from shards, in order.
+
+        This is the second phase of a sharded conversion: the shards made by
+        :meth:`.prepare_shard` must cover consecutive ranges of lines of the
+        same summary file. Trajectory files are only read for trials saved
+        without data. As with :meth:`.run`, a checkpoint is written each
+        time the storage is synced.
+
+        Parameters
+        ----------
+        shard_files : list of str
+            the shard files, in the order of their lines
+        n_trajs_per_block : int or None
+            number of steps for each block of the simulation (progress is
+            reported once per block); default (None) is all steps in one
+            block
+        """
+        infos = [shard_info(shard_file) for shard_file in shard_files]
+        if len(infos) == 0:
+            return
+        for (shard_file, prev, info) in zip(shard_files[1:], infos[:-1],
+                                            infos[1:]):
+            expected = prev['start_line'] + prev['n_trials']
+            if (info['summary_file'] != prev['summary_file']
+                    or info['start_line'] != expected):
+                raise RuntimeError("Shard " + shard_file + " doesn't "
+                                   + "continue from line " + str(expected)
+                                   + " of " + prev['summary_file'])
+
+        def trials():
+            for shard_file in shard_files:
+                for (fields, arrays) in read_shard(shard_file):
+                    trial = TrimmedTrial(trajectory=None, **fields)
+                    if arrays is None:
+                        data = None
+                    else:
+                        data = self.decode_trial_data(arrays)
+                    trajectory = self._trajectory_from_worker(trial, data)
+                    yield trial._replace(trajectory=trajectory)
+
+        self._run_trials(trials(), infos[0]['summary_file'],
+                         n_trajs_per_block, infos[0]['start_line'])
+
+    def _trajectory_from_worker(self, trial, file_data):
+        # worker processes return the file data for the kept frames only
+        if len(trial.frames) == 0:
+            trajectory, offset = paths.Trajectory([]), 0
+        elif file_data is None:
+            trajectory, offset = self.load_frames(trial.file_name), 0
+        else:
+            trajectory = self.frames_from_data(trial.file_name, file_data)
+            offset = min(trial.frames)
+        return self.trial_trajectory(trial, trajectory, offset)
+
+    def _parallel_trimmed_trials(self, lines, n_processes, n_prefetch,
+                                 prefetch_max_bytes):
+        # spawned (not forked) workers, so they don't inherit the open
+        # storage or the state of any threads (like the storage writer)
+        context = multiprocessing.get_context('spawn')
+        if n_processes is None:
+            n_processes = os.cpu_count()
+        executor = ProcessPoolExecutor(max_workers=n_processes,
+                                       mp_context=context,
+                                       initializer=_init_trim_worker,
+                                       initargs=(_worker_payload(self),))
+        nbytes = lambda line, result: data_nbytes(
+            result[1], self.summary_line_file_name(line)
+        )
+        n_ahead = max(n_prefetch, 2 * n_processes)
+        prefetcher = Prefetcher(_trim_in_worker, lines, n_ahead,
+                                max_bytes=prefetch_max_bytes, nbytes=nbytes,
+                                executor=executor)
+        try:
+            for (line, (trial, file_data)) in prefetcher:
+                trajectory = self._trajectory_from_worker(trial, file_data)
+                yield trial._replace(trajectory=trajectory)
+        finally:
+            executor.shutdown(wait=True)
+
+    def get_checkpoint_file(self):
+        """Name of the checkpoint file.
+
+        This is ``checkpoint_file`` if it is set, otherwise the storage file
+        name with ``.checkpoint`` appended.
+        """
+        if self.checkpoint_file is not None:
+            return self.checkpoint_file
+        elif self.storage is not None:
+            return self.storage.filename + ".checkpoint"
+        else:
+            return None
+
+    def write_checkpoint(self):
+        """Save the state needed to resume conversion.
+
+        This is called after each time the storage is synced (with
+        ``async_writer``, each time the writer is flushed), so the
+        checkpoint always matches the last step on disk. The checkpoint is
+        a small JSON file, written to :meth:`.get_checkpoint_file`.
+        """
+        checkpoint_file = self.get_checkpoint_file()
+        if checkpoint_file is None or self._checkpoint_position is None:
+            return
+        summary_file, first_line, first_step = self._checkpoint_position
+        checkpoint = {
+            'step': self.step,
+            'summary_file': summary_file,
+            'summary_line': first_line + self.step - first_step,
+            'extra_bw_frames': int(self.extra_bw_frames),
+            'extra_fw_frames': int(self.extra_fw_frames)
+        }
+        # write and rename, so a crash never leaves a partial checkpoint
+        tmp_file = checkpoint_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_file, checkpoint_file)
+
+    def sync_storage(self):
+        super(OneWayTPSConverter, self).sync_storage()
+        self.write_checkpoint()
+
+    def resume(self, summary_file_name=None, checkpoint_file=None,
+               follow=False, **kwargs):
+        """Continue a conversion that was interrupted.
+
+        The converter should be created in the same way as for the original
+        conversion, but with the storage opened in append (``'a'``) mode.
+        The simulation continues from the last step in storage, with the
+        trimming state from the checkpoint. If the checkpoint is missing or
+        behind the storage, the trimming state is recovered by trimming (but
+        not storing) the summary lines since the checkpoint (or the
+        beginning of the summary file).
+
+        Parameters
+        ----------
+        summary_file_name : str or None
+            the summary file; default (None) uses the one in the checkpoint
+        checkpoint_file : str or None
+            the checkpoint; default (None) uses :meth:`.get_checkpoint_file`
+        follow : bool
+            if True, continue with :meth:`.follow` instead of :meth:`.run`
+        kwargs :
+            other parameters are passed to :meth:`.run` (or
+            :meth:`.follow`)
+        """
+        if checkpoint_file is None:
+            checkpoint_file = self.get_checkpoint_file()
+        if os.path.isfile(checkpoint_file):
+            with open(checkpoint_file, 'r') as f:
+                checkpoint = json.load(f)
+        else:
+            checkpoint = {'step': 0, 'summary_file': None, 'summary_line': 0,
+                          'extra_bw_frames': self.extra_bw_frames,
+                          'extra_fw_frames': self.extra_fw_frames}
+
+        if summary_file_name is None:
+            summary_file_name = checkpoint['summary_file']
+        if summary_file_name is None:
+            raise RuntimeError("No checkpoint in " + str(checkpoint_file)
+                               + ": summary_file_name is required")
+
+        self.restore_from_storage()
+        if checkpoint['step'] > self.step:
+            raise RuntimeError("Checkpoint " + str(checkpoint_file)
+                               + " is ahead of the storage (step "
+                               + str(checkpoint['step']) + " vs. "
+                               + str(self.step) + ")")
+
+        self.extra_bw_frames = checkpoint['extra_bw_frames']
+        self.extra_fw_frames = checkpoint['extra_fw_frames']
+        if self.summary_root_dir is None:
+            self.summary_root_dir = os.path.dirname(summary_file_name)
+        checkpoint_line = checkpoint['summary_line']
+        start_line = checkpoint_line + self.step - checkpoint['step']
+        replay = itertools.islice(summary_lines(summary_file_name),
+                                  checkpoint_line, start_line)
+        for line in replay:
+            self.apply_trimmed_trial(self.trim_summary_line(line))
+
+        if follow:
+            self.follow(summary_file_name, start_line=start_line, **kwargs)
+        else:
+            self.run(summary_file_name, start_line=start_line, **kwargs)
+
+    def run(self, summary_file_name, n_trajs_per_block=None, n_prefetch=0,
+            prefetch_max_bytes=None, n_processes=1, start_line=0):
+        """Convert the steps in a summary file.
+
+        A checkpoint is written each time the storage is synced (see
+        :meth:`.write_checkpoint`); use :meth:`.resume` to continue an
+        interrupted conversion.
+
+        Parameters
+        ----------
+        summary_file_name : str
+            the summary file
+        n_trajs_per_block : int or None
+            number of steps for each block of the simulation (progress is
+            reported once per block); default (None) is all steps in one
+            block
+        n_prefetch : int
+            number of trajectory files to read ahead in background threads
+            (see :meth:`.read_trajectory_data`); 0 (default) reads each
+            file when it is needed
+        prefetch_max_bytes : int or None
+            approximate limit on the memory used by read-ahead data
+        n_processes : int or None
+            number of worker processes that load and trim the trajectory
+            files (see :meth:`.trim_summary_line`); None uses all cores.
+            The default (1) does everything in this process. The output is
+            the same either way. The workers are started with the 'spawn'
+            method, so a script that uses them must only start the
+            conversion under ``if __name__ == "__main__":``.
+        start_line : int
+            number of MC step lines at the beginning of the summary file to
+            skip (because they have already been converted)
+        """
         # this will basically create the move_info_list for part of the
         # summary_file, and then call super's RUN
-        summary = open(summary_file_name, 'r')
         if self.summary_root_dir is None:
             self.summary_root_dir = os.path.dirname(summary_file_name)
-        lines = [l for l in summary]
-        n_steps = len(lines)
+        lines = itertools.islice(summary_lines(summary_file_name),
+                                 start_line, None)
 
-        if n_trajs_per_block is None:
-            n_trajs_per_block = n_steps
+        if n_processes != 1:
+            trials = self._parallel_trimmed_trials(lines, n_processes,
+                                                   n_prefetch,
+                                                   prefetch_max_bytes)
+        elif n_prefetch > 0:
+            read_line = lambda line: self.read_trajectory_data(
+                self.summary_line_file_name(line)
+            )
+            nbytes = lambda line, data: data_nbytes(
+                data, self.summary_line_file_name(line)
+            )
+            lines_data = Prefetcher(read_line, lines, n_prefetch,
+                                    max_bytes=prefetch_max_bytes,
+                                    nbytes=nbytes)
+            trials = (self.trim_summary_line(line, file_data=data)
+                      for (line, data) in lines_data)
+        else:
+            # each line is trimmed just before it is applied, so the
+            # converter state is up to date for shared_frames
+            trials = (self.trim_summary_line(
+                line, n_shared=self.shared_frames(line)
+            ) for line in lines)
 
-        line_num = 0
-        while line_num < n_steps:
-            if self.report_progress is not None:
-                refresh_output("Working on MC step " + str(line_num) + "\n",
-                               output_stream=self.report_progress)
+        self._run_trials(trials, summary_file_name, n_trajs_per_block,
+                         start_line)
 
-            end = min(line_num + n_trajs_per_block, n_steps)
-            block = lines[line_num:end]
-            moves = [self.parse_summary_line(l) for l in block]
-            super(OneWayTPSConverter, self).run(moves)
-            line_num += n_trajs_per_block
+    def follow(self, summary_file_name, n_trajs_per_block=1,
+               poll_interval=1.0, timeout=None, sentinel="# END",
+               start_line=0):
+        """Convert the steps in a summary file while it is being written.
+
+        Each line is converted (and the step stored) as soon as the line
+        and its trajectory file are complete (see
+        :func:`.follow_summary_lines`). This stops when the ``sentinel``
+        line is read, or if nothing new happens for ``timeout`` seconds.
+        Since the storage is synced and checkpointed after each step, the
+        storage can be analyzed while the simulation is running, and an
+        interrupted conversion can be resumed.
+
+        Parameters
+        ----------
+        summary_file_name : str
+            the summary file; it doesn't need to exist yet
+        n_trajs_per_block : int or None
+            number of steps for each block of the simulation (progress is
+            reported once per block); default is 1
+        poll_interval : float
+            time between checks for new data, in seconds
+        timeout : float or None
+            stop if there is no new step for this long, in seconds; None
+            (default) waits for the ``sentinel``
+        sentinel : str or None
+            line that marks the end of the summary file (default ``# END``)
+        start_line : int
+            number of MC step lines at the beginning of the summary file to
+            skip (because they have already been converted)
+        """
+        if self.summary_root_dir is None:
+            self.summary_root_dir = os.path.dirname(summary_file_name)
+        lines = follow_summary_lines(summary_file_name,
+                                     poll_interval=poll_interval,
+                                     timeout=timeout, sentinel=sentinel,
+                                     data_file=self.summary_line_file_name,
+                                     n_skip=start_line)
+        trials = (self.trim_summary_line(
+            line, n_shared=self.shared_frames(line)
+        ) for line in lines)
+        self._run_trials(trials, summary_file_name, n_trajs_per_block,
+                         start_line)
+
+    def _run_trials(self, trials, summary_file_name, n_trajs_per_block,
+                    start_line):
+        # the summary file is read as the trials are needed, and each trial
+        # is applied just before its step is made, so that the converter
+        # state always matches the last step made (for checkpoints)
+        if n_trajs_per_block is not None:
+            n_rest_of_block = n_trajs_per_block - 1
+        else:
+            n_rest_of_block = None
+        first_step = self.step
+        self._checkpoint_position = (os.path.abspath(summary_file_name),
+                                     start_line, first_step)
+        try:
+            for first_trial in trials:
+                if self.report_progress is not None:
+                    line_num = start_line + self.step - first_step
+                    refresh_output("Working on MC step " + str(line_num)
+                                   + "\n", output_stream=self.report_progress)
+
+                block = itertools.chain(
+                    [first_trial], itertools.islice(trials, n_rest_of_block)
+                )
+                moves = (self.apply_trimmed_trial(trial) for trial in block)
+                super(OneWayTPSConverter, self).run(moves)
+        finally:
+            self._checkpoint_position = None
 
 
 class GromacsOneWayTPSConverter(OneWayTPSConverter):
+    """
+    One-way TPS converter for Gromacs (or any MDTraj-readable) files.
+
+    The topology file is only parsed once: the MDTraj topology, the OPS
+    topology, and the engine (snapshot descriptor) are reused for every
+    trajectory that is loaded. Files are trimmed as
+    :class:`.ArrayTrajectory` objects, so OPS snapshots are only made for
+    the frames that are stored.
+
+    If the states only depend on atoms given to MDTraj geometry functions
+    (see :func:`.state_atom_indices`), files are loaded in two passes: the
+    trimming pass only reads the coordinates of those atoms, and then all
+    coordinates are read for the frames of the one-way trial. Set
+    ``atom_subset_trimming=False`` to load all atoms in one pass.
+
+    XTC and TRR files can be trimmed while streaming (see
+    :meth:`.stream_summary_line`): they are read ``stream_chunk_size``
+    frames at a time, and reading stops once the trial is found. For full
+    trajectories, the frames shared with the current path are not read
+    (see :meth:`.shared_frames`).
+
+    Reading part of an XTC or TRR file needs the byte offset of each frame.
+    These are kept in a :class:`.FrameOffsetIndex` (``frame_index``), so
+    each file is only indexed once per converter. If ``frame_index_dir`` is
+    given (for example, :func:`.default_frame_index_dir`), the offsets are
+    also saved there, so later conversions of the same files can seek
+    straight to the frames they need.
+
+    For coordinate-free conversion (with ``cv_snapshots``), only the atoms
+    needed for the state CVs and the other stored CVs are loaded (if they
+    can be determined), and the trial frames aren't read again. The
+    coordinates can be loaded later with an :class:`.ExternalFrames`.
+
+    MDTraj and the OpenMM engine tools are imported when a converter is
+    created, not when ``ops_piggybacker`` is imported, so the rest of the
+    package works without them (they are optional in OPS).
+
+    Attributes
+    ----------
+    trim_atom_indices : numpy.ndarray of int or None
+        atoms loaded for the trimming pass; None if all atoms are loaded
+    stream_chunk_size : int
+        number of frames per chunk when streaming (default 100)
+    frame_index : :class:`.FrameOffsetIndex` or None
+        frame offsets for XTC/TRR files; None to let MDTraj find the
+        offsets each time a file is opened
+    """
     def __init__(self, storage, network, initial_file, topology_file,
-                 options=None, options_rejected=None):
+                 options=None, options_rejected=None,
+                 atom_subset_trimming=True, frame_index_dir=None,
+                 cv_snapshots=None, precompute_cvs=None):
+        self.frame_index = FrameOffsetIndex(frame_index_dir)
+        self.trim_atom_indices = None
         self.topology_file = topology_file
-        mover = oink.ShootingStub(ensemble=network.sampling_ensembles[0],
-                                  selector=paths.UniformSelector(),
-                                  pre_joined=False)
+        import mdtraj as md
+        from openpathsampling.engines.openmm.tools import TopologyEngine
+        from openpathsampling.engines.topology import MDTrajTopology
+        self.mdtraj_topology = md.load_topology(topology_file)
+        self.topology_engine = TopologyEngine(
+            MDTrajTopology(self.mdtraj_topology)
+        )
+        if cv_snapshots is not None:
+            stored_network = cv_snapshots.network
+        else:
+            stored_network = network
+        mover = oink.ShootingStub(
+            ensemble=stored_network.sampling_ensembles[0],
+            selector=paths.UniformSelector(),
+            pre_joined=False
+        )
 
         super(GromacsOneWayTPSConverter, self).__init__(
             storage=storage, network=network, initial_file=initial_file,
-            mover=mover, options=options, options_rejected=options_rejected
+            mover=mover, options=options, options_rejected=options_rejected,
+            cv_snapshots=cv_snapshots, precompute_cvs=precompute_cvs
         )
+        if atom_subset_trimming and cv_snapshots is not None:
+            self.trim_atom_indices = cv_atom_indices(cv_snapshots.cvs)
+        elif atom_subset_trimming:
+            self.trim_atom_indices = state_atom_indices(self.all_states)
+        if self.trim_atom_indices is not None:
+            self.trim_topology = self.mdtraj_topology.subset(
+                self.trim_atom_indices
+            )
+        else:
+            self.trim_topology = self.mdtraj_topology
+        self.stream_chunk_size = 100
 
     def load_trajectory(self, file_name):
         """Creates an OPS trajectory from the given file"""
-        return ops_load_trajectory(file_name, top=self.topology_file)
+        import mdtraj as md
+        return self.trajectory_from_data(
+            file_name, md.load(file_name, top=self.mdtraj_topology)
+        )
+
+    def load_frames(self, file_name):
+        """Loads the file as an :class:`.ArrayTrajectory`"""
+        return self.frames_from_data(
+            file_name, self.read_trajectory_data(file_name)
+        )
+
+    def read_trajectory_data(self, file_name):
+        """Loads the file (only ``trim_atom_indices``, if set) as an MDTraj
+        trajectory (thread-safe)"""
+        import mdtraj as md
+        return md.load(file_name, top=self.mdtraj_topology,
+                       atom_indices=self.trim_atom_indices)
+
+    def read_frame_range(self, file_name, start, stop):
+        """Loads all atoms for frames ``start:stop`` of the file as an
+        MDTraj trajectory (thread-safe)"""
+        import mdtraj as md
+        if (self.frame_index is not None
+                and self.frame_index.can_index(file_name)):
+            # XTC and TRR both give (xyz, time, step, box, ...)
+            data = self.frame_index.read(file_name, start, stop)
+            trajectory = md.Trajectory(data[0], self.mdtraj_topology,
+                                       time=data[1])
+            trajectory.unitcell_vectors = data[3]
+            return trajectory
+        chunks = md.iterload(file_name, top=self.mdtraj_topology,
+                             chunk=stop - start, skip=start)
+        return next(iter(chunks))[:stop - start]
+
+    def frame_chunks(self, file_name, from_end=False, origin=None):
+        """Reads XTC and TRR files in chunks of ``stream_chunk_size``
+        frames (only ``trim_atom_indices``, if set)"""
+        extension = os.path.splitext(file_name)[1].lower()
+        if extension not in ['.xtc', '.trr']:
+            return None
+        n_frames = xdr_n_frames(file_name, self.frame_index)
+        if origin is None:
+            origin = n_frames if from_end else 0
+        elif origin < 0:
+            origin += n_frames
+        chunk = self.stream_chunk_size
+        if from_end:
+            bounds = [(max(0, stop - chunk), stop)
+                      for stop in range(origin, 0, -chunk)]
+        else:
+            bounds = [(start, min(start + chunk, n_frames))
+                      for start in range(origin, n_frames, chunk)]
+        return n_frames, self._xdr_chunks(file_name, bounds)
+
+    def _xdr_chunks(self, file_name, bounds):
+        for (start, stop) in bounds:
+            # XTC and TRR both give (xyz, time, step, box, ...)
+            data = read_xdr_frames(file_name, start, stop,
+                                   atom_indices=self.trim_atom_indices,
+                                   frame_index=self.frame_index)
+            yield start, ArrayTrajectory(
+                coordinates=data[0],
+                box_vectors=data[3],
+                velocities=None,
+                engine=self.topology_engine,
+                atom_indices=self.trim_atom_indices,
+                topology=self.trim_topology
+            )
+
+    def frames_from_data(self, file_name, data):
+        """Wraps an MDTraj trajectory (without copying) for trimming"""
+        if data.n_atoms != self.mdtraj_topology.n_atoms:
+            atom_indices = self.trim_atom_indices
+        else:
+            atom_indices = None
+        return ArrayTrajectory.from_mdtraj(data, self.topology_engine,
+                                           atom_indices=atom_indices)
+
+    def trial_trajectory(self, trial, trajectory, offset=0):
+        """Loads all atoms for the trial's frames, if only some atoms were
+        used for trimming (not needed for coordinate-free conversion)"""
+        if (trajectory.atom_indices is not None
+                and self.cv_snapshots is None):
+            if len(trial.frames) == 0:
+                return paths.Trajectory([])
+            offset = int(min(trial.frames))
+            data = self.read_frame_range(trial.file_name, offset,
+                                         int(max(trial.frames)) + 1)
+            trajectory = self.frames_from_data(trial.file_name, data)
+        return super(GromacsOneWayTPSConverter, self).trial_trajectory(
+            trial, trajectory, offset
+        )
+
+    def load_trial(self, trial):
+        """Loads only the trial's frames"""
+        if len(trial.frames) == 0:
+            return paths.Trajectory([])
+        start = int(min(trial.frames))
+        data = self.read_frame_range(trial.file_name, start,
+                                     int(max(trial.frames)) + 1)
+        trajectory = self.frames_from_data(trial.file_name, data)
+        return self.trial_trajectory(trial, trajectory, start)
+
+    def trial_data(self, trial, file_data):
+        """Loads all atoms for the trial's frames, if only some atoms were
+        used for trimming (or the file hasn't been read)"""
+        all_atoms_needed = (self.trim_atom_indices is not None
+                            and self.cv_snapshots is None)
+        if ((all_atoms_needed or file_data is None)
+                and len(trial.frames) > 0):
+            return self.read_frame_range(trial.file_name,
+                                         int(min(trial.frames)),
+                                         int(max(trial.frames)) + 1)
+        return super(GromacsOneWayTPSConverter, self).trial_data(trial,
+                                                                 file_data)
+
+    def encode_trial_data(self, data):
+        """Coordinates (and box vectors) of an MDTraj trajectory"""
+        arrays = {'xyz': data.xyz}
+        if data.unitcell_vectors is not None:
+            arrays['box'] = data.unitcell_vectors
+        return arrays
+
+    def decode_trial_data(self, arrays):
+        """MDTraj trajectory from :meth:`.encode_trial_data`"""
+        import mdtraj as md
+        if arrays['xyz'].shape[1] == self.mdtraj_topology.n_atoms:
+            topology = self.mdtraj_topology
+        else:
+            topology = self.trim_topology
+        trajectory = md.Trajectory(arrays['xyz'], topology)
+        if 'box' in arrays:
+            trajectory.unitcell_vectors = arrays['box']
+        return trajectory
+
+    def trajectory_from_data(self, file_name, data):
+        """Creates an OPS trajectory from an MDTraj trajectory"""
+        # same as OPS's trajectory_from_mdtraj, but with our engine
+        return self.frames_from_data(file_name, data).to_trajectory()
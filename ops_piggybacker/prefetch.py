@@ -0,0 +1,168 @@
+"""
+Read-ahead of trajectory files in background threads
+
+Converting is a loop of "load a file, then trim and store it." On slow
+filesystems, a large part of the wall time is spent waiting for the load.
+The :class:`.Prefetcher` runs the loading for the next few items in
+background threads while the main thread works on the current one.
+
+Only thread-safe work should be done in the background. In particular, OPS
+objects (snapshots, trajectories) should be created in the main thread,
+since OPS does not assign UUIDs in a thread-safe way.
+"""
+
+import collections
+import os
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def data_nbytes(data, file_name=None):
+    """Estimate the memory used by prefetched data.
+
+    Parameters
+    ----------
+    data : object
+        the data returned by the prefetch function. Arrays (or objects with
+        an ``xyz`` array, like ``mdtraj.Trajectory``) report their size;
+        for anything else, the size of ``file_name`` is used.
+    file_name : str
+        the file the data was read from
+
+    Returns
+    -------
+    int
+        estimated number of bytes
+    """
+    if hasattr(data, 'xyz'):
+        data = data.xyz
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    elif file_name is not None and os.path.isfile(file_name):
+        return os.path.getsize(file_name)
+    else:
+        return 0
+
+
+class Prefetcher(object):
+    """Apply a function to upcoming items in background threads.
+
+    Iterating over the prefetcher gives ``(item, result)`` pairs, in the
+    order of ``items``. Exceptions from ``function`` are raised when the
+    corresponding item is reached. If iteration stops early (``break``, an
+    exception, or closing the iterator), the items that haven't started are
+    cancelled, and the prefetcher doesn't wait for the running ones.
+
+    Parameters
+    ----------
+    function : callable
+        function of a single item; must be thread-safe
+    items : iterable
+        the items; this is consumed lazily, in the main thread
+    n_prefetch : int
+        maximum number of items being worked on or waiting to be used
+        (queue depth); must be at least 1
+    max_bytes : int or None
+        if not None, don't start on new items while the results waiting to
+        be used (including an estimate for those in progress) are larger
+        than this. At least one item is always worked on.
+    nbytes : callable
+        function taking ``(item, result)`` and returning the memory used by
+        the result, in bytes
+    executor : concurrent.futures.Executor or None
+        executor to run ``function`` in; default (None) uses a thread pool
+        with ``n_prefetch`` threads. If given, the caller is responsible for
+        shutting it down (and ``function`` must be suitable for it).
+    """
+    def __init__(self, function, items, n_prefetch, max_bytes=None,
+                 nbytes=None, executor=None):
+        if n_prefetch < 1:
+            raise ValueError("n_prefetch must be at least 1, not "
+                             + str(n_prefetch))
+        if nbytes is None:
+            nbytes = lambda item, result: data_nbytes(result)
+        self.function = function
+        self.items = items
+        self.n_prefetch = n_prefetch
+        self.max_bytes = max_bytes
+        self.nbytes = nbytes
+        self.executor = executor
+        self._sizes = {}
+        self._mean_nbytes = 0.0
+        self._n_used = 0
+
+    def _result_nbytes(self, item, future):
+        if future not in self._sizes:
+            try:
+                self._sizes[future] = self.nbytes(item, future.result())
+            except Exception:
+                self._sizes[future] = 0
+        return self._sizes[future]
+
+    def _bytes_ahead(self, pending):
+        # finished results have a known size; use the average size of the
+        # results so far as an estimate for the others
+        done = [self._result_nbytes(item, future)
+                for (item, future) in pending if future.done()]
+        n_running = len(pending) - len(done)
+        if self._n_used > 0:
+            estimate = self._mean_nbytes
+        elif len(done) > 0:
+            estimate = float(sum(done)) / len(done)
+        elif n_running > 0:
+            return float("inf")  # no idea yet; wait until we know
+        else:
+            estimate = 0.0
+        return sum(done) + n_running * estimate
+
+    def _can_submit(self, pending):
+        if len(pending) == 0:
+            return True
+        elif len(pending) >= self.n_prefetch:
+            return False
+        elif self.max_bytes is None:
+            return True
+        else:
+            return self._bytes_ahead(pending) < self.max_bytes
+
+    def _used(self, item, future):
+        size = self._result_nbytes(item, future)
+        del self._sizes[future]
+        self._n_used += 1
+        self._mean_nbytes += (size - self._mean_nbytes) / self._n_used
+
+    def __iter__(self):
+        items = iter(self.items)
+        pending = collections.deque()
+        if self.executor is None:
+            executor = ThreadPoolExecutor(max_workers=self.n_prefetch)
+        else:
+            executor = self.executor
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and self._can_submit(pending):
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        exhausted = True
+                    else:
+                        future = executor.submit(self.function, item)
+                        pending.append((item, future))
+
+                if len(pending) == 0:
+                    break
+
+                item, future = pending.popleft()
+                result = future.result()
+                self._used(item, future)
+                yield (item, result)
+        finally:
+            # if iteration stops early, don't start the items waiting in
+            # the queue, and don't wait for the ones that are running
+            for (item, future) in pending:
+                future.cancel()
+            if self.executor is None:
+                executor.shutdown(wait=False)
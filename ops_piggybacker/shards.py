@@ -0,0 +1,165 @@
+"""
+Intermediate files for sharded (two-phase) conversion
+
+Most of the work in a conversion is loading and trimming each trial, which
+only depends on the trial's file and the converter options. Only the
+bookkeeping (the shooting point shifts and the OPS steps) must be done in
+order. So a conversion can be split into two phases:
+
+1. *prepare* (:meth:`.OneWayTPSConverter.prepare_shard`): trim the trials
+   for a range of lines of the summary file, and write them to a shard
+   file. Shards are independent, so they can be prepared on different
+   machines.
+2. *assemble* (:meth:`.OneWayTPSConverter.assemble_shards`): read the shards
+   in order and make the OPS steps.
+
+A shard file is an uncompressed NumPy ``.npz`` archive. For each trial, it
+has the trimmed trial's metadata (as JSON), the file frame index of each
+frame of the trial, and the coordinate data for the frames from the first
+to the last one in the trial (as returned by
+:meth:`.OneWayTPSConverter.encode_trial_data`). Arrays are written one at a
+time, and read back one trial at a time.
+"""
+
+import json
+import os
+import zipfile
+
+import numpy as np
+
+SHARD_FORMAT_VERSION = 1
+
+# TrimmedTrial fields stored as JSON (frames and trajectory are not)
+_META_FIELDS = ['replica', 'file_name', 'reverse', 'shooting_index',
+                'accepted', 'direction', 'retrim_shooting',
+                'extra_bw_frames', 'extra_fw_frames', 'n_frames']
+
+
+def _json_value(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class ShardWriter(object):
+    """Write trimmed trials to a shard file.
+
+    The shard is written to a temporary file, which is renamed to
+    ``shard_file`` when the writer is closed, so an interrupted prepare
+    phase never leaves an incomplete shard. Use it as a context manager.
+
+    Parameters
+    ----------
+    shard_file : str
+        the shard file to write
+    summary_file : str
+        the summary file the trials come from
+    start_line : int
+        index of the first trial's line among the MC step lines of the
+        summary file
+    """
+    def __init__(self, shard_file, summary_file, start_line):
+        self.shard_file = shard_file
+        self.summary_file = summary_file
+        self.start_line = start_line
+        self.n_trials = 0
+        self._tmp_file = shard_file + ".tmp"
+        self._zip = zipfile.ZipFile(self._tmp_file, 'w', allowZip64=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._zip.close()
+            os.remove(self._tmp_file)
+
+    def _write_array(self, name, array):
+        with self._zip.open(name + ".npy", 'w', force_zip64=True) as f:
+            np.lib.format.write_array(f, np.asanyarray(array),
+                                      allow_pickle=False)
+
+    def add(self, trial, arrays):
+        """Add a trial.
+
+        Parameters
+        ----------
+        trial : :class:`.TrimmedTrial`
+            the trimmed trial (its trajectory isn't stored)
+        arrays : dict of str to numpy.ndarray, or None
+            the encoded data for the trial's frames; None if there is no
+            data (then the trajectory file is loaded when assembling)
+        """
+        prefix = "trial_" + str(self.n_trials) + "_"
+        meta = {field: _json_value(getattr(trial, field))
+                for field in _META_FIELDS}
+        meta['data_keys'] = sorted(arrays) if arrays is not None else None
+        self._write_array(prefix + "meta", np.array(json.dumps(meta)))
+        self._write_array(prefix + "frames",
+                          np.asarray(trial.frames, dtype=np.int64))
+        for (key, array) in (arrays or {}).items():
+            self._write_array(prefix + "data_" + key, array)
+        self.n_trials += 1
+
+    def close(self):
+        """Finish the shard and move it into place"""
+        info = {'version': SHARD_FORMAT_VERSION,
+                'summary_file': self.summary_file,
+                'start_line': self.start_line,
+                'n_trials': self.n_trials}
+        self._write_array("shard", np.array(json.dumps(info)))
+        self._zip.close()
+        os.replace(self._tmp_file, self.shard_file)
+
+
+def shard_info(shard_file):
+    """Information about a shard.
+
+    Parameters
+    ----------
+    shard_file : str
+        the shard file
+
+    Returns
+    -------
+    dict
+        ``summary_file``, ``start_line``, and ``n_trials`` for the shard
+    """
+    with np.load(shard_file, allow_pickle=False) as shard:
+        info = json.loads(str(shard['shard']))
+    if info['version'] != SHARD_FORMAT_VERSION:  # pragma: no cover
+        raise RuntimeError("Unsupported shard format version "
+                           + str(info['version']) + " in " + shard_file)
+    return info
+
+
+def read_shard(shard_file):
+    """Iterate over the trials in a shard.
+
+    Parameters
+    ----------
+    shard_file : str
+        the shard file
+
+    Yields
+    ------
+    trial : dict
+        the :class:`.TrimmedTrial` fields (except ``trajectory``)
+    arrays : dict of str to numpy.ndarray, or None
+        the encoded data for the trial's frames
+    """
+    n_trials = shard_info(shard_file)['n_trials']
+    with np.load(shard_file, allow_pickle=False) as shard:
+        for idx in range(n_trials):
+            prefix = "trial_" + str(idx) + "_"
+            trial = json.loads(str(shard[prefix + "meta"]))
+            data_keys = trial.pop('data_keys')
+            trial['frames'] = shard[prefix + "frames"]
+            if data_keys is None:
+                arrays = None
+            else:
+                arrays = {key: shard[prefix + "data_" + key]
+                          for key in data_keys}
+            yield trial, arrays
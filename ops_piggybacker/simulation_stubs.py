@@ -1,4 +1,76 @@
 import openpathsampling as paths
+from openpathsampling.netcdfplus import LoaderProxy
+from .storage_writer import StorageWriter
+
+REJECTED_TRIAL_POLICIES = ['full', 'truncated', 'endpoints']
+
+
+def rejected_segment_indices(n_frames, direction, policy, max_frames=None):
+    """Frames of a rejected one-way segment to keep in storage.
+
+    Frames are dropped from the middle of the segment: the frames next to
+    the shooting point and the last frame generated (which shows where the
+    trial ended) are always kept.
+
+    Parameters
+    ----------
+    n_frames : int
+        number of frames in the one-way segment
+    direction : 1 or -1
+        positive if forward shooting, negative if backward
+    policy : str
+        ``'full'`` keeps all frames; ``'truncated'`` keeps at most
+        ``max_frames`` frames; ``'endpoints'`` keeps only the first and last
+        frames of the segment
+    max_frames : int or None
+        maximum number of frames for the ``'truncated'`` policy (at least 2)
+
+    Returns
+    -------
+    list of int or None
+        indices of the frames to keep, in order; None to keep all frames
+    """
+    if policy not in REJECTED_TRIAL_POLICIES:
+        raise ValueError("Unknown policy for rejected trials: "
+                         + str(policy))
+    if policy == 'full':
+        return None
+    n_keep = 2 if policy == 'endpoints' else max_frames
+    if n_keep is None or n_keep < 2:
+        raise ValueError("Truncated rejected trials must keep at least 2 "
+                         + "frames")
+    if n_frames <= n_keep:
+        return None
+    if direction > 0:
+        return list(range(n_keep - 1)) + [n_frames - 1]
+    else:
+        return [0] + list(range(n_frames - n_keep + 1, n_frames))
+
+
+def trial_length(step):
+    """Length of the trial trajectory of a shooting step.
+
+    For rejected trials stored with a placeholder trajectory (see the
+    ``rejected_trials`` attribute of :class:`.ShootingPseudoSimulator`),
+    this is the length of the trial that was actually generated, not the
+    length of the stored trajectory.
+
+    Parameters
+    ----------
+    step : openpathsampling.MCStep
+        a step made by a :class:`.ShootingPseudoSimulator`
+
+    Returns
+    -------
+    int
+        number of frames in the trial trajectory
+    """
+    inner = step.change.subchange.subchange
+    length = getattr(inner.details, 'trial_length', None)
+    if length is None:
+        length = len(inner.trials[0].trajectory)
+    return length
+
 
 class ShootingPseudoSimulator(paths.PathSimulator):
     """Pseudo-simulator for shooting-only mimics.
@@ -13,6 +85,41 @@ class ShootingPseudoSimulator(paths.PathSimulator):
         stub to mimic the shooting mover
     network : openpathsampling.TransitionNetwork
         transition network with information about this system
+
+    Attributes
+    ----------
+    bounded_memory : bool
+        if True, memory use doesn't grow with the number of steps (apart
+        from the storage's index of saved objects). The storage is switched
+        to the ``'lowmemory'`` caching mode, and after each sync the stored
+        parents of the active samples are replaced by proxies that load them
+        from storage, so that the chain of ancestors (with their
+        trajectories and changes) doesn't stay in memory. Since saved
+        trajectories refer to their snapshots through the storage, they
+        can't be used after the storage is closed. Default False.
+    async_writer : bool
+        if True, steps are saved and the storage is synced by a
+        :class:`.StorageWriter` in a background thread, while the next steps
+        are made. The syncs every ``save_frequency`` steps are done by the
+        writer; :meth:`.sync_storage` (called at the end of :meth:`.run`)
+        waits until everything is on disk, and raises any error from
+        writing. This isn't used with ``bounded_memory``: then the steps
+        are made from objects that are loaded from the storage through
+        proxies, which can't be done while the storage is being written, so
+        steps are saved in the main thread. Default False.
+    rejected_trials : str
+        what to store for the new frames of rejected trials (see
+        :func:`.rejected_segment_indices`): ``'full'`` (default),
+        ``'truncated'`` (at most ``rejected_max_frames`` frames), or
+        ``'endpoints'``. The shooting point and the frames shared with the
+        input trajectory are always stored. If frames are dropped, the
+        length of the real trial is saved as ``trial_length`` in the
+        details of the move change (see :func:`.trial_length`). The
+        :class:`.OneWayTPSConverter` applies this when trimming, so it
+        never makes snapshots for the dropped frames.
+    rejected_max_frames : int
+        maximum number of new frames stored for rejected trials with the
+        ``'truncated'`` policy. Default 100.
     """
     def __init__(self, storage, initial_conditions, mover, network):
         super(ShootingPseudoSimulator, self).__init__(storage)
@@ -26,71 +133,203 @@ class ShootingPseudoSimulator(paths.PathSimulator):
         self.network = network
         self.root_mover = self.scheme.move_decision_tree()
         self._path_sim_mover = paths.PathSimulatorMover(mover.mimic, self)
+        self._initial_step_saved = False
+        self.bounded_memory = False
+        self.async_writer = False
+        self.rejected_trials = 'full'
+        self.rejected_max_frames = 100
+        self._writer = None
 
+    def sync_storage(self):
+        if self._writer is not None:
+            self._writer.flush()
+        else:
+            super(ShootingPseudoSimulator, self).sync_storage()
+        if self.bounded_memory and self.storage is not None:
+            self.proxy_stored_ancestry()
+
+    def proxy_stored_ancestry(self):
+        """Replace stored parents of the active samples with proxies.
+
+        The proxies load the parent from storage when it is used, so the
+        ancestry doesn't need to stay in memory.
+        """
+        samples_store = self.storage.samples
+        for sample in self.sample_set:
+            parent = sample.parent
+            if (parent is not None and type(parent) is not LoaderProxy
+                    and parent.__uuid__ in samples_store.index):
+                sample.parent = samples_store.proxy(parent)
+
+    def restore_from_storage(self):
+        """Continue from the last MC step in storage.
+
+        The move scheme and movers saved in the storage are reused, so that
+        steps added afterward are part of the same simulation. The storage
+        must be open in append mode.
+        """
+        steps = self.storage.steps
+        last_step = steps[-1]
+        self.scheme = self.storage.schemes[0]
+        self.mover.mimic = self.scheme.movers['shooting'][0]
+        self.root_mover = self.scheme.move_decision_tree()
+        if last_step.mccycle > 0:
+            self._path_sim_mover = last_step.change.mover
+        else:
+            self._path_sim_mover = paths.PathSimulatorMover(self.mover.mimic,
+                                                            self)
+        self.initial_conditions = steps[0].active
+        self.sample_set = last_step.active
+        self.step = last_step.mccycle
+        self._initial_step_saved = True
+
+    def _rejected_placeholder(self, input_trajectory, trial_trajectory,
+                              shooting_point_index, direction, n_segment):
+        # returns the trial to store and the length of the real trial
+        if self.mover.pre_joined:
+            if direction > 0:
+                shared = trial_trajectory[:shooting_point_index + 1]
+                segment = trial_trajectory[shooting_point_index + 1:]
+            else:
+                n_shared = len(input_trajectory) - shooting_point_index
+                shared = trial_trajectory[len(trial_trajectory) - n_shared:]
+                segment = trial_trajectory[:len(trial_trajectory) - n_shared]
+            n_shared = len(shared)
+        else:
+            segment = trial_trajectory
+            if direction > 0:
+                n_shared = shooting_point_index + 1
+            else:
+                n_shared = len(input_trajectory) - shooting_point_index
+        if n_segment is None:
+            n_segment = len(segment)
+
+        keep = rejected_segment_indices(len(segment), direction,
+                                        self.rejected_trials,
+                                        self.rejected_max_frames)
+        if keep is not None:
+            segment = paths.Trajectory([segment[i] for i in keep])
+            if self.mover.pre_joined:
+                if direction > 0:
+                    trial_trajectory = paths.Trajectory(list(shared)
+                                                        + list(segment))
+                else:
+                    trial_trajectory = paths.Trajectory(list(segment)
+                                                        + list(shared))
+            else:
+                trial_trajectory = segment
+        return trial_trajectory, n_shared + n_segment
 
     def run(self, step_info_list):
         """
         Parameters
         ----------
-        step_info_list : list of tuple
+        step_info_list : iterable of tuple
             (replica, trial_trajectory, shooting_point_index, accepted) or
             (replica, one_way_trial_segment, shooting_point_index, accepted,
-            direction)
+            direction). A sixth element, if given and not None, is the
+            number of frames in the one-way segment that was generated,
+            if some of them were already dropped (as for the
+            ``rejected_trials`` policy).
         """
         mcstep = None
 
-        if self.step == 0:
+        if self.bounded_memory and self.storage is not None:
+            self.storage.set_caching_mode('lowmemory')
+
+        if self.step == 0 and not self._initial_step_saved:
             if self.storage is not None:
                 self.storage.save(self.scheme)
             self.save_initial_step()
+            self._initial_step_saved = True
 
-        for step_info in step_info_list:
-            self.step += 1
-            if len(step_info) == 4 and not self.mover.pre_joined: # pragma: no-cover
-                raise RuntimeError(
-                    "Shooting trial trajectories not pre-joined: " +
-                    "step_info must be (replica, trial_segment, " +
-                    "shooting_pt_idx, accepted, direction)")
-
-            replica = step_info[0]
-            trial_trajectory = step_info[1]
-            shooting_point_index = step_info[2]
-            accepted = step_info[3]
-            direction = None
-            if len(step_info) == 5:
-                direction = step_info[4]
-
-            input_sample = self.sample_set[replica]
-
-            if shooting_point_index < 0:
-                shooting_point_index += len(input_sample.trajectory)
-
-            shooting_point = input_sample.trajectory[shooting_point_index]
-
-            subchange = self.mover.move(input_sample, trial_trajectory,
-                                        shooting_point, accepted, direction)
-
-            change = paths.PathSimulatorMoveChange(
-                subchange=subchange,
-                mover=self._path_sim_mover,
-                details=paths.Details(step=self.step)
-            )
-            samples = change.results
-            new_sampleset = self.sample_set.apply_samples(samples)
-            mcstep = paths.MCStep(
-                simulation=self,
-                mccycle=self.step,
-                previous=self.sample_set,
-                active=new_sampleset,
-                change=change
-            )
+        # OPS storage isn't thread-safe, and with bounded_memory, making
+        # the steps loads objects from storage
+        if (self.async_writer and not self.bounded_memory
+                and self.storage is not None):
+            self._writer = StorageWriter(self.storage)
 
-            if self.storage is not None:
-                self.storage.steps.save(mcstep)
-            if self.step % self.save_frequency == 0:
-                self.sample_set.sanity_check()
-                self.sync_storage()
+        try:
+            for step_info in step_info_list:
+                self.step += 1
+                if (len(step_info) == 4
+                        and not self.mover.pre_joined):  # pragma: no-cover
+                    raise RuntimeError(
+                        "Shooting trial trajectories not pre-joined: " +
+                        "step_info must be (replica, trial_segment, " +
+                        "shooting_pt_idx, accepted, direction)")
+
+                replica = step_info[0]
+                trial_trajectory = step_info[1]
+                shooting_point_index = step_info[2]
+                accepted = step_info[3]
+                direction = None
+                if len(step_info) >= 5:
+                    direction = step_info[4]
+                n_segment = None
+                if len(step_info) >= 6:
+                    n_segment = step_info[5]
+
+                input_sample = self.sample_set[replica]
+
+                if shooting_point_index < 0:
+                    shooting_point_index += len(input_sample.trajectory)
+
+                shooting_point = input_sample.trajectory[shooting_point_index]
+
+                n_trial_frames = None
+                if not accepted and (self.rejected_trials != 'full'
+                                     or n_segment is not None):
+                    if direction is None:
+                        choice = self.mover._scan_choice(
+                            trial_trajectory, input_sample.trajectory
+                        )
+                        direction = 1 if choice == 0 else -1
+                    (trial_trajectory, n_trial_frames) = (
+                        self._rejected_placeholder(
+                            input_sample.trajectory, trial_trajectory,
+                            shooting_point_index, direction, n_segment
+                        )
+                    )
+
+                subchange = self.mover.move(input_sample, trial_trajectory,
+                                            shooting_point, accepted,
+                                            direction, shooting_point_index)
+                inner_change = subchange.subchange
+                if (n_trial_frames is not None and n_trial_frames
+                        != len(inner_change.trials[0].trajectory)):
+                    inner_change.details.trial_length = n_trial_frames
+
+                change = paths.PathSimulatorMoveChange(
+                    subchange=subchange,
+                    mover=self._path_sim_mover,
+                    details=paths.Details(step=self.step)
+                )
+                samples = change.results
+                new_sampleset = self.sample_set.apply_samples(samples)
+                mcstep = paths.MCStep(
+                    simulation=self,
+                    mccycle=self.step,
+                    previous=self.sample_set,
+                    active=new_sampleset,
+                    change=change
+                )
+
+                if self._writer is not None:
+                    self._writer.save(mcstep, self.storage.steps)
+                elif self.storage is not None:
+                    self.storage.steps.save(mcstep)
+                if self.step % self.save_frequency == 0:
+                    self.sample_set.sanity_check()
+                    if self._writer is not None:
+                        self._writer.sync()
+                    else:
+                        self.sync_storage()
 
-            self.sample_set = new_sampleset
+                self.sample_set = new_sampleset
 
-        self.sync_storage()
+            self.sync_storage()
+        finally:
+            if self._writer is not None:
+                writer, self._writer = self._writer, None
+                writer.close()
@@ -0,0 +1,224 @@
+"""
+On-disk cache of per-frame state indicators
+
+Trimming a trial only depends on which frames of its file are in a state
+(see :mod:`ops_piggybacker.trimming`). Conversions of the same files with
+different :class:`.TPSConverterOptions` evaluate the same indicators again,
+and the CV evaluation is usually the expensive part. A
+:class:`.StateIndicatorCache` saves the indicator for each file, keyed by
+the file's content hash and a fingerprint of the state volume (see
+:func:`.volume_fingerprint`), so later conversions only need to load the
+frames they keep.
+
+Each entry is stored as the boundaries of the runs of frames outside all
+states (see :func:`.out_of_state_runs`), which are also the boundaries of
+all the trimming segments. Entries can cover only part of a file, as when
+trimming stopped early (see :meth:`.OneWayTPSConverter.stream_summary_line`).
+When ``max_bytes`` is given, the least recently used entries are removed to
+keep the cache below that size.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from .trimming import out_of_state_runs, volume_fingerprint
+
+
+def file_hash(file_name, block_size=2**22):
+    """SHA-1 hash of the contents of a file.
+
+    Parameters
+    ----------
+    file_name : str
+        the file
+    block_size : int
+        number of bytes to read at a time
+
+    Returns
+    -------
+    str
+        hex digest of the file contents
+    """
+    sha = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        block = f.read(block_size)
+        while block:
+            sha.update(block)
+            block = f.read(block_size)
+    return sha.hexdigest()
+
+
+class StateIndicatorCache(object):
+    """Per-frame state indicators for trajectory files, saved between runs.
+
+    The content hash of a file is itself remembered by path, size, and
+    modification time, so an unchanged file is only read once. Several
+    processes can share the same directory.
+
+    Parameters
+    ----------
+    cache_dir : str
+        directory for the cache
+    states : openpathsampling.Volume
+        volume that is the union of all the states
+    max_bytes : int or None
+        maximum total size of the saved indicators; None (default) for no
+        limit
+    """
+    def __init__(self, cache_dir, states, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.states = states
+        self.max_bytes = max_bytes
+        self.fingerprint = volume_fingerprint(states)
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # locks can't be pickled (e.g., to send the cache to a worker)
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _path(self, subdir, name):
+        directory = os.path.join(self.cache_dir, subdir)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, name)
+
+    @staticmethod
+    def _write(path, write):
+        # write and rename, so other processes never see a partial file
+        tmp_file = (path + "." + str(os.getpid()) + "-"
+                    + str(threading.get_ident()) + ".tmp")
+        with open(tmp_file, 'wb') as f:
+            write(f)
+        os.replace(tmp_file, path)
+
+    def file_hash(self, file_name):
+        """Content hash of a file, read again only if the file changed"""
+        stat = os.stat(file_name)
+        key = [os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns]
+        with self._lock:
+            if key[0] in self._hashes and self._hashes[key[0]][0] == key:
+                return self._hashes[key[0]][1]
+
+        path_digest = hashlib.sha1(key[0].encode('utf-8')).hexdigest()
+        hash_file = self._path('hashes', path_digest + ".json")
+        digest = None
+        if os.path.isfile(hash_file):
+            try:
+                with open(hash_file, 'r') as f:
+                    saved = json.load(f)
+                if saved['key'] == key:
+                    digest = saved['hash']
+            except (IOError, OSError, ValueError, KeyError):
+                pass  # unreadable; hash the file again
+        if digest is None:
+            digest = file_hash(file_name)
+            contents = json.dumps({'key': key, 'hash': digest})
+            self._write(hash_file,
+                        lambda f: f.write(contents.encode('utf-8')))
+        with self._lock:
+            self._hashes[key[0]] = (key, digest)
+        return digest
+
+    def _entry_file(self, file_name):
+        name = self.file_hash(file_name) + "-" + self.fingerprint + ".npz"
+        return self._path('indicators', name)
+
+    def get(self, file_name):
+        """Saved state indicator for a file.
+
+        Parameters
+        ----------
+        file_name : str
+            the trajectory file
+
+        Returns
+        -------
+        tuple or None
+            ``(in_state, start, stop)``, where ``in_state`` has a value for
+            each frame of the file, but is only known for the frames
+            ``start:stop`` (the others are True); None if nothing is saved
+            for this file
+        """
+        entry_file = self._entry_file(file_name)
+        try:
+            with np.load(entry_file) as entry:
+                n_frames = int(entry['n_frames'])
+                start, stop = int(entry['start']), int(entry['stop'])
+                run_starts = entry['run_starts']
+                run_stops = entry['run_stops']
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        try:
+            os.utime(entry_file)  # mark as recently used
+        except OSError:  # pragma: no cover
+            pass  # removed by another process; we already have it
+        in_state = np.ones(n_frames, dtype=bool)
+        for (run_start, run_stop) in zip(run_starts, run_stops):
+            in_state[run_start:run_stop] = False
+        return in_state, start, stop
+
+    def save(self, file_name, in_state, start=0, stop=None):
+        """Save the state indicator for a file.
+
+        A partial indicator doesn't replace a complete one.
+
+        Parameters
+        ----------
+        file_name : str
+            the trajectory file
+        in_state : numpy.ndarray of bool
+            the indicator, with a value for each frame of the file
+        start : int
+            first frame for which ``in_state`` is known
+        stop : int or None
+            frame after the last one for which ``in_state`` is known;
+            default (None) is the end of the file
+        """
+        n_frames = len(in_state)
+        if stop is None:
+            stop = n_frames
+        entry_file = self._entry_file(file_name)
+        if start > 0 or stop < n_frames:
+            saved = self.get(file_name)
+            if saved is not None and saved[1] == 0 and saved[2] == n_frames:
+                return
+        run_starts, run_stops = out_of_state_runs(in_state[start:stop])
+        self._write(entry_file, lambda f: np.savez(
+            f, n_frames=n_frames, start=start, stop=stop,
+            run_starts=run_starts + start, run_stops=run_stops + start
+        ))
+        if self.max_bytes is not None:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries, down to ``max_bytes``"""
+        directory = os.path.join(self.cache_dir, 'indicators')
+        entries = []
+        for name in os.listdir(directory):
+            if not name.endswith(".npz"):
+                continue
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except OSError:  # pragma: no cover
+                continue  # removed by another process
+            entries.append((stat.st_mtime_ns, stat.st_size, name))
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, name) in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:  # pragma: no cover
+                pass  # already removed by another process
+            total -= size
@@ -0,0 +1,141 @@
+"""
+Saving to storage in a background thread
+
+Saving each MC step (and syncing the storage to disk) can take as long as
+making the step. The :class:`.StorageWriter` does the saving and syncing in
+a background thread, so that the next steps can be made at the same time.
+
+OPS storage is not thread-safe. While the writer is running, the main
+thread should not use the storage directly: call
+:meth:`.StorageWriter.flush` first, or hold the writer's ``lock`` (which
+the background thread holds while it saves or syncs). This includes
+loading objects through proxies, so the writer can't be used when the
+objects being made refer to stored objects through proxies.
+"""
+
+import queue
+import sys
+import threading
+
+_SAVE = 0
+_SYNC = 1
+_FLUSH = 2
+_STOP = 3
+
+
+class StorageWriter(object):
+    """Save objects and sync a storage in a background thread.
+
+    Requests are handled in order. Requests that are waiting when the
+    thread is ready are handled as a batch, with at most one sync at the end
+    of the batch. Errors in the background thread are raised in the main
+    thread by the next call to :meth:`.save`, :meth:`.sync`, or
+    :meth:`.flush`.
+
+    Parameters
+    ----------
+    storage : openpathsampling.netcdfplus.Storage
+        the storage to write to
+    max_queue : int
+        maximum number of waiting requests; if the queue is full, requests
+        block until there is room (backpressure)
+
+    Attributes
+    ----------
+    lock : threading.RLock
+        held by the background thread while it uses the storage; hold it to
+        use the storage from another thread while the writer is running
+    """
+    def __init__(self, storage, max_queue=100):
+        self.storage = storage
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._error = None
+        self.lock = threading.RLock()
+        self._thread = threading.Thread(target=self._work,
+                                        name="StorageWriter")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _work(self):
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            needs_sync = False
+            flushed = []
+            with self.lock:
+                for (kind, store, obj) in batch:
+                    if kind == _SAVE and self._error is None:
+                        try:
+                            store.save(obj)
+                        except Exception:
+                            self._error = sys.exc_info()
+                    elif kind == _SYNC:
+                        needs_sync = True
+                    elif kind == _FLUSH:
+                        needs_sync = True
+                        flushed.append(obj)
+                    elif kind == _STOP:
+                        stop = True
+
+                if needs_sync and self._error is None:
+                    try:
+                        self.storage.sync_all()
+                    except Exception:
+                        self._error = sys.exc_info()
+
+            for event in flushed:
+                event.set()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error[1].with_traceback(error[2])
+
+    def _put(self, kind, store=None, obj=None):
+        if not self._thread.is_alive():
+            raise RuntimeError("StorageWriter has been closed")
+        self._queue.put((kind, store, obj))
+
+    def save(self, obj, store=None):
+        """Save an object in the background.
+
+        Parameters
+        ----------
+        obj : openpathsampling.netcdfplus.StorableObject
+            the object to save
+        store : openpathsampling.netcdfplus.ObjectStore or None
+            the store to save it in; default (None) uses ``storage.save``
+        """
+        self._raise_error()
+        if store is None:
+            store = self.storage
+        self._put(_SAVE, store, obj)
+
+    def sync(self):
+        """Sync the storage in the background, after the saves so far"""
+        self._raise_error()
+        self._put(_SYNC)
+
+    def flush(self):
+        """Wait until everything so far is saved and synced to disk"""
+        self._raise_error()
+        event = threading.Event()
+        self._put(_FLUSH, obj=event)
+        event.wait()
+        self._raise_error()
+
+    def close(self):
+        """Finish the waiting requests and stop the background thread.
+
+        This doesn't raise errors from the background thread; use
+        :meth:`.flush` first to check for them.
+        """
+        if self._thread.is_alive():
+            self._queue.put((_STOP, None, None))
+            self._thread.join()
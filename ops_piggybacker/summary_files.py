@@ -0,0 +1,181 @@
+"""
+Reading simulation summary files
+
+Summary files have one line per MC step (see
+:mod:`ops_piggybacker.one_way_tps_converters` for the format). They can be
+very long, so they are read one line at a time. Files ending in ``.gz``,
+``.bz2``, or ``.xz`` are decompressed on the fly. Blank lines and comment
+lines (starting with ``#``) are skipped.
+
+A summary file that is still being written by a running simulation can be
+followed with :func:`.follow_summary_lines`, which waits for new lines (and
+their trajectory files) to be complete.
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import time
+
+_openers = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+
+def open_summary_file(file_name):
+    """Open a (possibly compressed) summary file for reading as text.
+
+    Parameters
+    ----------
+    file_name : str
+        the summary file; compression is based on the extension
+
+    Returns
+    -------
+    file-like
+        the file, opened in text mode
+    """
+    for (extension, opener) in _openers.items():
+        if file_name.endswith(extension):
+            return opener(file_name, 'rt')
+    return io.open(file_name, 'r')
+
+
+def is_summary_step_line(line):
+    """Whether a line of a summary file describes an MC step"""
+    stripped = line.strip()
+    return len(stripped) > 0 and not stripped.startswith('#')
+
+
+def summary_lines(file_name):
+    """Iterate over the MC step lines of a summary file.
+
+    Only the current line is kept in memory, and the file is closed when
+    the iteration finishes.
+
+    Parameters
+    ----------
+    file_name : str
+        the summary file
+
+    Yields
+    ------
+    str
+        the lines that describe MC steps
+    """
+    with open_summary_file(file_name) as summary:
+        for line in summary:
+            if is_summary_step_line(line):
+                yield line
+
+
+def wait_for_complete_file(file_name, poll_interval=1.0, timeout=None):
+    """Wait until a file exists and has stopped changing.
+
+    A file is considered complete if its size and modification time are the
+    same at two checks ``poll_interval`` seconds apart.
+
+    Parameters
+    ----------
+    file_name : str
+        the file to wait for
+    poll_interval : float
+        time between checks, in seconds
+    timeout : float or None
+        maximum time to wait, in seconds; None (default) waits forever
+
+    Returns
+    -------
+    bool
+        True if the file is complete, False if the timeout was reached
+    """
+    start = time.time()
+    previous = None
+    while True:
+        if os.path.isfile(file_name):
+            stat = os.stat(file_name)
+            current = (stat.st_size, stat.st_mtime)
+        else:
+            current = None
+        if current is not None and current == previous:
+            return True
+        if timeout is not None and time.time() - start > timeout:
+            return False
+        previous = current
+        time.sleep(poll_interval)
+
+
+def follow_summary_lines(file_name, poll_interval=1.0, timeout=None,
+                         sentinel="# END", data_file=None, n_skip=0):
+    """Iterate over the MC step lines of a summary file as it is written.
+
+    Lines are only used once they are complete (end with a newline). This
+    stops when the ``sentinel`` line is read, or if nothing new happens for
+    longer than ``timeout``. Compressed files can't be followed.
+
+    Parameters
+    ----------
+    file_name : str
+        the summary file; if it doesn't exist yet, wait for it
+    poll_interval : float
+        time between checks for new data, in seconds
+    timeout : float or None
+        stop if there is no new line for this long, in seconds (the time
+        spent using the lines doesn't count); None (default) waits forever
+    sentinel : str or None
+        line (without surrounding whitespace) that marks the end of the
+        summary file; default is ``# END``, which other readers treat as a
+        comment
+    data_file : callable or None
+        function that gives the trajectory file for a line; if given, each
+        line is only used when :func:`.wait_for_complete_file` says its
+        trajectory file is complete
+    n_skip : int
+        number of MC step lines at the beginning to skip (without waiting
+        for their trajectory files)
+
+    Yields
+    ------
+    str
+        the lines that describe MC steps
+    """
+    def timed_out(since):
+        return timeout is not None and time.time() - since > timeout
+
+    last_new = time.time()
+    while not os.path.isfile(file_name):
+        if timed_out(last_new):
+            return
+        time.sleep(poll_interval)
+
+    with io.open(file_name, 'r') as summary:
+        line = ""
+        while True:
+            line += summary.readline()
+            if not line.endswith("\n"):
+                # at the end of what has been written so far
+                if timed_out(last_new):
+                    return
+                time.sleep(poll_interval)
+                continue
+
+            if sentinel is not None and line.strip() == sentinel:
+                return
+            elif is_summary_step_line(line) and n_skip > 0:
+                n_skip -= 1
+            elif is_summary_step_line(line):
+                if data_file is not None:
+                    complete = wait_for_complete_file(
+                        data_file(line), poll_interval,
+                        None if timeout is None
+                        else max(timeout - (time.time() - last_new), 0.0)
+                    )
+                    if not complete:
+                        return
+                yield line
+            line = ""
+            last_new = time.time()
@@ -0,0 +1,86 @@
+import openpathsampling as paths
+from .tools import *
+
+try:
+    import mdtraj as md
+except ImportError:
+    HAS_MDTRAJ = False
+else:
+    HAS_MDTRAJ = True
+    from ops_piggybacker.array_trajectory import *
+    from openpathsampling.engines.openmm.tools import TopologyEngine
+    from openpathsampling.engines.topology import MDTrajTopology
+
+
+class TestArrayTrajectory(object):
+    def setup(self):
+        if not HAS_MDTRAJ:
+            raise SkipTest("Missing MDTraj")
+        topology_file = data_filename("gromacs_1way/dna.gro")
+        self.md_traj = md.load(data_filename("gromacs_1way/fw_rej.xtc"),
+                               top=topology_file)
+        self.engine = TopologyEngine(MDTrajTopology(self.md_traj.topology))
+        self.traj = ArrayTrajectory.from_mdtraj(self.md_traj, self.engine)
+
+    def test_from_mdtraj_does_not_copy(self):
+        assert_true(self.traj.coordinates is self.md_traj.xyz)
+        assert_equal(len(self.traj), len(self.md_traj))
+
+    def test_slice_is_view(self):
+        sliced = self.traj[1:4]
+        assert_equal(len(sliced), 3)
+        assert_true(np.shares_memory(sliced.coordinates,
+                                     self.traj.coordinates))
+        assert_array_almost_equal(sliced.coordinates,
+                                  self.md_traj.xyz[1:4])
+
+    def test_contiguous_index_array_is_view(self):
+        for frames in [np.arange(1, 4), np.arange(3, -1, -1)]:
+            selected = self.traj[frames]
+            assert_true(np.shares_memory(selected.coordinates,
+                                         self.traj.coordinates))
+            assert_array_almost_equal(selected.coordinates,
+                                      self.md_traj.xyz[frames])
+        selected = self.traj[np.array([0, 2])]
+        assert_array_almost_equal(selected.coordinates,
+                                  self.md_traj.xyz[[0, 2]])
+
+    def test_reversed(self):
+        reverse = self.traj.reversed
+        assert_true(reverse.velocities_reversed)
+        assert_true(np.shares_memory(reverse.coordinates,
+                                     self.traj.coordinates))
+        assert_array_almost_equal(reverse.coordinates,
+                                  self.md_traj.xyz[::-1])
+        assert_true(not reverse.reversed.velocities_reversed)
+
+    def test_to_trajectory(self):
+        ops_traj = self.traj[2:5].to_trajectory()
+        assert_true(isinstance(ops_traj, paths.Trajectory))
+        assert_equal(len(ops_traj), 3)
+        for (snap, xyz) in zip(ops_traj, self.md_traj.xyz[2:5]):
+            assert_true(snap.engine is self.engine)
+            assert_array_almost_equal(snap.xyz, xyz)
+        assert_array_almost_equal(ops_traj[0].box_vectors,
+                                  self.md_traj.unitcell_vectors[2])
+        # snapshots don't keep the file's arrays alive
+        assert_true(not np.shares_memory(ops_traj[0].coordinates,
+                                         self.traj.coordinates))
+
+    def test_reversed_to_trajectory(self):
+        forward = self.traj[0:3].to_trajectory()
+        reverse = self.traj[0:3].reversed.to_trajectory()
+        for (snap, fw_snap) in zip(reverse, reversed(forward)):
+            assert_array_almost_equal(snap.xyz, fw_snap.xyz)
+            assert_equal(snap.is_reversed, True)
+
+    def test_snapshot(self):
+        assert_array_almost_equal(self.traj[-1].xyz, self.md_traj.xyz[-1])
+        assert_array_almost_equal(self.traj.snapshot(1).xyz,
+                                  self.md_traj.xyz[1])
+
+    def test_to_mdtraj(self):
+        md_traj = self.traj[1:3].to_mdtraj(self.md_traj.topology)
+        assert_array_almost_equal(md_traj.xyz, self.md_traj.xyz[1:3])
+        assert_array_almost_equal(md_traj.unitcell_vectors,
+                                  self.md_traj.unitcell_vectors[1:3])
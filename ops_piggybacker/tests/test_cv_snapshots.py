@@ -0,0 +1,71 @@
+import openpathsampling as paths
+import ops_piggybacker as oink
+import os
+
+from . import common_test_data as common
+from .tools import *
+from ops_piggybacker.state_cache import file_hash
+from openpathsampling.tests.test_helpers import make_1d_traj
+
+
+class TestCVSnapshots(object):
+    def setup(self):
+        self.sources_file = data_filename("cv_snapshot_sources.txt")
+        self.teardown()
+        self.double_x = paths.FunctionCV("double_x",
+                                         lambda snap: 2 * snap.xyz[0][0])
+        self.cv_snapshots = oink.CVSnapshots(common.tps_network,
+                                             cvs=[self.double_x, common.cv],
+                                             sources_file=self.sources_file)
+        self.traj = make_1d_traj([-0.5, 1.5, 4.5, 10.5])
+        self.file0 = data_filename(os.path.join("one_way_tps_examples",
+                                                "file0.data"))
+        self.file1 = data_filename(os.path.join("one_way_tps_examples",
+                                                "file1.data"))
+
+    def teardown(self):
+        if os.path.isfile(self.sources_file):
+            os.remove(self.sources_file)
+
+    def test_cvs(self):
+        # the state CV is first, and only stored once
+        assert_equal(self.cv_snapshots.cvs, [common.cv, self.double_x])
+
+    def test_trajectory(self):
+        traj = self.cv_snapshots.trajectory(self.file0, [3, 4, 5, 6],
+                                            self.traj)
+        assert_equal(len(traj), 4)
+        x = self.cv_snapshots.column_cv(common.cv)
+        double_x = self.cv_snapshots.column_cv(self.double_x)
+        assert_equal(x.name, "x_column")
+        assert_items_equal(x(traj), [-0.5, 1.5, 4.5, 10.5])
+        assert_items_equal(double_x(traj), [-1.0, 3.0, 9.0, 21.0])
+        assert_equal(self.cv_snapshots.source(traj[2]), (self.file0, 5))
+
+    def test_network(self):
+        network = self.cv_snapshots.network
+        traj = self.cv_snapshots.trajectory(self.file0, range(4),
+                                            self.traj)
+        transition = network.sampling_transitions[0]
+        assert_equal(transition.stateA.name, "left")
+        assert_equal(transition.stateB.name, "right")
+        assert_equal(network.sampling_ensembles[0](traj), True)
+
+    def test_sources_file(self):
+        self.cv_snapshots.trajectory(self.file0, range(4), self.traj)
+        self.cv_snapshots.trajectory(self.file1, range(4), self.traj)
+        self.cv_snapshots.trajectory(self.file0, range(4), self.traj)
+        assert_equal(self.cv_snapshots.files, [self.file0, self.file1])
+        reloaded = oink.CVSnapshots(common.tps_network,
+                                    sources_file=self.sources_file)
+        assert_equal(reloaded.files, [self.file0, self.file1])
+        assert_equal(reloaded.file_number(self.file1), 1)
+        assert_equal(reloaded.file_checksums,
+                     self.cv_snapshots.file_checksums)
+        assert_equal(reloaded.file_checksums[0], file_hash(self.file0))
+
+    @raises(ValueError)
+    def test_unsupported_states(self):
+        # a volume the trimming tools can't batch
+        state = paths.PeriodicCVDefinedVolume(common.cv, 0.0, 1.0, 0.0, 2.0)
+        oink.CVSnapshots(paths.TPSNetwork(state, common.right))
@@ -0,0 +1,85 @@
+import openpathsampling as paths
+import ops_piggybacker as oink
+import os
+import shutil
+
+from .tools import *
+
+try:
+    import mdtraj as md
+except ImportError:
+    HAS_MDTRAJ = False
+else:
+    HAS_MDTRAJ = True
+
+
+class TestExternalFrames(object):
+    def setup(self):
+        if not HAS_MDTRAJ:
+            raise SkipTest("Missing MDTraj")
+        self.data_filename = lambda f : \
+                data_filename(os.path.join("gromacs_1way", f))
+        self.topology_file = self.data_filename("dna.gro")
+        self.initial_file = self.data_filename("initial.xtc")
+        self.copied_file = self.data_filename("initial_copy.xtc")
+        self.sources_file = self.data_filename("sources.txt")
+        self.frame_index_dir = self.data_filename("frame_offsets")
+        self.teardown()
+        self.md_traj = md.load(self.initial_file, top=self.topology_file)
+        from openpathsampling.engines.openmm.tools import \
+                trajectory_from_mdtraj
+        self.ops_traj = trajectory_from_mdtraj(self.md_traj)
+        d_bp = paths.MDTrajFunctionCV("d_bp", md.compute_distances,
+                                      self.ops_traj.topology,
+                                      atom_pairs=[[274, 491]])
+        network = paths.TPSNetwork(
+            paths.CVDefinedVolume(d_bp, 0.0, 0.35).named("bound"),
+            paths.CVDefinedVolume(d_bp, 0.5, float("inf")).named("unbound")
+        )
+        self.cv_snapshots = oink.CVSnapshots(network,
+                                             sources_file=self.sources_file)
+        self.cv_traj = self.cv_snapshots.trajectory(
+            self.initial_file, range(len(self.ops_traj)), self.ops_traj
+        )
+
+    def teardown(self):
+        for file_name in [self.copied_file, self.sources_file]:
+            if os.path.isfile(file_name):
+                os.remove(file_name)
+        if os.path.isdir(self.frame_index_dir):
+            shutil.rmtree(self.frame_index_dir)
+
+    def test_mdtraj(self):
+        frames = oink.ExternalFrames(self.sources_file, self.topology_file,
+                                     chunk_size=3,
+                                     frame_index_dir=self.frame_index_dir)
+        # out of order, and across chunks
+        selected = [self.cv_traj[idx] for idx in [4, 0, 5, 1]]
+        loaded = frames.mdtraj(selected)
+        assert_array_almost_equal(loaded.xyz, self.md_traj.xyz[[4, 0, 5, 1]])
+        assert_array_almost_equal(loaded.unitcell_vectors,
+                                  self.md_traj.unitcell_vectors[[4, 0, 5, 1]])
+
+    def test_snapshot(self):
+        frames = oink.ExternalFrames(self.cv_snapshots, self.topology_file,
+                                     frame_index_dir=self.frame_index_dir)
+        snapshot = frames.snapshot(self.cv_traj[2])
+        assert_array_almost_equal(snapshot.xyz, self.md_traj.xyz[2])
+
+    def test_cache_size(self):
+        frames = oink.ExternalFrames(self.cv_snapshots, self.topology_file,
+                                     cache_size=2, chunk_size=1,
+                                     frame_index_dir=self.frame_index_dir)
+        frames.trajectory(self.cv_traj[:4])
+        assert_equal(list(frames._chunks.keys()), [(0, 2), (0, 3)])
+
+    @raises(RuntimeError)
+    def test_changed_file(self):
+        shutil.copy(self.initial_file, self.copied_file)
+        traj = self.cv_snapshots.trajectory(self.copied_file, [0],
+                                            self.ops_traj[:1])
+        with open(self.copied_file, 'ab') as f:
+            f.write(b"changed")
+        frames = oink.ExternalFrames(self.cv_snapshots, self.topology_file,
+                                     frame_index_dir=self.frame_index_dir)
+        frames.snapshot(traj[0])
@@ -0,0 +1,77 @@
+import shutil
+import tempfile
+
+from .tools import *
+
+try:
+    import mdtraj as md
+except ImportError:
+    HAS_MDTRAJ = False
+else:
+    HAS_MDTRAJ = True
+    from ops_piggybacker.frame_index import *
+
+
+class TestFrameOffsetIndex(object):
+    def setup(self):
+        if not HAS_MDTRAJ:
+            raise SkipTest("Missing MDTraj")
+        self.cache_dir = tempfile.mkdtemp()
+        self.traj_file = data_filename("gromacs_1way/fw_rej.xtc")
+        self.index = FrameOffsetIndex(self.cache_dir)
+
+    def teardown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_can_index(self):
+        assert_true(self.index.can_index(self.traj_file))
+        assert_true(self.index.can_index("traj.TRR"))
+        assert_true(not self.index.can_index("conf.gro"))
+
+    def test_offsets(self):
+        offsets = self.index.offsets(self.traj_file)
+        with md.open(self.traj_file) as f:
+            assert_equal(len(offsets), len(f))
+            assert_items_equal(offsets, f.offsets)
+
+    def test_offsets_are_saved(self):
+        offsets = self.index.offsets(self.traj_file)
+        new_index = FrameOffsetIndex(self.cache_dir)
+
+        def fail(file_name):
+            raise AssertionError("offsets should come from the cache")
+
+        new_index._compute_offsets = fail
+        assert_items_equal(new_index.offsets(self.traj_file), offsets)
+
+    def test_changed_file_is_reindexed(self):
+        traj_file = os.path.join(self.cache_dir, "traj.xtc")
+        shutil.copy(self.traj_file, traj_file)
+        offsets = self.index.offsets(traj_file)
+        # drop the last frame
+        with open(traj_file, 'rb+') as f:
+            f.truncate(int(offsets[-1]))
+        assert_equal(len(self.index.offsets(traj_file)), len(offsets) - 1)
+
+    def test_read(self):
+        md_traj = md.load(self.traj_file,
+                          top=data_filename("gromacs_1way/dna.gro"))
+        assert_equal(self.index.n_frames(self.traj_file), len(md_traj))
+        xyz = self.index.read(self.traj_file, 3, 5)[0]
+        assert_array_almost_equal(xyz, md_traj.xyz[3:5])
+        # the last frames, and past the end
+        n_frames = len(md_traj)
+        xyz = self.index.read(self.traj_file, n_frames - 2, n_frames + 5)[0]
+        assert_array_almost_equal(xyz, md_traj.xyz[-2:])
+
+    def test_read_atom_indices(self):
+        md_traj = md.load(self.traj_file,
+                          top=data_filename("gromacs_1way/dna.gro"))
+        xyz = self.index.read(self.traj_file, 1, 4, atom_indices=[2, 7])[0]
+        assert_array_almost_equal(xyz, md_traj.xyz[1:4, [2, 7]])
+
+    def test_in_memory(self):
+        index = FrameOffsetIndex()
+        offsets = index.offsets(self.traj_file)
+        assert_items_equal(index.offsets(self.traj_file), offsets)
+        assert_equal(os.listdir(self.cache_dir), [])
@@ -0,0 +1,28 @@
+import subprocess
+import sys
+
+from .tools import *
+
+# OPS treats MDTraj and OpenMM as optional; setting a module to None in
+# sys.modules makes importing it fail, as if it weren't installed
+_IMPORT_SCRIPT = """
+import sys
+for name in ['mdtraj', 'openmm', 'simtk']:
+    sys.modules[name] = None
+import openpathsampling as paths
+import ops_piggybacker as oink
+cv = paths.FunctionCV("x", lambda snap: snap.coordinates[0][0])
+left = paths.CVDefinedVolume(cv, float("-inf"), 0.0)
+right = paths.CVDefinedVolume(cv, 10.0, float("inf"))
+ensemble = paths.TPSNetwork(left, right).sampling_ensembles[0]
+oink.ShootingStub(ensemble, pre_joined=False)
+"""
+
+
+class TestImports(object):
+    def test_without_mdtraj_openmm(self):
+        process = subprocess.Popen([sys.executable, "-c", _IMPORT_SCRIPT],
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        output = process.communicate()[0].decode('utf-8', 'replace')
+        assert_equal(process.returncode, 0, output)
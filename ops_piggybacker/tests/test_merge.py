@@ -0,0 +1,117 @@
+import openpathsampling as paths
+import ops_piggybacker as oink
+import os
+
+from . import common_test_data as common
+from .tools import *
+
+
+class TestMergeStorages(object):
+    fnames = ["test_merge_chain_0.nc", "test_merge_chain_1.nc",
+              "test_merge_merged.nc", "test_merge_other_network.nc"]
+
+    def setup(self):
+        self.teardown()
+        setup_storage = paths.Storage(data_filename("tps_setup.nc"), "r")
+        network = setup_storage.networks[0]
+        tps_ensemble = network.sampling_ensembles[0]
+        setup_storage.close()
+
+        # each chain has its own scheme and mimic mover, and its own
+        # trajectories (so no snapshots are shared between the chains)
+        self.network = network
+        self.n_snapshots = []
+        for fname in self.fnames[:2]:
+            (sample, chain_moves) = common.shooting_move_info()
+            initial_sample = paths.Sample(replica=0,
+                                          trajectory=sample.trajectory,
+                                          ensemble=tps_ensemble)
+            moves = [(move[0], move[4], move[2], move[3], move[5])
+                     for move in chain_moves]
+            template = initial_sample.trajectory[0]
+            storage = paths.Storage(data_filename(fname), "w", template)
+            storage.save(template)
+            pseudosim = oink.ShootingPseudoSimulator(
+                storage=storage,
+                initial_conditions=paths.SampleSet([initial_sample]),
+                mover=oink.ShootingStub(tps_ensemble, pre_joined=False),
+                network=network
+            )
+            pseudosim.run(moves)
+            self.n_snapshots.append(len(storage.snapshots))
+            storage.close()
+        self.moves = moves
+        self.template = template
+        self.initial_sample = initial_sample
+
+    def teardown(self):
+        for fname in self.fnames:
+            if os.path.isfile(data_filename(fname)):
+                os.remove(data_filename(fname))
+
+    def test_merge_storages(self):
+        replicas = oink.merge_storages(
+            data_filename(self.fnames[2]),
+            [data_filename(fname) for fname in self.fnames[:2]],
+            chunk_size=4
+        )
+        assert_equal(replicas, {(0, 0): 0, (1, 0): 1})
+
+        merged = paths.Storage(data_filename(self.fnames[2]), "r")
+        merged_x = {snap.__uuid__: common.xval(snap)
+                    for snap in merged.snapshots}
+        assert_equal(len(merged.snapshots), sum(self.n_snapshots))
+        merged.close()
+        for fname in self.fnames[:2]:
+            source = paths.Storage(data_filename(fname), "r")
+            for snap in source.snapshots:
+                assert_equal(merged_x[snap.__uuid__], common.xval(snap))
+            source.close()
+
+        analysis = paths.AnalysisStorage(data_filename(self.fnames[2]))
+        assert_equal(len(analysis.steps), 9)  # initial + 2 * 4 steps
+        assert_equal(len(analysis.schemes), 1)
+        scheme = analysis.schemes[0]
+        assert_equal(len(scheme.movers['shooting']), 1)
+        mover = scheme.movers['shooting'][0]
+
+        devnull = open(os.devnull, 'w')
+        scheme.move_summary(analysis.steps, output=devnull)
+        mover_keys = [k for k in scheme._mover_acceptance._trials.keys()
+                      if k[0] == mover]
+        assert_equal(len(mover_keys), 1)
+        assert_equal(scheme._mover_acceptance._trials[mover_keys[0]], 8)
+        assert_equal(scheme._mover_acceptance._accepted[mover_keys[0]], 6)
+
+        path_lengths = [[len(step.active[replica].trajectory)
+                         for step in analysis.steps]
+                        for replica in [0, 1]]
+        assert_equal(path_lengths, [[11, 9, 7, 7, 7, 7, 7, 7, 7],
+                                    [11, 11, 11, 11, 11, 9, 7, 7, 7]])
+        analysis.close()
+
+    @raises(RuntimeError)
+    def test_mismatched_network(self):
+        state_a = self.network.sampling_transitions[0].stateA
+        cv = state_a.collectivevariable
+        state_b = paths.CVDefinedVolume(cv, 9.5, float("inf")).named("right")
+        network = paths.TPSNetwork(state_a, state_b)
+        tps_ensemble = network.sampling_ensembles[0]
+        storage = paths.Storage(data_filename(self.fnames[3]), "w",
+                                self.template)
+        storage.save(self.template)
+        pseudosim = oink.ShootingPseudoSimulator(
+            storage=storage,
+            initial_conditions=paths.SampleSet([
+                self.initial_sample.copy_reset()
+            ]),
+            mover=oink.ShootingStub(tps_ensemble, pre_joined=False),
+            network=network
+        )
+        pseudosim.run(self.moves)
+        storage.close()
+        oink.merge_storages(
+            data_filename(self.fnames[2]),
+            [data_filename(fname) for fname in [self.fnames[0],
+                                                self.fnames[3]]]
+        )
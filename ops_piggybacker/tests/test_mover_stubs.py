@@ -49,6 +49,17 @@ class TestShootingStub(object):
         joined_4 = self.no_prejoin.join_one_way(joined_2, trial_4, sp_4, dir_4)
         assert_equal(joined_4, out_4)
 
+    def test_join_refers_to_segments(self):
+        moves = common.tps_shooting_moves
+        initial = common.initial_tps_sample.trajectory
+        trial = moves[0][4]
+        joined = self.no_prejoin._join_at_index(initial, trial, 4, -1)
+        assert_equal(joined.segments, [(trial, 0, len(trial)),
+                                       (initial, 4, len(initial))])
+        forward = self.no_prejoin._join_at_index(joined, trial, 3, +1)
+        assert_equal(forward.segments, [(trial, 0, 2), (initial, 4, 6),
+                                        (trial, 0, 2)])
+
     def test_backward_move(self):
         initial_sample = common.initial_tps_sample
         move = common.tps_shooting_moves[0]
@@ -96,6 +107,46 @@ class TestShootingStub(object):
         assert_equal(change.accepted, True)
         assert_equal(type(change.canonical.mover), paths.BackwardShootMover)
 
+    def test_move_with_shooting_index(self):
+        initial_sample = common.initial_tps_sample
+        move = common.tps_shooting_moves[0]
+        shooting_point = initial_sample.trajectory[move[2]]
+        validating = oink.ShootingStub(common.tps_ensemble, pre_joined=False,
+                                       validate=True)
+        for stub in [self.no_prejoin, validating]:
+            change = stub.move(initial_sample, move[4], shooting_point,
+                               move[3], move[5], move[2])
+            assert_items_equal(change.trials[0].trajectory, move[1])
+            assert_equal(type(change.canonical.mover),
+                         paths.BackwardShootMover)
+
+    def test_move_with_direction_pre_joined(self):
+        initial_sample = common.initial_tps_sample
+        move = common.tps_shooting_moves[0]
+        shooting_point = initial_sample.trajectory[move[2]]
+        change = self.stub.move(initial_sample, move[1], shooting_point,
+                                move[3], -1, move[2])
+        assert_equal(change.trials[0].trajectory, move[1])
+        assert_equal(type(change.canonical.mover), paths.BackwardShootMover)
+
+    @raises(RuntimeError)
+    def test_validate_wrong_direction(self):
+        initial_sample = common.initial_tps_sample
+        move = common.tps_shooting_moves[0]
+        shooting_point = initial_sample.trajectory[move[2]]
+        stub = oink.ShootingStub(common.tps_ensemble, validate=True)
+        stub.move(initial_sample, move[1], shooting_point, move[3], +1)
+
+    @raises(RuntimeError)
+    def test_validate_wrong_shooting_index(self):
+        initial_sample = common.initial_tps_sample
+        move = common.tps_shooting_moves[0]
+        shooting_point = initial_sample.trajectory[move[2]]
+        stub = oink.ShootingStub(common.tps_ensemble, pre_joined=False,
+                                 validate=True)
+        stub.move(initial_sample, move[4], shooting_point, move[3], move[5],
+                  move[2] + 1)
+
     def test_forward_move(self):
         init_traj = common.tps_shooting_moves[0][1]
         initial_sample = paths.Sample(replica=0,
@@ -205,6 +256,7 @@ class TestShootingStub(object):
         shooting_point = initial_sample.trajectory[move[2]]
         accepted = True
         direction = move[5]
+        stub = oink.ShootingStub(common.tps_ensemble, validate=True)
 
-        change  = self.stub.move(initial_sample, trial_trajectory,
-                                 shooting_point, accepted, direction)
+        change  = stub.move(initial_sample, trial_trajectory,
+                            shooting_point, accepted, direction)
@@ -4,8 +4,17 @@ import openpathsampling as paths
 from .tools import *
 from . import common_test_data as common
 from openpathsampling.tests.test_helpers import make_1d_traj
+from ops_piggybacker.simulation_stubs import trial_length
+from ops_piggybacker import one_way_tps_converters
+from ops_piggybacker.one_way_tps_converters import (
+    _worker_payload, _init_trim_worker, _trim_in_worker
+)
+import json
 import os.path
+import shutil
 import sys
+import threading
+import time
 
 try:
     import mdtraj as md
@@ -17,7 +26,8 @@ else:
 class StupidOneWayTPSConverter(oink.OneWayTPSConverter):
     """Test-ready subclass"""
     def __init__(self, storage, initial_file, mover, network, options=None,
-                options_rejected=None):
+                options_rejected=None, cv_snapshots=None,
+                precompute_cvs=None):
         self.test_dir = os.path.join(
             os.path.dirname(__file__),
             "test_data", "one_way_tps_examples"
@@ -28,14 +38,25 @@ class StupidOneWayTPSConverter(oink.OneWayTPSConverter):
             mover=mover,
             network=network,
             options=options,
-            options_rejected=options_rejected
+            options_rejected=options_rejected,
+            cv_snapshots=cv_snapshots,
+            precompute_cvs=precompute_cvs
         )
         self.summary_root_dir = ""
 
     def load_trajectory(self, file_name):
+        return self.trajectory_from_data(
+            file_name, self.read_trajectory_data(file_name)
+        )
+
+    def read_trajectory_data(self, file_name):
         f = open(os.path.join(self.test_dir, file_name), "r")
         traj_list = [float(line) for line in f]
-        return make_1d_traj(traj_list)
+        f.close()
+        return traj_list
+
+    def trajectory_from_data(self, file_name, data):
+        return make_1d_traj(data)
 
 
 class TestOneWayTPSConverter(object):
@@ -63,8 +84,11 @@ class TestOneWayTPSConverter(object):
             self.converter.storage.close()
         except RuntimeError:
             pass  # test_run closes this already
-        if os.path.isfile(self.data_filename("output.nc")):
-            os.remove(self.data_filename("output.nc"))
+        for file_name in ["output.nc", "output.nc.checkpoint",
+                          "summary_interrupted.txt", "summary_follow.txt",
+                          "shard_0.npz", "shard_1.npz"]:
+            if os.path.isfile(self.data_filename(file_name)):
+                os.remove(self.data_filename(file_name))
 
     def test_initial_extra_frames_fw_bw(self):
         converter = StupidOneWayTPSConverter(
@@ -229,6 +253,343 @@ class TestOneWayTPSConverter(object):
         self._standard_analysis_checks(analysis)
         analysis.close()
 
+    def test_run_with_prefetch(self):
+        self.converter.run(self.data_filename("summary.txt"), n_prefetch=2)
+        self.converter.storage.close()
+        analysis = paths.AnalysisStorage(self.data_filename("output.nc"))
+        self._standard_analysis_checks(analysis)
+        analysis.close()
+
+    def test_run_with_prefetch_max_bytes(self):
+        self.converter.run(self.data_filename("summary.txt"),
+                           n_trajs_per_block=3, n_prefetch=2,
+                           prefetch_max_bytes=1)
+        self.converter.storage.close()
+        analysis = paths.AnalysisStorage(self.data_filename("output.nc"))
+        self._standard_analysis_checks(analysis)
+        analysis.close()
+
+    def test_run_parallel(self):
+        self.converter.run(self.data_filename("summary.txt"), n_processes=2)
+        self.converter.storage.close()
+        analysis = paths.AnalysisStorage(self.data_filename("output.nc"))
+        self._standard_analysis_checks(analysis)
+        analysis.close()
+
+    def test_worker_converter(self):
+        _init_trim_worker(_worker_payload(self.converter))
+        assert_true(self.converter.storage is not None)
+        worker_converter = one_way_tps_converters._worker_converter
+        assert_equal(worker_converter.storage, None)
+        with open(self.data_filename("summary.txt"), "r") as summary:
+            lines = [l for l in summary]
+        for line in lines:
+            (trial, data) = _trim_in_worker(line)
+            (expected, _) = self.converter.trim_summary_line_data(line)
+            assert_equal(list(trial.frames), list(expected.frames))
+            assert_equal(trial._replace(frames=None),
+                         expected._replace(frames=None))
+
+    def test_run_rejected_endpoints(self):
+        self.converter.rejected_trials = 'endpoints'
+        self.converter.run(self.data_filename("summary.txt"))
+        self.converter.storage.close()
+        analysis = paths.AnalysisStorage(self.data_filename("output.nc"))
+        self._standard_analysis_checks(analysis)
+        steps = analysis.steps
+        assert_equal([trial_length(step) for step in steps[1:]],
+                     [9, 7, 6, 7])
+        rejected = steps[3].change.subchange.subchange
+        assert_equal(len(rejected.trials[0].trajectory), 4)
+        analysis.close()
+
+    def test_trim_frames_rejected_truncated(self):
+        self.converter.rejected_trials = 'truncated'
+        self.converter.rejected_max_frames = 3
+        with open(self.data_filename("summary.txt"), "r") as summary:
+            lines = [l for l in summary]
+        trial = self.converter.trim_summary_line(lines[2])
+        assert_equal(trial.accepted, False)
+        assert_items_equal(trial.frames, [0, 2, 3])
+        assert_equal(trial.n_frames, 4)
+        assert_equal(len(trial.trajectory), 3)
+
+    def test_run_cv_snapshots(self):
+        self.converter.storage.close()
+        cv_snapshots = oink.CVSnapshots(self.network, checksums=False)
+        self.converter = StupidOneWayTPSConverter(
+            storage=paths.Storage(self.data_filename("output.nc"), "w"),
+            initial_file="file0.data",
+            mover=oink.ShootingStub(
+                cv_snapshots.network.sampling_ensembles[0],
+                pre_joined=False
+            ),
+            network=self.network,
+            options=oink.TPSConverterOptions(includes_shooting_point=False,
+                                             trim=False),
+            cv_snapshots=cv_snapshots
+        )
+        # the original CV can be in the same storage as its column CV
+        cv = self.network.sampling_transitions[0].stateA.collectivevariable
+        self.converter.storage.save(cv)
+        self.converter.run(self.data_filename("summary.txt"))
+        self.converter.storage.close()
+        analysis = paths.AnalysisStorage(self.data_filename("output.nc"))
+        self._standard_analysis_checks(analysis)
+        assert_equal(sorted(cv.name for cv in analysis.cvs),
+                     ["x", "x_column"])
+        initial = analysis.steps[0].active[0].trajectory
+        assert_equal(cv_snapshots.source(initial[0]), ("file0.data", 0))
+        assert_equal(cv_snapshots.files[0], "file0.data")
+        analysis.close()
+
+    def test_run_precompute_cvs(self):
+        self.converter.storage.close()
+        cv = self.network.sampling_transitions[0].stateA.collectivevariable
+        self.converter = StupidOneWayTPSConverter(
+            storage=paths.Storage(self.data_filename("output.nc"), "w"),
+            initial_file="file0.data",
+            mover=self.shoot,
+            network=self.network,
+            options=oink.TPSConverterOptions(includes_shooting_point=False,
+                                             trim=False),
+            precompute_cvs=[cv]
+        )
+        self.converter.run(self.data_filename("summary.txt"))
+        self.converter.storage.close()
+        analysis = paths.AnalysisStorage(self.data_filename("output.nc"))
+        self._standard_analysis_checks(analysis)
+        stored_cv = analysis.cvs[cv.name]
+        assert_equal(stored_cv.diskcache_enabled, True)
+        trajectory = analysis.steps[-1].active[0].trajectory
+        assert_array_almost_equal(stored_cv(trajectory),
+                                  [snap.xyz[0][0] for snap in trajectory])
+        analysis.close()
+
+    @raises(ValueError)
+    def test_precompute_cvs_with_cv_snapshots(self):
+        StupidOneWayTPSConverter(
+            storage=None,
+            initial_file="file0.data",
+            mover=self.shoot,
+            network=self.network,
+            cv_snapshots=oink.CVSnapshots(self.network, checksums=False),
+            precompute_cvs=[common.cv]
+        )
+
+    def test_run_async_writer(self):
+        self.converter.async_writer = True
+        self.converter.run(self.data_filename("summary.txt"),
+                           n_trajs_per_block=3)
+        self.converter.storage.close()
+        with open(self.data_filename("output.nc.checkpoint")) as f:
+            assert_equal(json.load(f)['step'], 4)
+        analysis = paths.AnalysisStorage(self.data_filename("output.nc"))
+        self._standard_analysis_checks(analysis)
+        analysis.close()
+
+    def test_run_in_blocks_with_prefetch(self):
+        self.converter.run(self.data_filename("summary.txt"),
+                           n_trajs_per_block=3, n_prefetch=2,
+                           prefetch_max_bytes=1)
+        self.converter.storage.close()
+        analysis = paths.AnalysisStorage(self.data_filename("output.nc"))
+        self._standard_analysis_checks(analysis)
+        analysis.close()
+
+    def test_run_in_blocks_parallel(self):
+        self.converter.run(self.data_filename("summary.txt"),
+                           n_trajs_per_block=3, n_processes=2)
+        self.converter.storage.close()
+        analysis = paths.AnalysisStorage(self.data_filename("output.nc"))
+        self._standard_analysis_checks(analysis)
+        analysis.close()
+
+    def _prepare_shards(self):
+        summary_file = self.data_filename("summary.txt")
+        shards = [self.data_filename("shard_0.npz"),
+                  self.data_filename("shard_1.npz")]
+        assert_equal(self.converter.prepare_shard(summary_file, shards[0],
+                                                  stop_line=2), 2)
+        assert_equal(self.converter.prepare_shard(summary_file, shards[1],
+                                                  start_line=2), 2)
+        return shards
+
+    def test_assemble_shards(self):
+        shards = self._prepare_shards()
+        assert_equal(self.converter.step, 0)
+        self.converter.assemble_shards(shards, n_trajs_per_block=3)
+        self.converter.storage.close()
+        with open(self.data_filename("output.nc.checkpoint")) as f:
+            checkpoint = json.load(f)
+        assert_equal(checkpoint['summary_line'], 4)
+        analysis = paths.AnalysisStorage(self.data_filename("output.nc"))
+        self._standard_analysis_checks(analysis)
+        analysis.close()
+
+    @raises(RuntimeError)
+    def test_assemble_shards_out_of_order(self):
+        shards = self._prepare_shards()
+        self.converter.assemble_shards(shards[::-1])
+
+    def test_run_compressed_summary_with_comments(self):
+        import gzip
+        summary_file = self.data_filename("summary_commented.txt.gz")
+        with open(self.data_filename("summary.txt"), "r") as summary:
+            lines = [l for l in summary]
+        with gzip.open(summary_file, "wt") as summary:
+            summary.write("# file_name shooting_point direction accepted\n")
+            summary.write(lines[0] + "\n")
+            summary.write("".join(lines[1:3]))
+            summary.write("  # a comment\n")
+            summary.write("".join(lines[3:]))
+        self.converter.run(summary_file, n_trajs_per_block=2)
+        self.converter.storage.close()
+        os.remove(summary_file)
+        analysis = paths.AnalysisStorage(self.data_filename("output.nc"))
+        self._standard_analysis_checks(analysis)
+        analysis.close()
+
+    def _retrim_converter(self, mode):
+        shoot = oink.ShootingStub(self.network.sampling_ensembles[0],
+                                  pre_joined=False)
+        return StupidOneWayTPSConverter(
+            storage=paths.Storage(self.data_filename("output.nc"), mode),
+            initial_file="file0_extra.data",
+            mover=shoot,
+            network=self.network,
+            options=oink.TPSConverterOptions(trim=True,
+                                             retrim_shooting=True,
+                                             auto_reverse=True,
+                                             includes_shooting_point=True)
+        )
+
+    def _interrupted_retrim_run(self, n_lines):
+        # fake an interrupted run by converting the first few lines
+        self.converter.storage.close()
+        with open(self.data_filename("summary_extra_retrim.txt")) as f:
+            lines = [l for l in f]
+        with open(self.data_filename("summary_interrupted.txt"), "w") as f:
+            f.write("".join(lines[:n_lines]))
+        converter = self._retrim_converter("w")
+        converter.run(self.data_filename("summary_interrupted.txt"))
+        converter.storage.close()
+
+    def test_checkpoint(self):
+        self._interrupted_retrim_run(2)
+        with open(self.data_filename("output.nc.checkpoint")) as f:
+            checkpoint = json.load(f)
+        assert_equal(checkpoint['step'], 2)
+        assert_equal(checkpoint['summary_line'], 2)
+        assert_equal(checkpoint['summary_file'],
+                     os.path.abspath(
+                         self.data_filename("summary_interrupted.txt")
+                     ))
+        assert_equal(checkpoint['extra_bw_frames'], 4)
+        assert_equal(checkpoint['extra_fw_frames'], 1)
+
+    def test_resume(self):
+        self._interrupted_retrim_run(2)
+        converter = self._retrim_converter("a")
+        converter.resume(self.data_filename("summary_extra_retrim.txt"))
+        converter.storage.close()
+        analysis = paths.AnalysisStorage(self.data_filename("output.nc"))
+        self._standard_analysis_checks(analysis)
+        analysis.close()
+
+    def test_resume_without_checkpoint(self):
+        self._interrupted_retrim_run(3)
+        os.remove(self.data_filename("output.nc.checkpoint"))
+        converter = self._retrim_converter("a")
+        converter.resume(self.data_filename("summary_extra_retrim.txt"),
+                         n_prefetch=2)
+        converter.storage.close()
+        analysis = paths.AnalysisStorage(self.data_filename("output.nc"))
+        self._standard_analysis_checks(analysis)
+        analysis.close()
+
+    def test_follow(self):
+        summary_file = self.data_filename("summary_follow.txt")
+        with open(self.data_filename("summary.txt"), "r") as summary:
+            lines = [l for l in summary]
+
+        def write_summary():
+            for line in lines + ["# END\n"]:
+                time.sleep(0.02)
+                with open(summary_file, "a") as summary:
+                    summary.write(line)
+
+        # follow waits for the trajectory files, so it needs real paths
+        self.converter.summary_root_dir = self.converter.test_dir
+        writer = threading.Thread(target=write_summary)
+        writer.start()
+        self.converter.follow(summary_file, poll_interval=0.005,
+                              timeout=30.0)
+        writer.join()
+        self.converter.storage.close()
+        analysis = paths.AnalysisStorage(self.data_filename("output.nc"))
+        self._standard_analysis_checks(analysis)
+        analysis.close()
+
+    def test_trim_summary_line_does_not_change_state(self):
+        converter = StupidOneWayTPSConverter(
+            storage=None,
+            initial_file="file0_extra.data",
+            mover=self.shoot,
+            network=self.network,
+            options=oink.TPSConverterOptions(trim=True,
+                                             retrim_shooting=True,
+                                             auto_reverse=True,
+                                             includes_shooting_point=True)
+        )
+        summary = open(self.data_filename("summary_extra_retrim.txt"), "r")
+        lines = [l for l in summary]
+        summary.close()
+        trials = [converter.trim_summary_line(l) for l in lines]
+        assert_equal(converter.extra_bw_frames, 3)
+        assert_equal(converter.extra_fw_frames, 4)
+        for (trial, move) in zip(trials, common.tps_shooting_moves):
+            parsed = converter.apply_trimmed_trial(trial)
+            assert_array_almost_equal(parsed[1].coordinates,
+                                      move[4].coordinates)
+            assert_equal(parsed[2], move[2])
+
+    def test_state_cache(self):
+        import shutil
+        import tempfile
+        cache_dir = tempfile.mkdtemp()
+        converter = StupidOneWayTPSConverter(
+            storage=None,
+            initial_file="file0_extra.data",
+            mover=self.shoot,
+            network=self.network,
+            options=oink.TPSConverterOptions(trim=True,
+                                             auto_reverse=True,
+                                             includes_shooting_point=True)
+        )
+        converter.summary_root_dir = converter.test_dir
+        converter.state_cache = oink.StateIndicatorCache(
+            cache_dir, converter.all_states
+        )
+        with open(self.data_filename("summary_extra.txt"), "r") as f:
+            lines = [l for l in f]
+        first_pass = [converter.trim_summary_line(l) for l in lines]
+
+        def no_cv_evaluation(trajectory):
+            raise AssertionError("state indicator should be cached")
+
+        converter.trimmer.in_state = no_cv_evaluation
+        try:
+            for (line, trial) in zip(lines, first_pass):
+                cached = converter.trim_summary_line(line)
+                assert_items_equal(cached.frames, trial.frames)
+                assert_equal(cached.extra_fw_frames, trial.extra_fw_frames)
+                assert_equal(cached.extra_bw_frames, trial.extra_bw_frames)
+                assert_array_almost_equal(cached.trajectory.coordinates,
+                                          trial.trajectory.coordinates)
+        finally:
+            shutil.rmtree(cache_dir)
+
     def test_run_with_negative_shooting_point(self):
         shoot = oink.ShootingStub(self.network.sampling_ensembles[0],
                                   pre_joined=False)
@@ -246,8 +607,9 @@ class TestOneWayTPSConverter(object):
         analysis = paths.AnalysisStorage(self.data_filename("neg_sp.nc"))
         self._standard_analysis_checks(analysis)
         analysis.close()
-        if os.path.isfile(self.data_filename("neg_sp.nc")):
-            os.remove(self.data_filename("neg_sp.nc"))
+        for file_name in ["neg_sp.nc", "neg_sp.nc.checkpoint"]:
+            if os.path.isfile(self.data_filename(file_name)):
+                os.remove(self.data_filename(file_name))
 
     def test_run_with_neg_sp_retrim(self):
         storage_file = self.data_filename("retrim_negsp.nc")
@@ -268,8 +630,9 @@ class TestOneWayTPSConverter(object):
         step4 = analysis.steps[4]
         self._standard_analysis_checks(analysis)
         analysis.close()
-        if os.path.isfile(storage_file):
-            os.remove(storage_file)
+        for file_name in [storage_file, storage_file + ".checkpoint"]:
+            if os.path.isfile(file_name):
+                os.remove(file_name)
 
 class TestGromacsOneWayTPSConverter(object):
     def setup(self):
@@ -306,15 +669,22 @@ class TestGromacsOneWayTPSConverter(object):
             initial_file=initial_file,
             topology_file=topology_file,
             options=acc_options,
-            options_rejected=rej_options
+            options_rejected=rej_options,
+            frame_index_dir=self.data_filename("frame_offsets")
         )
         self.converter.report_progress = sys.stdout
         self.converter.n_trajs_per_block = 1
 
     def teardown(self):
-        self.converter.storage.close()
-        if os.path.exists(self.data_filename("gromacs.nc")):
-            os.remove(self.data_filename("gromacs.nc"))
+        try:
+            self.converter.storage.close()
+        except RuntimeError:
+            pass  # _check_stored_steps closes this already
+        for file_name in ["gromacs.nc", "gromacs.nc.checkpoint"]:
+            if os.path.exists(self.data_filename(file_name)):
+                os.remove(self.data_filename(file_name))
+        if os.path.isdir(self.data_filename("frame_offsets")):
+            shutil.rmtree(self.data_filename("frame_offsets"))
 
 
     def _wc_hg_TPS_network(self, topology):
@@ -332,10 +702,170 @@ class TestGromacsOneWayTPSConverter(object):
         network = paths.TPSNetwork(state_WC, state_HG)
         return network
 
+    def test_load_trajectory_reuses_topology(self):
+        from openpathsampling.engines.openmm.tools import ops_load_trajectory
+        file_name = self.data_filename("fw_rej.xtc")
+        traj_1 = self.converter.load_trajectory(file_name)
+        traj_2 = self.converter.load_trajectory(
+            self.data_filename("bw_acc.xtc")
+        )
+        assert_true(traj_1[0].engine is traj_2[0].engine)
+        assert_true(traj_1[0].engine is self.converter.topology_engine)
+        expected = ops_load_trajectory(file_name,
+                                       top=self.data_filename("dna.gro"))
+        assert_equal(len(traj_1), len(expected))
+        for (snap, expected_snap) in zip(traj_1, expected):
+            assert_array_almost_equal(snap.xyz, expected_snap.xyz)
+            assert_array_almost_equal(snap.box_vectors,
+                                      expected_snap.box_vectors)
+
+    def test_trim_summary_line_matches_ops_trajectory(self):
+        self.converter.summary_root_dir = self.data_filename("")
+        with open(self.data_filename("summary.txt")) as f:
+            lines = [l for l in f if l.strip()]
+        for line in lines:
+            trial = self.converter.trim_summary_line(line)
+            full = self.converter.load_trajectory(trial.file_name)
+            expected = [full[frame] for frame in trial.frames]
+            if trial.reverse:
+                expected = [snap.reversed for snap in expected]
+            assert_equal(len(trial.trajectory), len(expected))
+            for (snap, expected_snap) in zip(trial.trajectory, expected):
+                assert_true(snap.engine is self.converter.topology_engine)
+                assert_array_almost_equal(snap.xyz, expected_snap.xyz)
+
+    def test_trim_atom_indices(self):
+        assert_items_equal(self.converter.trim_atom_indices,
+                           [274, 275, 488, 491, 494])
+        frames = self.converter.load_frames(self.data_filename("fw_rej.xtc"))
+        assert_equal(frames.coordinates.shape[1], 5)
+        full = self.converter.load_trajectory(self.data_filename("fw_rej.xtc"))
+        assert_items_equal(self.converter.trimmer.in_state(frames),
+                           self.converter.trimmer.in_state(full))
+
+    def test_trim_without_atom_subset(self):
+        converter = oink.GromacsOneWayTPSConverter(
+            storage=None,
+            network=self.network,
+            initial_file=self.data_filename("initial.xtc"),
+            topology_file=self.data_filename("dna.gro"),
+            options=self.converter.options,
+            options_rejected=self.converter.options_rejected,
+            atom_subset_trimming=False,
+            frame_index_dir=self.data_filename("frame_offsets")
+        )
+        assert_equal(converter.trim_atom_indices, None)
+        converter.summary_root_dir = self.data_filename("")
+        self.converter.summary_root_dir = self.data_filename("")
+        with open(self.data_filename("summary.txt")) as f:
+            lines = [l for l in f if l.strip()]
+        for line in lines:
+            trial = converter.trim_summary_line(line)
+            subset_trial = self.converter.trim_summary_line(line)
+            assert_items_equal(trial.frames, subset_trial.frames)
+            assert_array_almost_equal(trial.trajectory.xyz,
+                                      subset_trial.trajectory.xyz)
+
+    def _assert_streaming_matches(self, lines):
+        self.converter.summary_root_dir = self.data_filename("")
+        self.converter.stream_chunk_size = 7
+        for line in lines:
+            streamed = self.converter.stream_summary_line(line)
+            assert_true(streamed is not None)
+            self.converter.streaming_trim = False
+            trial = self.converter.trim_summary_line(line)
+            self.converter.streaming_trim = True
+            assert_items_equal(streamed.frames, trial.frames)
+            assert_equal(streamed.extra_fw_frames, trial.extra_fw_frames)
+            assert_equal(streamed.extra_bw_frames, trial.extra_bw_frames)
+            assert_array_almost_equal(streamed.trajectory.xyz,
+                                      trial.trajectory.xyz)
+
+    def test_read_frame_range(self):
+        file_name = self.data_filename("bw_rej.xtc")
+        full = md.load(file_name, top=self.data_filename("dna.gro"))
+        for frame_index in [self.converter.frame_index, None]:
+            self.converter.frame_index = frame_index
+            frames = self.converter.read_frame_range(file_name, 5, 12)
+            assert_array_almost_equal(frames.xyz, full.xyz[5:12])
+            assert_array_almost_equal(frames.unitcell_vectors,
+                                      full.unitcell_vectors[5:12])
+
+    def test_stream_summary_line(self):
+        # rejected trials are trimmed one-way trajectories: streamed from
+        # the beginning (bw_rej is auto-reversed)
+        self._assert_streaming_matches(["fw_rej.xtc 96 FW False",
+                                        "bw_rej.xtc 240 BW False"])
+        # accepted trials are full trajectories: can't be streamed
+        self.converter.summary_root_dir = self.data_filename("")
+        line = "bw_acc.xtc 90 BW True 320"
+        assert_equal(self.converter.stream_summary_line(line), None)
+
+    def test_stream_summary_line_from_end(self):
+        self.converter.options_rejected = oink.TPSConverterOptions(
+            trim=True, auto_reverse=False, includes_shooting_point=True
+        )
+        self._assert_streaming_matches(["bw_rej.xtc 240 BW False"])
+
+    def test_stream_shared_frames(self):
+        # accepted trials are full trajectories: with the shared frames
+        # known from the current path, only the new frames are read
+        self.converter.summary_root_dir = self.data_filename("")
+        self.converter.stream_chunk_size = 7
+        with open(self.data_filename("summary.txt")) as f:
+            lines = [l for l in f if l.strip()]
+        # in bw_acc.xtc, the frames shared with the path start at frame
+        # 1049, not at the shooting point given in the summary file (320)
+        mismatched = lines[2]
+        lines[2] = mismatched.replace(" 320", " 1049")
+        n_streamed = 0
+        for line in lines:
+            n_shared = self.converter.shared_frames(line)
+            self.converter.streaming_trim = False
+            trial = self.converter.trim_summary_line(line)
+            self.converter.streaming_trim = True
+            if line is lines[2]:
+                streamed = self.converter.stream_summary_line(mismatched,
+                                                              n_shared)
+                assert_equal(streamed, None)
+            if n_shared is not None:
+                streamed = self.converter.stream_summary_line(line,
+                                                              n_shared)
+                assert_true(streamed is not None)
+                assert_items_equal(streamed.frames, trial.frames)
+                assert_equal(streamed.extra_fw_frames,
+                             trial.extra_fw_frames)
+                assert_equal(streamed.extra_bw_frames,
+                             trial.extra_bw_frames)
+                assert_array_almost_equal(streamed.trajectory.xyz,
+                                          trial.trajectory.xyz)
+                n_streamed += 1
+            step = self.converter.apply_trimmed_trial(trial)
+            super(oink.OneWayTPSConverter, self.converter).run([step])
+        assert_true(n_streamed > 0)
+
     def test_options_setup(self):
         assert_equal(self.converter.options.full_trajectory, True)
         assert_equal(self.converter.options_rejected.full_trajectory, False)
 
 
+    def _check_stored_steps(self):
+        # same as for the serial run
+        self.converter.storage.close()
+        analysis = paths.AnalysisStorage(self.data_filename("gromacs.nc"))
+        assert_equal([len(step.active[0].trajectory)
+                      for step in analysis.steps], [184, 184, 184, 401])
+        assert_equal([step.change.accepted for step in analysis.steps],
+                     [True, False, False, True])
+        analysis.close()
+
     def test_run(self):
         self.converter.run(self.data_filename("summary.txt"))
+
+    def test_run_with_prefetch(self):
+        self.converter.run(self.data_filename("summary.txt"), n_prefetch=2)
+        self._check_stored_steps()
+
+    def test_run_parallel(self):
+        self.converter.run(self.data_filename("summary.txt"), n_processes=2)
+        self._check_stored_steps()
@@ -0,0 +1,88 @@
+from ops_piggybacker.prefetch import *
+from .tools import *
+
+import threading
+import time
+
+
+class TestDataNbytes(object):
+    def test_array(self):
+        assert_equal(data_nbytes(np.zeros((10, 3))), 240)
+
+    def test_file_size(self):
+        file_name = data_filename("one_way_tps_examples/file1.data")
+        assert_equal(data_nbytes(None, file_name),
+                     os.path.getsize(file_name))
+
+    def test_unknown(self):
+        assert_equal(data_nbytes(None), 0)
+
+
+class TestPrefetcher(object):
+    def setup(self):
+        self.lock = threading.Lock()
+        self.n_running = 0
+        self.max_running = 0
+        self.started = []
+
+    def _slow_zeros(self, item):
+        with self.lock:
+            self.started.append(item)
+            self.n_running += 1
+            self.max_running = max(self.max_running, self.n_running)
+        time.sleep(0.01)
+        with self.lock:
+            self.n_running -= 1
+        return np.zeros(item)
+
+    def test_order_preserved(self):
+        items = list(range(10))
+        prefetcher = Prefetcher(self._slow_zeros, items, n_prefetch=4)
+        results = list(prefetcher)
+        assert_equal([item for (item, result) in results], items)
+        assert_equal([len(result) for (item, result) in results], items)
+
+    def test_queue_depth(self):
+        prefetcher = Prefetcher(self._slow_zeros, range(10), n_prefetch=3)
+        for (item, result) in prefetcher:
+            # never more than n_prefetch items started but not used
+            assert_true(len(self.started) <= item + 3)
+        assert_true(1 < self.max_running <= 3)
+
+    def test_max_bytes(self):
+        prefetcher = Prefetcher(self._slow_zeros, [100] * 5, n_prefetch=5,
+                                max_bytes=1)
+        results = list(prefetcher)
+        assert_equal(len(results), 5)
+        # every result is larger than the cap: only one at a time
+        assert_equal(self.max_running, 1)
+
+    def test_stop_early(self):
+        iterator = iter(Prefetcher(self._slow_zeros, range(10),
+                                   n_prefetch=2))
+        (item, result) = next(iterator)
+        assert_equal(item, 0)
+        iterator.close()
+        time.sleep(0.05)
+        # the queued items were cancelled instead of being run
+        assert_true(len(self.started) <= 3)
+        assert_equal(self.n_running, 0)
+
+    @raises(ValueError)
+    def test_bad_n_prefetch(self):
+        Prefetcher(self._slow_zeros, range(3), n_prefetch=0)
+
+    @raises(RuntimeError)
+    def test_error_raised_in_order(self):
+        def fail_on_two(item):
+            if item == 2:
+                raise RuntimeError("fail")
+            return item
+
+        results = []
+        try:
+            for (item, result) in Prefetcher(fail_on_two, range(5),
+                                             n_prefetch=3):
+                results.append(result)
+        finally:
+            assert_equal(results, [0, 1])
@@ -0,0 +1,72 @@
+import shutil
+import tempfile
+
+from ops_piggybacker.shards import *
+from ops_piggybacker.one_way_tps_converters import TrimmedTrial
+from .tools import *
+
+
+class TestShards(object):
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.shard_file = os.path.join(self.tmp_dir, "shard.npz")
+        self.trials = [
+            TrimmedTrial(replica=0, file_name="file1.data",
+                         frames=[4, 3, 2], reverse=True, trajectory=None,
+                         shooting_index=np.int64(5), accepted=True,
+                         direction=-1, retrim_shooting=False,
+                         extra_bw_frames=2, extra_fw_frames=None),
+            TrimmedTrial(replica=0, file_name="file2.data", frames=[],
+                         reverse=False, trajectory=None, shooting_index=3,
+                         accepted=False, direction=1,
+                         retrim_shooting=False, extra_bw_frames=None,
+                         extra_fw_frames=None)
+        ]
+        self.arrays = [{'xyz': np.arange(18.0).reshape(3, 2, 3),
+                        'box': np.ones((3, 3, 3))},
+                       None]
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self):
+        with ShardWriter(self.shard_file, "summary.txt", 7) as writer:
+            for (trial, arrays) in zip(self.trials, self.arrays):
+                writer.add(trial, arrays)
+
+    def test_shard_info(self):
+        self._write()
+        info = shard_info(self.shard_file)
+        assert_equal(info['summary_file'], "summary.txt")
+        assert_equal(info['start_line'], 7)
+        assert_equal(info['n_trials'], 2)
+
+    def test_read_shard(self):
+        self._write()
+        loaded = list(read_shard(self.shard_file))
+        assert_equal(len(loaded), 2)
+        for ((fields, arrays), trial, truth) in zip(loaded, self.trials,
+                                                    self.arrays):
+            read_trial = TrimmedTrial(trajectory=None, **fields)
+            for field in ['replica', 'file_name', 'reverse',
+                          'shooting_index', 'accepted', 'direction',
+                          'retrim_shooting', 'extra_bw_frames',
+                          'extra_fw_frames']:
+                assert_equal(getattr(read_trial, field),
+                             getattr(trial, field))
+            assert_items_equal(read_trial.frames, trial.frames)
+            if truth is None:
+                assert_equal(arrays, None)
+            else:
+                assert_equal(sorted(arrays), sorted(truth))
+                for key in truth:
+                    assert_array_almost_equal(arrays[key], truth[key])
+
+    def test_interrupted_write(self):
+        try:
+            with ShardWriter(self.shard_file, "summary.txt", 0) as writer:
+                writer.add(self.trials[0], self.arrays[0])
+                raise RuntimeError("interrupted")
+        except RuntimeError:
+            pass
+        assert_equal(os.listdir(self.tmp_dir), [])
@@ -1,10 +1,17 @@
 import openpathsampling as paths
 import ops_piggybacker as oink
+import gc
 import os
 
 from . import common_test_data as common
 from .tools import *
 from openpathsampling.tests.test_helpers import make_1d_traj
+from openpathsampling.netcdfplus import LoaderProxy
+from ops_piggybacker import simulation_stubs
+from ops_piggybacker.simulation_stubs import (
+    rejected_segment_indices, trial_length
+)
+from ops_piggybacker.storage_writer import StorageWriter
 
 class TestShootingPseudoSimulator(object):
     fname="test_pseudo_shoot.nc"
@@ -136,3 +143,165 @@ class TestShootingPseudoSimulator(object):
                         for step in analysis.steps]
         assert_equal(path_lengths, [11, 9, 7, 7, 7])
         analysis.close()
+
+    def test_rejected_segment_indices(self):
+        assert_equal(rejected_segment_indices(5, 1, 'full'), None)
+        assert_equal(rejected_segment_indices(5, 1, 'endpoints'), [0, 4])
+        assert_equal(rejected_segment_indices(5, -1, 'endpoints'), [0, 4])
+        assert_equal(rejected_segment_indices(2, -1, 'endpoints'), None)
+        assert_equal(rejected_segment_indices(5, 1, 'truncated', 3),
+                     [0, 1, 4])
+        assert_equal(rejected_segment_indices(5, -1, 'truncated', 3),
+                     [0, 3, 4])
+        assert_equal(rejected_segment_indices(3, 1, 'truncated', 3), None)
+
+    @raises(ValueError)
+    def test_rejected_segment_indices_bad_policy(self):
+        rejected_segment_indices(5, 1, 'none')
+
+    def _check_rejected_placeholder(self, n_stored):
+        analysis = paths.AnalysisStorage(data_filename(self.fname))
+        steps = analysis.steps
+        assert_equal(len(steps), 5)
+        scheme = analysis.schemes[0]
+        mover = scheme.movers['shooting'][0]
+        devnull = open(os.devnull, 'w')
+        scheme.move_summary(steps, output=devnull)
+        mover_keys = [k for k in scheme._mover_acceptance._trials.keys()
+                      if k[0] == mover]
+        assert_equal(scheme._mover_acceptance._trials[mover_keys[0]], 4)
+        assert_equal(scheme._mover_acceptance._accepted[mover_keys[0]], 3)
+
+        path_lengths = [len(step.active[0].trajectory) for step in steps]
+        assert_equal(path_lengths, [11, 9, 7, 7, 7])
+        assert_equal([trial_length(step) for step in steps[1:]],
+                     [9, 7, 6, 7])
+        rejected = steps[3].change.subchange.subchange
+        assert_equal(len(rejected.trials[0].trajectory), n_stored)
+        # shooting points are still frames of the input trajectory
+        assert_equal(rejected.details.initial_trajectory.index(
+            rejected.details.shooting_snapshot
+        ), 5)
+        analysis.close()
+
+    def test_rejected_endpoints_run_and_analyze(self):
+        moves = [(move[0], move[4], move[2], move[3], move[5])
+                 for move in common.tps_shooting_moves]
+        self.nojoin_pseudosim.rejected_trials = 'endpoints'
+        self.nojoin_pseudosim.run(moves)
+        self.storage.close()
+        # 2 frames of the backward segment, and the 2 shared frames
+        self._check_rejected_placeholder(4)
+
+    def test_rejected_truncated_prejoined_run_and_analyze(self):
+        moves = [tuple(move[0:4]) for move in common.tps_shooting_moves]
+        self.pseudosim.rejected_trials = 'truncated'
+        self.pseudosim.rejected_max_frames = 3
+        self.pseudosim.run(moves)
+        self.storage.close()
+        self._check_rejected_placeholder(5)
+
+    def test_bounded_memory_run_and_analyze(self):
+        moves = [(move[0], move[4], move[2], move[3], move[5])
+                 for move in common.tps_shooting_moves]
+        self.nojoin_pseudosim.bounded_memory = True
+        self.nojoin_pseudosim.run(moves)
+        assert_equal(type(self.nojoin_pseudosim.sample_set[0].parent),
+                     LoaderProxy)
+        self.storage.close()
+        analysis = paths.AnalysisStorage(data_filename(self.fname))
+        assert_equal(len(analysis.steps), 5)
+        path_lengths = [len(step.active[0].trajectory)
+                        for step in analysis.steps]
+        assert_equal(path_lengths, [11, 9, 7, 7, 7])
+        analysis.close()
+
+    def test_async_writer_run_and_analyze(self):
+        moves = [(move[0], move[4], move[2], move[3], move[5])
+                 for move in common.tps_shooting_moves]
+        self.nojoin_pseudosim.async_writer = True
+        self.nojoin_pseudosim.save_frequency = 2
+        self.nojoin_pseudosim.run(moves)
+        assert_equal(self.nojoin_pseudosim._writer, None)
+        self.storage.close()
+        analysis = paths.AnalysisStorage(data_filename(self.fname))
+        assert_equal(len(analysis.steps), 5)
+        path_lengths = [len(step.active[0].trajectory)
+                        for step in analysis.steps]
+        assert_equal(path_lengths, [11, 9, 7, 7, 7])
+        analysis.close()
+
+    def test_async_writer_with_bounded_memory(self):
+        # the writer isn't used with bounded_memory: proxies are loaded from
+        # the storage while the steps are made
+        writers = []
+
+        class RecordingWriter(StorageWriter):
+            def __init__(self, storage, max_queue=100):
+                writers.append(self)
+                super(RecordingWriter, self).__init__(storage, max_queue)
+
+        moves = [(move[0], move[4], move[2], move[3], move[5])
+                 for move in common.tps_shooting_moves]
+        self.nojoin_pseudosim.bounded_memory = True
+        self.nojoin_pseudosim.async_writer = True
+        self.nojoin_pseudosim.save_frequency = 2
+        original_writer = simulation_stubs.StorageWriter
+        simulation_stubs.StorageWriter = RecordingWriter
+        try:
+            self.nojoin_pseudosim.run(moves)
+        finally:
+            simulation_stubs.StorageWriter = original_writer
+        assert_equal(writers, [])
+        assert_equal(type(self.nojoin_pseudosim.sample_set[0].parent),
+                     LoaderProxy)
+        self.storage.close()
+        analysis = paths.AnalysisStorage(data_filename(self.fname))
+        assert_equal(len(analysis.steps), 5)
+        path_lengths = [len(step.active[0].trajectory)
+                        for step in analysis.steps]
+        assert_equal(path_lengths, [11, 9, 7, 7, 7])
+        analysis.close()
+
+    def test_bounded_memory_is_flat(self):
+        # with small caches, snapshots saved here can only be reloaded from
+        # this storage: use a fresh initial trajectory, not the shared one
+        template = self.nojoin_pseudosim.initial_conditions[0].trajectory[0]
+        engine = template.engine
+        initial_trajectory = make_1d_traj(
+            [-0.1, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 9.0, 10.1],
+            engine=engine
+        )
+        pseudosim = oink.ShootingPseudoSimulator(
+            storage=self.storage,
+            initial_conditions=paths.SampleSet([paths.Sample(
+                replica=0,
+                trajectory=initial_trajectory,
+                ensemble=common.tps_ensemble
+            )]),
+            mover=oink.ShootingStub(common.tps_ensemble, pre_joined=False),
+            network=common.tps_network
+        )
+
+        # 10k backward shots that each replace the first 2 frames
+        def moves(first, n_moves):
+            for i in range(first, first + n_moves):
+                yield (0, make_1d_traj([-0.1 - 1e-6 * i, 1.0 + 1e-6 * i],
+                                       engine=engine), 2, True, -1)
+
+        def n_ops_objects():
+            gc.collect()
+            modules = [getattr(type(obj), '__module__', None)
+                       for obj in gc.get_objects()]
+            return len([module for module in modules
+                        if str(module).startswith('openpathsampling')])
+
+        pseudosim.bounded_memory = True
+        pseudosim.save_frequency = 100
+        counts = []
+        for block in range(5):
+            pseudosim.run(moves(2000 * block, 2000))
+            counts.append(n_ops_objects())
+        assert_equal(pseudosim.step, 10000)
+        # the caches are full after the first block; after that, no growth
+        assert_true(max(counts) - min(counts) < 100)
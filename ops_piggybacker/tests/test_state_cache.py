@@ -0,0 +1,78 @@
+import shutil
+import tempfile
+
+import openpathsampling as paths
+
+from ops_piggybacker.state_cache import *
+from . import common_test_data as common
+from .tools import *
+
+
+class TestStateIndicatorCache(object):
+    def setup(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.states = paths.join_volumes([common.left, common.right])
+        self.cache = StateIndicatorCache(self.cache_dir, self.states)
+        self.traj_file = os.path.join(self.cache_dir, "traj.data")
+        with open(self.traj_file, 'w') as f:
+            f.write("some trajectory\n")
+        self.in_state = np.array([True, False, False, True, False, True])
+
+    def teardown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_file_hash(self):
+        copy_file = os.path.join(self.cache_dir, "copy.data")
+        shutil.copy(self.traj_file, copy_file)
+        assert_equal(file_hash(self.traj_file), file_hash(copy_file))
+        assert_equal(self.cache.file_hash(self.traj_file),
+                     file_hash(self.traj_file))
+
+    def test_save_and_get(self):
+        assert_equal(self.cache.get(self.traj_file), None)
+        self.cache.save(self.traj_file, self.in_state)
+        # a new cache object reads what the first one saved
+        cache = StateIndicatorCache(self.cache_dir, self.states)
+        in_state, start, stop = cache.get(self.traj_file)
+        assert_items_equal(in_state, self.in_state)
+        assert_equal((start, stop), (0, 6))
+
+    def test_content_addressed(self):
+        self.cache.save(self.traj_file, self.in_state)
+        copy_file = os.path.join(self.cache_dir, "copy.data")
+        shutil.copy(self.traj_file, copy_file)
+        assert_items_equal(self.cache.get(copy_file)[0], self.in_state)
+        with open(self.traj_file, 'a') as f:
+            f.write("more frames\n")
+        assert_equal(self.cache.get(self.traj_file), None)
+
+    def test_other_states(self):
+        self.cache.save(self.traj_file, self.in_state)
+        cache = StateIndicatorCache(self.cache_dir, common.left)
+        assert_equal(cache.get(self.traj_file), None)
+
+    def test_partial(self):
+        partial = np.array([True, False, False, True, True, True])
+        self.cache.save(self.traj_file, partial, 0, 4)
+        in_state, start, stop = self.cache.get(self.traj_file)
+        assert_items_equal(in_state, partial)
+        assert_equal((start, stop), (0, 4))
+        # complete indicators replace partial ones, but not the reverse
+        self.cache.save(self.traj_file, self.in_state)
+        self.cache.save(self.traj_file, partial, 0, 4)
+        assert_equal(self.cache.get(self.traj_file)[1:], (0, 6))
+
+    def test_evict(self):
+        self.cache.save(self.traj_file, self.in_state)
+        entry_size = sum(
+            os.path.getsize(os.path.join(self.cache_dir, 'indicators', f))
+            for f in os.listdir(os.path.join(self.cache_dir, 'indicators'))
+        )
+        other_file = os.path.join(self.cache_dir, "other.data")
+        with open(other_file, 'w') as f:
+            f.write("another trajectory\n")
+        self.cache.max_bytes = entry_size
+        os.utime(self.cache._entry_file(self.traj_file), (0, 0))
+        self.cache.save(other_file, self.in_state)
+        assert_equal(self.cache.get(self.traj_file), None)
+        assert_true(self.cache.get(other_file) is not None)
@@ -0,0 +1,93 @@
+from ops_piggybacker.storage_writer import *
+from .tools import *
+
+import threading
+import time
+
+
+class RecordingStorage(object):
+    """Stand-in for a storage that records what was saved and synced"""
+    def __init__(self, save_delay=0.0, fail_on=None):
+        self.save_delay = save_delay
+        self.fail_on = fail_on
+        self.calls = []
+        self.thread_names = set()
+
+    def save(self, obj):
+        self.thread_names.add(threading.current_thread().name)
+        time.sleep(self.save_delay)
+        if obj == self.fail_on:
+            raise RuntimeError("failed to save " + str(obj))
+        self.calls.append(('save', obj))
+
+    def sync_all(self):
+        self.calls.append(('sync', None))
+
+
+class TestStorageWriter(object):
+    def test_saves_in_order(self):
+        storage = RecordingStorage()
+        writer = StorageWriter(storage)
+        for i in range(20):
+            writer.save(i)
+        writer.flush()
+        writer.close()
+        saved = [obj for (kind, obj) in storage.calls if kind == 'save']
+        assert_equal(saved, list(range(20)))
+        assert_equal(storage.calls[-1], ('sync', None))
+        assert_equal(storage.thread_names, set(["StorageWriter"]))
+
+    def test_store_argument(self):
+        storage = RecordingStorage()
+        store = RecordingStorage()
+        writer = StorageWriter(storage)
+        writer.save("step", store)
+        writer.flush()
+        writer.close()
+        assert_equal(store.calls, [('save', "step")])
+        assert_equal(storage.calls, [('sync', None)])
+
+    def test_syncs_batched(self):
+        storage = RecordingStorage(save_delay=0.01)
+        writer = StorageWriter(storage)
+        for i in range(10):
+            writer.save(i)
+            writer.sync()
+        writer.flush()
+        writer.close()
+        n_syncs = len([c for c in storage.calls if c[0] == 'sync'])
+        # waiting requests are batched, with one sync per batch
+        assert_true(1 <= n_syncs < 10)
+        saved = [obj for (kind, obj) in storage.calls if kind == 'save']
+        assert_equal(saved, list(range(10)))
+
+    def test_backpressure(self):
+        storage = RecordingStorage(save_delay=0.05)
+        writer = StorageWriter(storage, max_queue=2)
+        start = time.time()
+        for i in range(5):
+            writer.save(i)
+        # can't queue 5 slow saves in a queue of 2 without waiting
+        assert_true(time.time() - start > 0.05)
+        writer.close()
+        assert_equal(len(storage.calls), 5)
+
+    @raises(RuntimeError)
+    def test_error_raised_on_flush(self):
+        storage = RecordingStorage(fail_on=3)
+        writer = StorageWriter(storage)
+        try:
+            for i in range(5):
+                writer.save(i)
+            writer.flush()
+        finally:
+            writer.close()
+            # nothing is saved after an error
+            assert_equal(storage.calls, [('save', 0), ('save', 1),
+                                         ('save', 2)])
+
+    @raises(RuntimeError)
+    def test_closed(self):
+        writer = StorageWriter(RecordingStorage())
+        writer.close()
+        writer.save(0)
@@ -0,0 +1,124 @@
+from ops_piggybacker.summary_files import *
+from .tools import *
+
+import bz2
+import gzip
+import lzma
+import threading
+import time
+
+
+class TestSummaryFiles(object):
+    def setup(self):
+        self.summary = data_filename("one_way_tps_examples/summary.txt")
+        with open(self.summary, "r") as summary:
+            self.lines = [l for l in summary]
+        self.file_names = []
+
+    def teardown(self):
+        for file_name in self.file_names:
+            if os.path.isfile(file_name):
+                os.remove(file_name)
+
+    def _write(self, opener, extension, text):
+        file_name = data_filename("summary_test.txt" + extension)
+        self.file_names.append(file_name)
+        with opener(file_name, "wt") as summary:
+            summary.write(text)
+        return file_name
+
+    def test_uncompressed(self):
+        assert_equal(list(summary_lines(self.summary)), self.lines)
+
+    def test_compressed(self):
+        text = "".join(self.lines)
+        for (opener, extension) in [(gzip.open, ".gz"), (bz2.open, ".bz2"),
+                                    (lzma.open, ".xz")]:
+            file_name = self._write(opener, extension, text)
+            assert_equal(list(summary_lines(file_name)), self.lines)
+
+    def test_skip_blank_and_comments(self):
+        text = ("# header\n" + self.lines[0] + "\n   \n"
+                + "".join(self.lines[1:]) + "  # trailing comment\n")
+        file_name = self._write(open, "", text)
+        assert_equal(list(summary_lines(file_name)), self.lines)
+
+    def test_is_summary_step_line(self):
+        assert_true(is_summary_step_line("file1.data 4 BW True\n"))
+        assert_true(not is_summary_step_line("\n"))
+        assert_true(not is_summary_step_line(" # file1.data 4 BW True"))
+
+
+class TestFollowSummaryLines(object):
+    def setup(self):
+        self.summary = data_filename("summary_follow.txt")
+        self.data_file = data_filename("summary_follow.data")
+        with open(data_filename("one_way_tps_examples/summary.txt")) as f:
+            self.lines = [l for l in f]
+
+    def teardown(self):
+        for file_name in [self.summary, self.data_file]:
+            if os.path.isfile(file_name):
+                os.remove(file_name)
+
+    def _write_later(self, pieces, file_name=None, delay=0.02):
+        if file_name is None:
+            file_name = self.summary
+
+        def write():
+            for piece in pieces:
+                time.sleep(delay)
+                with open(file_name, "a") as f:
+                    f.write(piece)
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        return thread
+
+    def test_sentinel(self):
+        thread = self._write_later(self.lines
+                                   + ["# END\n", "ignored.data 0 FW T\n"])
+        lines = list(follow_summary_lines(self.summary, poll_interval=0.005))
+        thread.join()
+        assert_equal(lines, self.lines)
+
+    def test_timeout(self):
+        thread = self._write_later(self.lines[:2])
+        lines = list(follow_summary_lines(self.summary, poll_interval=0.005,
+                                          timeout=0.2))
+        thread.join()
+        assert_equal(lines, self.lines[:2])
+
+    def test_partial_line(self):
+        line = self.lines[0]
+        thread = self._write_later([line[:5], line[5:], "# END\n"],
+                                   delay=0.05)
+        lines = list(follow_summary_lines(self.summary, poll_interval=0.005))
+        thread.join()
+        assert_equal(lines, [line])
+
+    def test_n_skip(self):
+        with open(self.summary, "w") as f:
+            f.write("".join(self.lines) + "# END\n")
+        lines = list(follow_summary_lines(self.summary, n_skip=3))
+        assert_equal(lines, self.lines[3:])
+
+    def test_wait_for_data_file(self):
+        with open(self.summary, "w") as f:
+            f.write(self.lines[0] + "# END\n")
+        thread = self._write_later(["1.0\n"] * 5, file_name=self.data_file,
+                                   delay=0.01)
+        lines = list(follow_summary_lines(
+            self.summary, poll_interval=0.1,
+            data_file=lambda line: self.data_file
+        ))
+        thread.join()
+        assert_equal(lines, self.lines[:1])
+        with open(self.data_file) as f:
+            # only complete once the writer is done
+            assert_equal(len(f.readlines()), 5)
+
+    def test_wait_for_complete_file_timeout(self):
+        assert_true(not wait_for_complete_file(self.data_file,
+                                               poll_interval=0.01,
+                                               timeout=0.05))
@@ -0,0 +1,101 @@
+from ops_piggybacker.trajectory_segments import *
+import openpathsampling as paths
+from openpathsampling.tests.test_helpers import make_1d_traj
+import os
+
+from .tools import *
+
+
+class TestSegmentedTrajectory(object):
+    def setup(self):
+        self.traj_a = make_1d_traj([0.0, 1.0, 2.0, 3.0, 4.0])
+        self.traj_b = make_1d_traj([10.0, 11.0, 12.0])
+        self.segmented = SegmentedTrajectory([(self.traj_a, 1, 4),
+                                              (self.traj_b, 0, 3)])
+        self.expected = list(self.traj_a[1:4]) + list(self.traj_b)
+
+    def test_len(self):
+        assert_equal(len(self.segmented), 6)
+        assert_equal(len(SegmentedTrajectory()), 0)
+        assert_true(self.segmented.segments is not None)
+
+    def test_getitem(self):
+        for (i, snap) in enumerate(self.expected):
+            assert_equal(self.segmented[i], snap)
+        assert_equal(self.segmented[-1], self.traj_b[-1])
+        assert_equal(self.segmented[-6], self.traj_a[1])
+        assert_true(self.segmented.segments is not None)
+
+    @raises(IndexError)
+    def test_getitem_out_of_range(self):
+        self.segmented[6]
+
+    def test_slice(self):
+        part = self.segmented[2:4]
+        assert_equal(part.segments, [(self.traj_a, 3, 4),
+                                     (self.traj_b, 0, 1)])
+        assert_items_equal(list(part), self.expected[2:4])
+        # a slice with a step needs the flat list
+        assert_items_equal(list(self.segmented[::2]), self.expected[::2])
+        assert_equal(self.segmented.segments, None)
+
+    def test_iter(self):
+        assert_items_equal(list(self.segmented), self.expected)
+        assert_true(self.segmented.segments is not None)
+
+    def test_nested(self):
+        # frames 2 to 4 of segmented: traj_a[3], traj_b[0], traj_b[1]
+        nested = SegmentedTrajectory([(self.segmented, 2, 5),
+                                      (self.traj_a, 0, 1)])
+        assert_equal(nested.segments, [(self.traj_a, 3, 4),
+                                       (self.traj_b, 0, 2),
+                                       (self.traj_a, 0, 1)])
+        assert_items_equal(list(nested), self.expected[2:5] + [self.traj_a[0]])
+        # a flat segmented trajectory is used as it is
+        self.segmented.flatten()
+        nested = SegmentedTrajectory([(self.segmented, 2, 5)])
+        assert_equal(nested.segments, [(self.segmented, 2, 5)])
+
+    def test_flatten(self):
+        self.segmented.flatten()
+        assert_equal(self.segmented.segments, None)
+        assert_equal(len(self.segmented), 6)
+        assert_items_equal(list(self.segmented.iter_proxies()),
+                           self.expected)
+        assert_items_equal(list(self.segmented), self.expected)
+        # the segment trajectories are unchanged
+        assert_equal(len(self.traj_a), 5)
+        assert_equal(len(self.traj_b), 3)
+
+    def test_flatten_keeps_proxies(self):
+        proxies = ['proxy_a', 'proxy_b']
+        trajectory = paths.Trajectory()
+        list.extend(trajectory, proxies)
+        segmented = SegmentedTrajectory([(trajectory, 0, 2)])
+        assert_equal(list(segmented.iter_proxies()), proxies)
+
+    def test_list_methods_flatten(self):
+        flat = paths.Trajectory(self.expected)
+        assert_equal(self.segmented.index(self.traj_b[0]), 3)
+        assert_equal(self.segmented.segments, None)
+        segmented = SegmentedTrajectory([(self.traj_a, 1, 4),
+                                         (self.traj_b, 0, 3)])
+        assert_true(flat == segmented)
+        assert_equal(segmented.segments, None)
+        assert_equal(hash(segmented), hash(flat))
+
+    def test_save(self):
+        fname = data_filename("test_trajectory_segments.nc")
+        if os.path.isfile(fname):
+            os.remove(fname)
+        storage = paths.Storage(fname, "w", self.traj_a[0])
+        storage.save(self.segmented)
+        assert_equal(self.segmented.segments, None)
+        storage.close()
+        storage = paths.Storage(fname, "r")
+        loaded = storage.trajectories[0]
+        assert_equal(type(loaded), paths.Trajectory)
+        assert_equal([snap.coordinates[0][0] for snap in loaded],
+                     [1.0, 2.0, 3.0, 10.0, 11.0, 12.0])
+        storage.close()
+        os.remove(fname)
@@ -0,0 +1,107 @@
+import openpathsampling as paths
+import itertools
+
+from ops_piggybacker.trimming import *
+from . import common_test_data as common
+from .tools import *
+from openpathsampling.tests.test_helpers import make_1d_traj
+
+
+class TestSegmentFunctions(object):
+    def setup(self):
+        all_states = paths.join_volumes([common.left, common.right])
+        in_x = paths.AllInXEnsemble(all_states) & paths.LengthEnsemble(1)
+        out_x = paths.AllOutXEnsemble(all_states)
+        self.fw_ensemble = paths.SequentialEnsemble([out_x, in_x])
+        self.bw_ensemble = paths.SequentialEnsemble([in_x, out_x])
+        self.full_ensemble = paths.SequentialEnsemble([in_x, out_x, in_x])
+        self.trimmer = TrajectoryTrimmer(all_states)
+        # values for: out of state, in left, in right
+        self.values = [5.0, -1.0, 11.0]
+
+    @staticmethod
+    def _as_slices(trajectory, subtrajectories):
+        return [slice(trajectory.index(sub[0]), trajectory.index(sub[-1])+1)
+                for sub in subtrajectories]
+
+    def _all_trajectories(self, max_length):
+        for n_frames in range(1, max_length + 1):
+            for labels in itertools.product([0, 1, 2], repeat=n_frames):
+                # small offset ensures that all snapshots are distinct
+                yield make_1d_traj([self.values[label] + 0.001 * i
+                                    for (i, label) in enumerate(labels)])
+
+    def test_out_of_state_runs(self):
+        starts, stops = out_of_state_runs([True, False, False, True, False])
+        assert_items_equal(starts, [1, 4])
+        assert_items_equal(stops, [3, 5])
+        starts, stops = out_of_state_runs([True, True])
+        assert_equal(len(starts), 0)
+        assert_equal(len(stops), 0)
+
+    def test_in_state(self):
+        traj = make_1d_traj([-0.1, 1.0, 5.0, 10.1, 9.9])
+        assert_items_equal(self.trimmer.in_state(traj),
+                           [True, False, False, True, False])
+
+    def test_segments_match_ensemble_split(self):
+        for traj in self._all_trajectories(5):
+            assert_equal(self.trimmer.forward(traj),
+                         self._as_slices(traj, self.fw_ensemble.split(traj)))
+            assert_equal(self.trimmer.backward(traj),
+                         self._as_slices(traj, self.bw_ensemble.split(traj)))
+            assert_equal(self.trimmer.full(traj),
+                         self._as_slices(traj,
+                                         self.full_ensemble.split(traj)))
+
+    def test_tps_segments_are_full_segments(self):
+        for traj in self._all_trajectories(5):
+            tps_segments = [seg for seg in self.trimmer.full(traj)
+                            if common.tps_ensemble(traj[seg])]
+            assert_equal(tps_segments,
+                         self._as_slices(traj,
+                                         common.tps_ensemble.split(traj)))
+
+
+class TestVolumeIndicator(object):
+    def setup(self):
+        self.n_calls = 0
+
+        def x_array(snapshots):
+            self.n_calls += 1
+            return np.array([snap.coordinates[0][0] for snap in snapshots])
+
+        self.x_array = paths.FunctionCV("x_array", x_array,
+                                        cv_requires_lists=True,
+                                        cv_wrap_numpy_array=True)
+        self.traj = make_1d_traj([-0.5, 0.5, 1.5, 4.0, 9.5, 10.5, 12.0])
+
+    def _check_against_per_frame(self, volume):
+        per_frame = [volume(snap) for snap in self.traj]
+        assert_items_equal(volume_indicator(volume, self.traj), per_frame)
+
+    def test_combinations(self):
+        low = paths.CVDefinedVolume(common.cv, float("-inf"), 1.0)
+        high = paths.CVDefinedVolume(common.cv, 9.0, float("inf"))
+        middle = paths.CVDefinedVolume(self.x_array, 0.0, 10.0)
+        volumes = [
+            low, low | high, low & middle, high ^ middle, middle - low,
+            ~middle, paths.join_volumes([common.left, common.right]),
+            paths.EmptyVolume(), paths.FullVolume()
+        ]
+        for volume in volumes:
+            self._check_against_per_frame(volume)
+
+    def test_cv_evaluated_once(self):
+        state_1 = paths.CVDefinedVolume(self.x_array, 0.0, 1.0)
+        state_2 = paths.CVDefinedVolume(self.x_array, 4.0, 10.0)
+        indicator = volume_indicator(state_1 | state_2, self.traj)
+        assert_items_equal(indicator,
+                           [False, True, False, True, True, False, False])
+        assert_equal(self.n_calls, 1)
+
+    def test_fallback_per_frame(self):
+        periodic = paths.PeriodicCVDefinedVolume(common.cv, 9.0, 1.0,
+                                                 -5.0, 15.0)
+        self._check_against_per_frame(periodic)
+        self._check_against_per_frame(periodic | common.left)
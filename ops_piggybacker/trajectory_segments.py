@@ -0,0 +1,179 @@
+"""
+Trajectories made of segments of other trajectories
+
+A one-way shooting trial shares most of its frames with the previous
+trajectory. Building it with ``old[:idx+1] + new`` copies all the shared
+frames (several times: slicing and adding OPS trajectories each make a new
+list), so each step costs time proportional to the length of the path, even
+though only the new segment changed.
+
+A :class:`.SegmentedTrajectory` is an ``openpathsampling.Trajectory`` that
+starts out as a list of references to segments of other trajectories, so
+joining costs the same no matter how long the shared part is. The length,
+single frames, contiguous slices, and iteration are answered from the
+segments. The frames are only put into the trajectory's own list when it is
+saved (storage asks for its UUID first), or when something else needs the
+flat list (for example, ``index`` or ``==``). Until then, the trajectories
+it refers to must not be changed (OPS trajectories normally aren't).
+"""
+
+import threading
+
+import openpathsampling as paths
+from openpathsampling.netcdfplus import LoaderProxy
+
+# one lock for all flattening: flattening is short, and a trajectory can be
+# saved by a StorageWriter thread while the main thread reads it
+_flatten_lock = threading.Lock()
+
+
+class SegmentedTrajectory(paths.Trajectory):
+    """Trajectory made of segments of other trajectories.
+
+    Segments of a :class:`.SegmentedTrajectory` that isn't flat yet are
+    replaced by the segments it refers to, so joins can be nested without
+    copying frames.
+
+    Parameters
+    ----------
+    segments : list of tuple
+        ``(trajectory, start, stop)`` for each segment, in order; the
+        segment is the frames ``trajectory[start:stop]``
+
+    Attributes
+    ----------
+    segments : list of tuple or None
+        ``(trajectory, start, stop)`` for each (non-empty) segment, with
+        ``0 <= start < stop <= len(trajectory)``; None once the frames are
+        in the trajectory's own list
+    """
+    def __init__(self, segments=None):
+        self._segments = []
+        self._length = 0
+        super(SegmentedTrajectory, self).__init__()
+        if segments is not None:
+            for (trajectory, start, stop) in segments:
+                self._append_segment(trajectory, start, stop)
+
+    @property
+    def segments(self):
+        return self._segments
+
+    @property
+    def __uuid__(self):
+        # storage asks for the UUID before it reads the list of frames
+        self.flatten()
+        return self._uuid
+
+    @__uuid__.setter
+    def __uuid__(self, value):
+        self._uuid = value
+
+    def _append_segment(self, trajectory, start, stop):
+        (start, stop, _) = slice(start, stop).indices(len(trajectory))
+        if stop <= start:
+            return
+        if isinstance(trajectory, LoaderProxy):
+            trajectory = trajectory.__subject__
+        sub_segments = None
+        if isinstance(trajectory, SegmentedTrajectory):
+            sub_segments = trajectory._segments
+        if sub_segments is None:
+            self._segments.append((trajectory, start, stop))
+            self._length += stop - start
+            return
+        offset = 0
+        for (sub_trajectory, sub_start, sub_stop) in sub_segments:
+            sub_length = sub_stop - sub_start
+            first = max(start - offset, 0)
+            last = min(stop - offset, sub_length)
+            if first < last:
+                self._segments.append((sub_trajectory, sub_start + first,
+                                       sub_start + last))
+                self._length += last - first
+            offset += sub_length
+            if offset >= stop:
+                break
+
+    def flatten(self):
+        """Put the frames of the segments in this trajectory's own list.
+
+        Snapshots that are stored as proxies in the segments stay proxies,
+        so they aren't loaded from storage. This does nothing if the
+        trajectory is already flat.
+        """
+        if self._segments is None:
+            return
+        with _flatten_lock:
+            segments = self._segments
+            if segments is None:
+                return
+            frames = []
+            for (trajectory, start, stop) in segments:
+                frames.extend(list.__getitem__(trajectory,
+                                               slice(start, stop)))
+            list.extend(self, frames)
+            self._segments = None
+
+    def __len__(self):
+        if self._segments is None:
+            return list.__len__(self)
+        return self._length
+
+    def __getitem__(self, index):
+        segments = self._segments
+        if segments is None or hasattr(index, '__iter__'):
+            self.flatten()
+            return super(SegmentedTrajectory, self).__getitem__(index)
+        if isinstance(index, slice):
+            (start, stop, step) = index.indices(self._length)
+            if step != 1:
+                self.flatten()
+                return super(SegmentedTrajectory, self).__getitem__(index)
+            return SegmentedTrajectory([(self, start, stop)])
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("SegmentedTrajectory index out of range")
+        for (trajectory, start, stop) in segments:
+            if index < stop - start:
+                return trajectory[start + index]
+            index -= stop - start
+
+    def __iter__(self):
+        segments = self._segments
+        if segments is None:
+            for frame in super(SegmentedTrajectory, self).__iter__():
+                yield frame
+            return
+        for (trajectory, start, stop) in segments:
+            for idx in range(start, stop):
+                yield trajectory[idx]
+
+
+def _flat_first(name):
+    method = getattr(paths.Trajectory, name)
+
+    def flat_method(self, *args, **kwargs):
+        self.flatten()
+        for arg in args:
+            if isinstance(arg, SegmentedTrajectory):
+                arg.flatten()
+        return method(self, *args, **kwargs)
+
+    flat_method.__name__ = name
+    flat_method.__doc__ = method.__doc__
+    return flat_method
+
+
+# everything else that reads (or changes) the list itself needs it flat;
+# properties like ``reversed`` go through these
+for _name in ['__add__', '__contains__', '__delitem__', '__eq__', '__ge__',
+              '__gt__', '__hash__', '__iadd__', '__imul__', '__le__',
+              '__lt__', '__mul__', '__ne__', '__reversed__', '__rmul__',
+              '__setitem__', 'append', 'as_proxies', 'clear', 'copy',
+              'count', 'extend', 'get_as_proxy', 'index', 'insert',
+              'iter_proxies', 'map', 'pop', 'remove', 'reverse', 'sort',
+              'summarize_by_volumes', 'to_dict']:
+    setattr(SegmentedTrajectory, _name, _flat_first(_name))
+del _name
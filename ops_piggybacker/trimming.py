@@ -0,0 +1,506 @@
+"""
+Linear-time trimming of one-way shooting trajectories
+
+The converters need to cut each trial trajectory down to the part that
+could have been generated by TPS. In terms of ensembles, these are the
+subtrajectories found by ``SequentialEnsemble.split`` for ensembles built
+from ``AllOutXEnsemble(states)`` and ``AllInXEnsemble(states) &
+LengthEnsemble(1)``. However, ``split`` is quadratic in the trajectory
+length.
+
+All of those ensembles are fully determined by the per-frame indicator of
+whether a frame is in any state. Every segment they accept is a maximal run
+of frames outside all states, possibly extended by the (in-state) frame
+just before and/or just after it. So once we have the indicator, we can
+find all segments in a single pass.
+
+The segment functions here return lists of ``slice`` objects in the same
+order that ``split`` would return the corresponding subtrajectories.
+
+The indicator itself is evaluated for the whole trajectory at once where
+possible: collective variables are called on the trajectory (which is a
+single call for CVs with ``cv_requires_lists``) and the volume logic is
+done with NumPy. Volumes that can't be handled that way fall back to
+calling the volume on each snapshot. For an :class:`.ArrayTrajectory`,
+``MDTrajFunctionCV`` functions are called directly on the coordinate
+arrays, so no snapshots are made; any other CV is evaluated on the OPS
+version of the trajectory.
+
+If the states only depend on the atoms given to MDTraj geometry functions
+(distances, angles, dihedrals), :func:`.state_atom_indices` finds those
+atoms, and the indicator can be evaluated for an :class:`.ArrayTrajectory`
+with only those atoms loaded.
+"""
+
+import hashlib
+import json
+
+import numpy as np
+import openpathsampling as paths
+from openpathsampling import volume as ops_volume
+from .array_trajectory import ArrayTrajectory
+
+
+class _NotBatchable(Exception):
+    """Raised when a volume can't be evaluated for a whole trajectory"""
+    pass
+
+
+def _cv_values(cv, trajectory, cv_values):
+    # each CV is evaluated only once per trajectory, even if it is used by
+    # several volumes
+    if cv not in cv_values:
+        try:
+            if isinstance(trajectory, ArrayTrajectory):
+                values = _array_cv_values(cv, trajectory)
+            else:
+                values = cv(trajectory)
+            values = np.asarray(values, dtype=float)
+        except (TypeError, ValueError):
+            raise _NotBatchable()
+        if values.size != len(trajectory):
+            raise _NotBatchable()
+        cv_values[cv] = values.reshape(len(trajectory))
+    return cv_values[cv]
+
+
+def _atom_index_kwarg(function):
+    # MDTraj functions that only use the atoms given in one keyword
+    # argument (mdtraj is imported here, so it is only needed when an
+    # MDTrajFunctionCV is used)
+    import mdtraj as md
+    return {
+        md.compute_distances: 'atom_pairs',
+        md.compute_displacements: 'atom_pairs',
+        md.compute_angles: 'angle_indices',
+        md.compute_dihedrals: 'indices',
+    }.get(function)
+
+
+def _cv_atom_indices(cv):
+    # exact type check, because subclasses may redefine _eval
+    if type(cv) is not paths.MDTrajFunctionCV:
+        raise _NotBatchable()
+    key = _atom_index_kwarg(cv.cv_callable)
+    if key is None or key not in cv.kwargs:
+        raise _NotBatchable()
+    return key, np.asarray(cv.kwargs[key], dtype=int)
+
+
+def _subset_cv_kwargs(cv, atom_indices):
+    # the CV's keyword arguments, with atoms renumbered for the subset
+    key, cv_atoms = _cv_atom_indices(cv)
+    subset_atoms = np.searchsorted(atom_indices, cv_atoms)
+    subset_atoms = np.minimum(subset_atoms, len(atom_indices) - 1)
+    if not np.array_equal(atom_indices[subset_atoms], cv_atoms):
+        raise _NotBatchable()
+    kwargs = dict(cv.kwargs)
+    kwargs[key] = subset_atoms
+    return kwargs
+
+
+def _array_cv_values(cv, trajectory):
+    # exact type check, because subclasses may redefine _eval
+    if type(cv) is not paths.MDTrajFunctionCV:
+        raise _NotBatchable()
+    if trajectory.atom_indices is None:
+        md_trajectory = trajectory.to_mdtraj(cv.topology.mdtraj)
+        return cv.cv_callable(md_trajectory, **cv.kwargs)
+    else:
+        kwargs = _subset_cv_kwargs(cv, trajectory.atom_indices)
+        return cv.cv_callable(trajectory.to_mdtraj(), **kwargs)
+
+
+def _volume_cvs(volume):
+    # the CVs of a volume that _batch_volume can evaluate
+    vol_type = type(volume)
+    if vol_type is paths.CVDefinedVolume:
+        return [volume.collectivevariable]
+    elif vol_type in [paths.UnionVolume, paths.IntersectionVolume,
+                      ops_volume.SymmetricDifferenceVolume,
+                      ops_volume.RelativeComplementVolume]:
+        return _volume_cvs(volume.volume1) + _volume_cvs(volume.volume2)
+    elif vol_type is ops_volume.NegatedVolume:
+        return _volume_cvs(volume.volume)
+    elif vol_type in [paths.EmptyVolume, paths.FullVolume]:
+        return []
+    else:
+        raise _NotBatchable()
+
+
+def volume_cvs(volume):
+    """The collective variables a volume depends on.
+
+    Parameters
+    ----------
+    volume : openpathsampling.Volume
+        the volume
+
+    Returns
+    -------
+    list of openpathsampling.CollectiveVariable or None
+        the CVs (each one once, in the order they are found), or None if
+        the volume isn't made of ``CVDefinedVolume`` objects combined in
+        the ways that :func:`.volume_indicator` can evaluate for a whole
+        trajectory
+    """
+    try:
+        cvs = _volume_cvs(volume)
+    except _NotBatchable:
+        return None
+    unique = []
+    for cv in cvs:
+        if not any(cv is known for known in unique):
+            unique.append(cv)
+    return unique
+
+
+def cv_atom_indices(cvs):
+    """Atoms needed to evaluate some collective variables.
+
+    This can only be determined if all the CVs are ``MDTrajFunctionCV``
+    objects for MDTraj geometry functions (``compute_distances``,
+    ``compute_displacements``, ``compute_angles``, or
+    ``compute_dihedrals``).
+
+    Parameters
+    ----------
+    cvs : list of openpathsampling.CollectiveVariable
+        the CVs
+
+    Returns
+    -------
+    numpy.ndarray of int or None
+        sorted atom indices, or None if the atoms can't be determined (or
+        there are no CVs)
+    """
+    try:
+        cv_atoms = [_cv_atom_indices(cv)[1].ravel() for cv in cvs]
+    except _NotBatchable:
+        return None
+    if len(cv_atoms) == 0:
+        return None
+    return np.unique(np.concatenate(cv_atoms))
+
+
+def state_atom_indices(volume):
+    """Atoms needed to decide whether frames are in a volume.
+
+    This can only be determined if all the CVs in the volume are
+    ``MDTrajFunctionCV`` objects for MDTraj geometry functions (see
+    :func:`.cv_atom_indices`), combined in the ways that
+    :func:`.volume_indicator` can evaluate for a whole trajectory.
+
+    Parameters
+    ----------
+    volume : openpathsampling.Volume
+        the volume (usually the union of all states)
+
+    Returns
+    -------
+    numpy.ndarray of int or None
+        sorted atom indices, or None if the atoms can't be determined (or
+        the volume doesn't depend on any atoms)
+    """
+    cvs = volume_cvs(volume)
+    if cvs is None:
+        return None
+    return cv_atom_indices(cvs)
+
+
+def trajectory_cv_values(cv, trajectory):
+    """Evaluate a scalar collective variable for every frame.
+
+    As for :func:`.volume_indicator`, the CV is called on the whole
+    trajectory where possible; for an :class:`.ArrayTrajectory`,
+    ``MDTrajFunctionCV`` functions are called directly on the coordinate
+    arrays (which may have only some of the atoms, if they include the
+    CV's atoms).
+
+    Parameters
+    ----------
+    cv : openpathsampling.CollectiveVariable
+        the CV, which must give one number per frame
+    trajectory : openpathsampling.Trajectory or :class:`.ArrayTrajectory`
+        the trajectory
+
+    Returns
+    -------
+    numpy.ndarray of float
+        the value for each frame
+    """
+    if len(trajectory) == 0:
+        return np.zeros(0)
+    if isinstance(trajectory, ArrayTrajectory):
+        try:
+            return _cv_values(cv, trajectory, cv_values={})
+        except _NotBatchable:
+            trajectory = trajectory.to_trajectory()
+    try:
+        return _cv_values(cv, trajectory, cv_values={})
+    except _NotBatchable:
+        return np.array([float(cv(snap)) for snap in trajectory])
+
+
+def _batch_volume(volume, trajectory, cv_values):
+    # exact type checks, because subclasses may redefine __call__
+    vol_type = type(volume)
+    if vol_type is paths.CVDefinedVolume:
+        values = _cv_values(volume.collectivevariable, trajectory,
+                            cv_values)
+        # same comparisons as CVDefinedVolume.__call__ (incl. for NaN)
+        return (~(volume.lambda_min > values)
+                & ~(volume.lambda_max <= values))
+    elif vol_type is paths.UnionVolume:
+        return (_batch_volume(volume.volume1, trajectory, cv_values)
+                | _batch_volume(volume.volume2, trajectory, cv_values))
+    elif vol_type is paths.IntersectionVolume:
+        return (_batch_volume(volume.volume1, trajectory, cv_values)
+                & _batch_volume(volume.volume2, trajectory, cv_values))
+    elif vol_type is ops_volume.SymmetricDifferenceVolume:
+        return (_batch_volume(volume.volume1, trajectory, cv_values)
+                ^ _batch_volume(volume.volume2, trajectory, cv_values))
+    elif vol_type is ops_volume.RelativeComplementVolume:
+        return (_batch_volume(volume.volume1, trajectory, cv_values)
+                & ~_batch_volume(volume.volume2, trajectory, cv_values))
+    elif vol_type is ops_volume.NegatedVolume:
+        return ~_batch_volume(volume.volume, trajectory, cv_values)
+    elif vol_type is paths.EmptyVolume:
+        return np.zeros(len(trajectory), dtype=bool)
+    elif vol_type is paths.FullVolume:
+        return np.ones(len(trajectory), dtype=bool)
+    else:
+        raise _NotBatchable()
+
+
+def _kwarg_description(value):
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return np.asarray(value).tolist()
+    elif value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    else:
+        return repr(value)
+
+
+def _cv_description(cv):
+    # exact type check, because subclasses may redefine _eval
+    if type(cv) is paths.MDTrajFunctionCV:
+        function = cv.cv_callable
+        kwargs = {key: _kwarg_description(value)
+                  for (key, value) in cv.kwargs.items()}
+        return ['MDTrajFunctionCV', function.__module__,
+                function.__name__, kwargs, cv.topology.n_atoms]
+    else:
+        return ['uuid', str(cv.__uuid__)]
+
+
+def _volume_description(volume):
+    vol_type = type(volume)
+    if vol_type is paths.CVDefinedVolume:
+        return ['CVDefinedVolume', _cv_description(volume.collectivevariable),
+                float(volume.lambda_min), float(volume.lambda_max)]
+    elif vol_type in [paths.UnionVolume, paths.IntersectionVolume,
+                      ops_volume.SymmetricDifferenceVolume,
+                      ops_volume.RelativeComplementVolume]:
+        return [vol_type.__name__, _volume_description(volume.volume1),
+                _volume_description(volume.volume2)]
+    elif vol_type is ops_volume.NegatedVolume:
+        return [vol_type.__name__, _volume_description(volume.volume)]
+    elif vol_type in [paths.EmptyVolume, paths.FullVolume]:
+        return [vol_type.__name__]
+    else:
+        return ['uuid', str(volume.__uuid__)]
+
+
+def volume_fingerprint(volume):
+    """Identifier for what a volume computes.
+
+    Volumes made of ``CVDefinedVolume`` objects (combined in the ways that
+    :func:`.volume_indicator` can evaluate for a whole trajectory) with
+    ``MDTrajFunctionCV`` CVs are described by their structure, bounds, and
+    CV functions, so an equivalent volume made in another session has the
+    same fingerprint. Any other volume or CV is identified by its UUID
+    (which is only the same if it was loaded from the same storage).
+
+    Parameters
+    ----------
+    volume : openpathsampling.Volume
+        the volume
+
+    Returns
+    -------
+    str
+        hex digest identifying the volume
+    """
+    description = ['v1', _volume_description(volume)]
+    encoded = json.dumps(description, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def volume_indicator(volume, trajectory):
+    """Evaluate a volume for every frame of a trajectory.
+
+    Combinations of :class:`openpathsampling.CVDefinedVolume` are
+    evaluated for the whole trajectory at once; any other volume is called
+    on each snapshot.
+
+    Parameters
+    ----------
+    volume : openpathsampling.Volume
+        the volume to evaluate
+    trajectory : openpathsampling.Trajectory or :class:`.ArrayTrajectory`
+        the trajectory to evaluate it for
+
+    Returns
+    -------
+    numpy.ndarray of bool
+        True for frames in the volume
+    """
+    if isinstance(trajectory, ArrayTrajectory):
+        if len(trajectory) > 0:
+            try:
+                return _batch_volume(volume, trajectory, cv_values={})
+            except _NotBatchable:
+                pass
+        trajectory = trajectory.to_trajectory()
+    if len(trajectory) > 0:
+        try:
+            return _batch_volume(volume, trajectory, cv_values={})
+        except _NotBatchable:
+            pass
+    return np.array([bool(volume(snap)) for snap in trajectory],
+                    dtype=bool)
+
+
+def out_of_state_runs(in_state):
+    """Find the maximal runs of frames that are not in any state.
+
+    Parameters
+    ----------
+    in_state : array-like of bool
+        per-frame indicator of whether the frame is in any state
+
+    Returns
+    -------
+    starts : numpy.ndarray of int
+        the index of the first frame of each run
+    stops : numpy.ndarray of int
+        the index one past the last frame of each run
+    """
+    in_state = np.asarray(in_state, dtype=bool)
+    padded = np.concatenate(([0], (~in_state).astype(np.int8), [0]))
+    edges = np.diff(padded)
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+    return starts, stops
+
+
+def forward_segments(in_state):
+    """Segments that leave no state and end on their first in-state frame.
+
+    Equivalent to splitting with ``SequentialEnsemble([AllOutXEnsemble,
+    AllInXEnsemble & LengthEnsemble(1)])``.
+
+    Parameters
+    ----------
+    in_state : array-like of bool
+        per-frame indicator of whether the frame is in any state
+
+    Returns
+    -------
+    list of slice
+        the segments, in trajectory order
+    """
+    n_frames = len(in_state)
+    starts, stops = out_of_state_runs(in_state)
+    return [slice(start, stop + 1)
+            for (start, stop) in zip(starts, stops) if stop < n_frames]
+
+
+def backward_segments(in_state):
+    """Segments that start on an in-state frame and then leave all states.
+
+    Equivalent to splitting with ``SequentialEnsemble([AllInXEnsemble &
+    LengthEnsemble(1), AllOutXEnsemble])``.
+
+    Parameters
+    ----------
+    in_state : array-like of bool
+        per-frame indicator of whether the frame is in any state
+
+    Returns
+    -------
+    list of slice
+        the segments, in trajectory order
+    """
+    starts, stops = out_of_state_runs(in_state)
+    return [slice(start - 1, stop)
+            for (start, stop) in zip(starts, stops) if start > 0]
+
+
+def full_segments(in_state):
+    """Segments that start and end in a state, and are outside in between.
+
+    Equivalent to splitting with ``SequentialEnsemble([AllInXEnsemble &
+    LengthEnsemble(1), AllOutXEnsemble, AllInXEnsemble &
+    LengthEnsemble(1)])``.
+
+    Parameters
+    ----------
+    in_state : array-like of bool
+        per-frame indicator of whether the frame is in any state
+
+    Returns
+    -------
+    list of slice
+        the segments, in trajectory order
+    """
+    n_frames = len(in_state)
+    starts, stops = out_of_state_runs(in_state)
+    return [slice(start - 1, stop + 1)
+            for (start, stop) in zip(starts, stops)
+            if start > 0 and stop < n_frames]
+
+
+class TrajectoryTrimmer(object):
+    """Find trimming boundaries for trajectories based on a set of states.
+
+    Parameters
+    ----------
+    states : openpathsampling.Volume
+        volume that is the union of all the states
+    """
+    def __init__(self, states):
+        self.states = states
+
+    def in_state(self, trajectory):
+        """Per-frame indicator of whether the frame is in any state.
+
+        Parameters
+        ----------
+        trajectory : openpathsampling.Trajectory or :class:`.ArrayTrajectory`
+            the trajectory to evaluate
+
+        Returns
+        -------
+        numpy.ndarray of bool
+            True for frames in any state
+        """
+        return volume_indicator(self.states, trajectory)
+
+    def forward(self, trajectory):
+        """Forward segments of ``trajectory``; see :func:`.forward_segments`
+        """
+        return forward_segments(self.in_state(trajectory))
+
+    def backward(self, trajectory):
+        """Backward segments of ``trajectory``; see
+        :func:`.backward_segments`
+        """
+        return backward_segments(self.in_state(trajectory))
+
+    def full(self, trajectory):
+        """Full TPS-like segments of ``trajectory``; see
+        :func:`.full_segments`
+        """
+        return full_segments(self.in_state(trajectory))
@@ -104,6 +104,7 @@ def buildKeywordDictionary():
     setupKeywords["platforms"]         = ["Linux", "Mac OS X", "Windows"]
     setupKeywords["description"]       = "Blah"
     setupKeywords["requires"]          = ["openpathsampling", "nose"]
+    setupKeywords["python_requires"]   = ">=3.6"
     setupKeywords["long_description"]  = """Blah
     """
     outputString=""